@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: adaptive.py
+Description: 根据观测到的延迟和错误自适应调整抓取并发（AIMD），下载失败的 url 按指数退避加随机抖动
+             重新放回 frontier，持续失败的 host 由熔断器暂停
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import logging
+import random
+import threading
+import time
+
+import downloader
+import metrics
+import scheduler
+
+# 延迟的快、慢两条指数滑动平均，快线明显高于慢线视为拥塞
+FAST_ALPHA = 0.3
+SLOW_ALPHA = 0.02
+# 延迟样本数不足时不根据延迟判断拥塞
+MIN_LATENCY_SAMPLES = 10
+# 两次乘性减小的最短间隔（秒），避免同一批并发请求的失败把 limit 连续减半
+DECREASE_INTERVAL = 1.0
+# 新 host 的初始并发数，之后按成功的请求逐步增加
+INITIAL_HOST_LIMIT = 2
+BREAKER_MAX_COOLDOWN = 600.0
+# 熔断连续打开超过此次数（中间没有成功的请求）的 host 被放弃，其余 url 不再请求直接失败
+BREAKER_MAX_TRIPS = 3
+
+
+def is_retryable(error):
+    """
+    check whether a download error is worth retrying: 网络错误、超时、5xx 和 429 可重试，
+    其它 4xx、url 编码错误和超过大小限制的 body 不可重试
+
+    Args:
+        error: urllib2 / httplib / socket / tornado 抛出的异常
+    """
+    if error is None or isinstance(error, (downloader.BodyTooLargeError, ValueError)):
+        return False
+    code = getattr(error, 'code', None)
+    # tornado 用 599 表示没有收到响应
+    if not isinstance(code, int) or code == 599:
+        return True
+    return code == 429 or code >= 500
+
+
+def get_retry_after(error):
+    """
+    get seconds of the Retry-After header of an HTTP error, 不支持 HTTP-date 格式
+
+    Returns:
+        秒数，没有该响应头时返回 None
+    """
+    value = None
+    headers = getattr(error, 'hdrs', None)
+    response = getattr(error, 'response', None)
+    if headers is not None:
+        value = headers.getheader('retry-after')
+    elif response is not None:
+        value = response.headers.get('Retry-After')
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class AimdLimit(object):
+    """
+    Additive-increase / multiplicative-decrease concurrency limit, 调用方负责加锁
+
+    Attributes:
+        limit     : 当前并发上限（浮点数），每个成功的请求增加 1 / limit，
+                    即每一轮（limit 个请求）增加 1
+        min_limit : 下限
+        max_limit : 上限
+        backoff   : 拥塞时的乘数
+    """
+    def __init__(self, initial, min_limit, max_limit, backoff=0.5, clock=time.time):
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.clock = clock
+        self.last_decrease = None
+
+
+    def increase(self):
+        self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+
+    def decrease(self):
+        """
+        multiply limit by backoff, DECREASE_INTERVAL 内只减小一次
+
+        Returns:
+            True/False: 是否减小
+        """
+        now = self.clock()
+        if self.last_decrease is not None and now - self.last_decrease < DECREASE_INTERVAL:
+            return False
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        self.last_decrease = now
+        return True
+
+
+    def get(self):
+        return int(self.limit)
+
+
+class LatencyTracker(object):
+    """
+    Fast and slow EWMA of latency, 快线超过慢线 factor 倍时判定为拥塞, 调用方负责加锁
+    """
+    def __init__(self, factor):
+        self.factor = factor
+        self.fast = None
+        self.slow = None
+        self.sample_num = 0
+
+
+    def observe(self, latency):
+        """
+        add a latency sample
+
+        Returns:
+            True/False: 是否拥塞
+        """
+        if self.fast is None:
+            self.fast = self.slow = latency
+        else:
+            self.fast += FAST_ALPHA * (latency - self.fast)
+            self.slow += SLOW_ALPHA * (latency - self.slow)
+        self.sample_num += 1
+        return self.sample_num >= MIN_LATENCY_SAMPLES and self.fast > self.factor * self.slow
+
+
+class HostState(object):
+    """
+    Adaptive state of one host
+
+    Attributes:
+        limit      : 该 host 的 AimdLimit
+        latency    : 该 host 的 LatencyTracker
+        applied    : 已设置到 frontier 的并发上限
+        failures   : 连续失败的请求数
+        trips      : 熔断器连续打开的次数
+        open_until : 熔断器打开（暂停该 host）到此时间，之后半开：只放行一个请求
+        given_up   : 是否已放弃该 host
+    """
+    def __init__(self, limit, latency):
+        self.limit = limit
+        self.latency = latency
+        self.applied = None
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0
+        self.given_up = False
+
+
+class AdaptiveController(object):
+    """
+    Adjust global and per-host concurrency from observed latency and errors, thread-safe.
+
+    每个请求结束后调用 record：成功且延迟正常时加性增加，出错（可重试的错误）或延迟
+    明显升高时乘性减小。per-host 上限通过 frontier 的 set_concurrency 生效；全局上限
+    限制同时处于抓取中的 worker 数，只按所有请求的延迟调整，单个 host 的错误不影响全局。
+
+    Attributes:
+        frontiers          : 需要同步 per-host 并发和暂停的 HostScheduler 列表
+        max_concurrency    : 全局并发上限（抓取线程数或协程数）
+        max_host_concurrency: 缺省的 host 并发上限，0 表示 max_concurrency
+        host_concurrency   : host -> 配置的并发上限
+        try_times          : 每个 url 最多下载的次数（含重试）
+        retry_base_delay   : 第一次重试的最大等待时间（秒），之后每次翻倍
+        retry_max_delay    : 重试等待时间的上限（秒）
+        breaker_threshold  : 连续失败多少次打开熔断器，0 表示不熔断
+        breaker_cooldown   : 第一次熔断暂停的秒数，之后每次翻倍
+        retry_num          : 已调度的重试次数
+        trip_num           : 熔断器打开的次数
+        given_up_num       : 被放弃的 host 数
+    """
+    def __init__(self, frontiers, max_concurrency, max_host_concurrency=0, host_concurrency=None,
+                 try_times=3, retry_base_delay=1.0, retry_max_delay=60.0, breaker_threshold=5,
+                 breaker_cooldown=30.0, latency_factor=2.0, clock=time.time, rand=random.random):
+        self.frontiers = frontiers
+        self.max_concurrency = max_concurrency
+        self.max_host_concurrency = max_host_concurrency
+        self.host_concurrency = dict(host_concurrency or {})
+        self.try_times = try_times
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.latency_factor = latency_factor
+        self.clock = clock
+        self.rand = rand
+        self.hosts = {}
+        self.global_limit = AimdLimit(max_concurrency, 1, max_concurrency, clock=clock)
+        self.global_latency = LatencyTracker(latency_factor)
+        self.inflight = 0
+        self.retry_num = 0
+        self.trip_num = 0
+        self.given_up_num = 0
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(threading.Lock())
+
+
+    def acquire(self):
+        """
+        wait until the number of active workers is below the global limit
+        """
+        with self.cond:
+            while self.inflight >= self.global_limit.get():
+                self.cond.wait()
+            self.inflight += 1
+
+
+    def try_acquire(self):
+        """
+        non-blocking acquire, 用于异步引擎
+
+        Returns:
+            True/False: 是否获得名额
+        """
+        with self.cond:
+            if self.inflight >= self.global_limit.get():
+                return False
+            self.inflight += 1
+            return True
+
+
+    def release(self):
+        with self.cond:
+            self.inflight -= 1
+            self.cond.notify()
+
+
+    def get_state(self, host):
+        """
+        get state of host, 不存在时创建，调用方需持有 self.lock
+        """
+        state = self.hosts.get(host)
+        if state is None:
+            max_limit = (self.host_concurrency.get(host, self.max_host_concurrency) or
+                         self.max_concurrency)
+            state = HostState(AimdLimit(INITIAL_HOST_LIMIT, 1, max_limit, clock=self.clock),
+                              LatencyTracker(self.latency_factor))
+            self.hosts[host] = state
+        return state
+
+
+    def is_given_up(self, url):
+        """
+        whether the host of url has been given up by the circuit breaker
+        """
+        host = scheduler.get_host(url)
+        with self.lock:
+            state = self.hosts.get(host)
+            return state is not None and state.given_up
+
+
+    def record(self, url, latency, error):
+        """
+        record the result of a request and adjust limits
+
+        Args:
+            url     : 请求的 url
+            latency : 收到响应头的耗时（秒），不可比较时（如流式保存）为 None
+            error   : 请求失败时的异常，成功时为 None
+        """
+        host = scheduler.get_host(url)
+        failed = is_retryable(error)
+        pause_until = None
+        with self.lock:
+            state = self.get_state(host)
+            now = self.clock()
+            congested = failed
+            if latency is not None and error is None:
+                congested = state.latency.observe(latency)
+                with self.cond:
+                    if self.global_latency.observe(latency):
+                        self.global_limit.decrease()
+                    else:
+                        self.global_limit.increase()
+                        self.cond.notify()
+            if congested:
+                state.limit.decrease()
+            else:
+                state.limit.increase()
+
+            # 熔断器：暂停期间结束的请求不计入，半开时一次失败即重新打开
+            if failed and now >= state.open_until:
+                state.failures += 1
+                if state.failures >= self.breaker_threshold > 0 or (
+                        state.trips > 0 and state.failures > 0):
+                    pause_until = self.trip(host, state, now)
+            elif not failed:
+                # 不可重试的错误（如 404）也说明 host 能正常响应
+                state.failures = 0
+                state.trips = 0
+            limit = state.limit.get()
+            if limit == state.applied:
+                limit = None
+            else:
+                state.applied = limit
+        if limit is not None:
+            for frontier in self.frontiers:
+                frontier.set_concurrency(host, limit)
+        if pause_until is not None:
+            for frontier in self.frontiers:
+                frontier.pause(host, pause_until)
+
+
+    def trip(self, host, state, now):
+        """
+        open the circuit breaker of host, 调用方需持有 self.lock
+
+        Returns:
+            暂停到的时间
+        """
+        cooldown = min(BREAKER_MAX_COOLDOWN, self.breaker_cooldown * 2 ** state.trips)
+        state.trips += 1
+        state.failures = 0
+        state.open_until = now + cooldown
+        # 恢复后从一个并发开始（半开）
+        state.limit.limit = state.limit.min_limit
+        self.trip_num += 1
+        metrics.incr('breaker_trips')
+        if state.trips > BREAKER_MAX_TRIPS:
+            state.given_up = True
+            self.given_up_num += 1
+            logging.warn(' * Give up host after %d breaker trips: %s' % (state.trips - 1, host))
+            return now
+        logging.warn(' * Pause host for %.1fs after repeated failures: %s' % (cooldown, host))
+        return state.open_until
+
+
+    def retry_delay(self, url_obj, error):
+        """
+        get the delay before retrying a failed url, 指数退避加完全随机抖动（full jitter），
+        服务端给出 Retry-After 时至少等待该时间
+
+        Returns:
+            等待秒数，不应重试（错误不可重试、次数用尽或 host 已放弃）时返回 None
+        """
+        if not is_retryable(error) or url_obj.get_retry_num() + 1 >= self.try_times:
+            return None
+        if self.is_given_up(url_obj.get_url()):
+            return None
+        delay = self.rand() * min(self.retry_max_delay,
+                                  self.retry_base_delay * 2 ** url_obj.get_retry_num())
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.retry_max_delay))
+        with self.lock:
+            self.retry_num += 1
+        metrics.incr('retries')
+        return delay
@@ -0,0 +1,501 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: async_engine.py
+Description: 基于 tornado 事件循环的异步抓取引擎，单线程驱动大量并发下载，
+             可替代 CrawlerThread 线程池（engine = async）
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import Queue
+import datetime
+import logging
+import socket
+import time
+
+from tornado import gen
+from tornado import httpclient
+from tornado import ioloop
+from tornado import locks
+from tornado import netutil
+
+import compression
+import html_parser
+import metrics
+import robots
+
+# 多节点抓取时检查全局终止的间隔，单机时分发循环只由 frontier 的通知唤醒
+CLUSTER_POLL_INTERVAL = 0.1
+
+
+class StreamDecoder(object):
+    """
+    Decode a response body by its Content-Encoding as tornado streams it in.
+
+    tornado 自带的解压只支持 gzip 且不限制解压后的大小，所以请求时关闭 decompress_response，
+    通过 header_callback 取得 Content-Encoding，在 streaming_callback 中边收边解压。
+
+    Attributes:
+        max_size : 解压前、解压后 body 的最大字节数
+        sink     : 解压后数据的回调，None 时保留在内存中，由 finish 返回
+        encoding : 最终响应（跟随重定向之后）的 Content-Encoding
+        decoder  : 收到第一块 body 时创建的 ContentDecoder
+        error    : 解压失败或超过大小限制时的异常，由 finish 抛出
+    """
+    def __init__(self, max_size, sink=None):
+        self.max_size = max_size
+        self.sink = sink
+        self.encoding = None
+        self.decoder = None
+        self.error = None
+        self.parts = []
+
+
+    def on_header(self, line):
+        """
+        header_callback, 每次传入一行响应头
+        """
+        if line.lower().startswith('content-encoding:'):
+            self.encoding = line.split(':', 1)[1].strip()
+
+
+    def on_chunk(self, chunk):
+        """
+        streaming_callback, 回调中抛出的异常会被 tornado 当作连接断开（可重试）处理，
+        所以出错后只记录异常并丢弃剩余数据，线上字节数仍受 tornado 的 max_body_size 限制
+        """
+        if self.error is not None:
+            return
+        try:
+            if self.decoder is None:
+                self.decoder = compression.ContentDecoder(self.encoding, self.max_size)
+            self.write(self.decoder.decode(chunk))
+        except IOError as e:
+            self.error = e
+
+
+    def write(self, data):
+        if not data:
+            return
+        if self.sink is None:
+            self.parts.append(data)
+        else:
+            self.sink(data)
+
+
+    def finish(self):
+        """
+        flush the decoder at the end of the body
+
+        Returns:
+            解压后的 body，指定了 sink 时为空串
+
+        Raises:
+            BodyTooLargeError/IOError: 解压失败或超过大小限制
+        """
+        if self.error is not None:
+            raise self.error
+        if self.decoder is None:
+            self.decoder = compression.ContentDecoder(self.encoding, self.max_size)
+        self.write(self.decoder.flush())
+        return ''.join(self.parts)
+
+
+    def count(self):
+        """
+        add wire and decoded bytes to metrics
+        """
+        if self.decoder is not None:
+            metrics.incr('bytes_downloaded', self.decoder.wire_size)
+            metrics.incr('bytes_decoded', self.decoder.decoded_size)
+
+
+class CachingResolver(netutil.Resolver):
+    """
+    tornado resolver backed by the shared DnsCache, 未命中时在线程池中解析，不阻塞事件循环
+    """
+    def initialize(self, dns_cache):
+        self.dns_cache = dns_cache
+
+
+    @gen.coroutine
+    def resolve(self, host, port, family=socket.AF_UNSPEC):
+        addrinfo = yield ioloop.IOLoop.current().run_in_executor(None, self.dns_cache.resolve,
+                                                                 host, port)
+        raise gen.Return([(info[0], info[4]) for info in addrinfo
+                          if family == socket.AF_UNSPEC or info[0] == family])
+
+
+class AsyncCrawler(object):
+    """
+    This class crawls pages with coroutines on a single event loop.
+
+    与 CrawlerThread 使用相同的配置项、相同的 process_response 回调语义
+    (flag 0/1/-1/2) 以及相同的输出目录布局。
+
+    Attributes:
+        checking_urls   : 待爬取 URL 的 host 调度器（与线程引擎共享）
+        process_response: response callback
+        process_retry   : retry callback process_retry(url_obj, delay)
+        concurrency     : 并发抓取的协程数
+        output_dir      : 存放爬取页面的目录
+        target_store    : target 文件的存储（flat / cas 布局）
+        crawl_interval  : 爬取间隔
+        crawl_timeout   : 爬取时间延迟
+        url_pattern     : 目标文件链接格式
+        max_depth       : 爬取最大深度
+        tag_dict        : 链接标签字典
+        try_times       : 下载尝试次数
+        max_body_size   : 响应 body 的最大字节数
+        parser          : html 解析后端
+        dns_cache       : 共享的 DNS 缓存，None 时使用 tornado 缺省的 resolver
+        cluster         : 多节点抓取时本节点的 ClusterNode，单机时为 None
+        with_fingerprint: 解析时是否计算页面的 SimHash 指纹
+        robots_cache    : robots.txt 规则缓存，None 表示不遵守 robots.txt
+        adaptive        : 自适应并发与重试控制器，None 表示在 fetch 中立即重试
+        accounted_ids   : 抓取中、已回调 process_response / process_retry 的 url 对象的 id
+    """
+    def __init__(self, checking_urls, process_response, args_dict, concurrency,
+                 process_retry=None):
+        self.checking_urls = checking_urls
+        self.process_response = self.track(process_response)
+        self.process_retry = self.track(process_retry) if process_retry is not None else None
+        self.accounted_ids = set()
+        self.concurrency = concurrency
+        self.output_dir = args_dict['output_dir']
+        self.target_store = args_dict['target_store']
+        self.crawl_interval = args_dict['crawl_interval']
+        self.crawl_timeout = args_dict['crawl_timeout']
+        self.url_pattern = args_dict['url_pattern']
+        self.max_depth = args_dict['max_depth']
+        self.tag_dict = args_dict['tag_dict']
+        self.try_times = args_dict['try_times']
+        self.max_body_size = args_dict['max_body_size']
+        self.parser = args_dict['parser']
+        self.dns_cache = args_dict['dns_cache']
+        self.cluster = args_dict['cluster']
+        self.with_fingerprint = args_dict['with_fingerprint']
+        self.robots_cache = args_dict['robots_cache']
+        self.adaptive = args_dict['adaptive']
+        # robots.txt url -> 正在抓取它的 Future，同一 host 只抓取一次
+        self.robots_fetching = {}
+        self.http_client = None
+        self.io_loop = None
+        # frontier 有新的就绪 url、任务完成或抓取协程结束时通知分发循环
+        self.frontier_changed = None
+        self.wakeup_pending = False
+
+
+    def run(self):
+        """
+        启动事件循环，直到队列中所有任务都处理完毕
+        """
+        resolver = None
+        if self.dns_cache is not None:
+            resolver = CachingResolver(dns_cache=self.dns_cache)
+        httpclient.AsyncHTTPClient.configure(None, max_clients=self.concurrency,
+                                             max_body_size=self.max_body_size,
+                                             resolver=resolver)
+        self.http_client = httpclient.AsyncHTTPClient()
+        self.io_loop = ioloop.IOLoop.current()
+        self.frontier_changed = locks.Condition()
+        self.checking_urls.add_listener(self.on_frontier_change)
+        try:
+            self.io_loop.run_sync(self.crawl)
+        finally:
+            self.checking_urls.remove_listener(self.on_frontier_change)
+
+
+    @gen.coroutine
+    def crawl(self):
+        """
+        分发循环：有空闲名额时取一个就绪的 url 交给新的抓取协程，所有任务完成后
+        等待仍在收尾的协程结束
+        """
+        slots = locks.Semaphore(self.concurrency)
+        while True:
+            yield slots.acquire()
+            url_obj = yield self.next_url()
+            if url_obj is None:
+                break
+            self.crawl_one(url_obj, slots)
+        for _ in xrange(self.concurrency - 1):
+            yield slots.acquire()
+
+
+    def on_frontier_change(self):
+        """
+        listener of the frontier, 可能在其它线程中调用（多节点转发链接），多次通知合并为一次唤醒
+        """
+        if not self.wakeup_pending:
+            self.wakeup_pending = True
+            self.io_loop.add_callback(self.wakeup)
+
+
+    def wakeup(self):
+        self.wakeup_pending = False
+        self.frontier_changed.notify_all()
+
+
+    @gen.coroutine
+    def next_url(self):
+        """
+        wait for a url whose host is ready, 由 frontier 的通知或下一个 host 的就绪时间唤醒，
+        不轮询
+
+        Returns:
+            url_obj，队列为空且所有任务都已完成时返回 None
+        """
+        while True:
+            # 全局并发上限低于协程数时，等待抓取协程释放名额
+            if self.adaptive is None or self.adaptive.try_acquire():
+                try:
+                    url_obj = self.checking_urls.get(block=False)
+                except Queue.Empty:
+                    if self.adaptive is not None:
+                        self.adaptive.release()
+                else:
+                    raise gen.Return(url_obj)
+            # 多节点时其它节点仍可能转发链接过来，需等协调节点宣布全局终止
+            if self.checking_urls.unfinished_tasks == 0 and (
+                    self.cluster is None or self.cluster.is_stopped()):
+                raise gen.Return(None)
+
+            timeout = None
+            wake_time = self.checking_urls.next_wake_time()
+            if wake_time is not None:
+                timeout = max(0.0, wake_time - time.time())
+            if self.cluster is not None:
+                # 全局终止没有通知，定期检查
+                timeout = min(timeout, CLUSTER_POLL_INTERVAL) if timeout is not None \
+                    else CLUSTER_POLL_INTERVAL
+            if timeout is not None:
+                timeout = datetime.timedelta(seconds=timeout)
+            yield self.frontier_changed.wait(timeout)
+
+
+    def track(self, callback):
+        """
+        wrap a callback so that calling it marks its url accounted, 规则同 CrawlerThread.track
+        """
+        def tracked(url_obj, *args, **kwargs):
+            self.accounted_ids.add(id(url_obj))
+            return callback(url_obj, *args, **kwargs)
+        return tracked
+
+
+    @gen.coroutine
+    def crawl_one(self, url_obj, slots):
+        """
+        crawl a url in its own coroutine and give back its slot
+        """
+        logging.debug('coroutine : get a url in depth: %s', url_obj.get_depth())
+        try:
+            yield self.crawl_url(url_obj)
+        except Exception as e:
+            # 保证异常时也调用 process_response，否则 task_done 缺失导致无法退出
+            logging.error(' * Async crawl error: %s - %s' % (url_obj.get_url(), e))
+            if id(url_obj) not in self.accounted_ids:
+                try:
+                    self.process_response(url_obj, -1)
+                except Exception:
+                    logging.exception(' * Record error failed: %s' % url_obj.get_url())
+        finally:
+            self.accounted_ids.discard(id(url_obj))
+            if self.adaptive is not None:
+                self.adaptive.release()
+            slots.release()
+            # 释放的自适应名额可能让等待中的分发循环继续
+            self.frontier_changed.notify_all()
+
+
+    @gen.coroutine
+    def crawl_url(self, url_obj):
+        """
+        抓取一个 url，并按 CrawlerThread.run 相同的语义回调 process_response
+        """
+        url = url_obj.get_url()
+        if self.robots_cache is not None and not (yield self.check_robots(url)):
+            self.process_response(url_obj, 3)
+            return
+
+        if self.adaptive is not None and self.adaptive.is_given_up(url):
+            # host 已被熔断器放弃，不再请求
+            self.process_response(url_obj, -1)
+            return
+
+        if self.url_pattern.match(url):
+            flag = -1
+            error = yield self.save_target(url)
+            if error is None:
+                flag = 1
+            elif self.retry_later(url_obj, error):
+                return
+            self.process_response(url_obj, flag)
+            return
+
+        if url_obj.get_depth() >= self.max_depth:
+            self.process_response(url_obj, 2)
+            return
+
+        response, body, error = yield self.fetch(url)
+        if response is None:
+            if not self.retry_later(url_obj, error):
+                self.process_response(url_obj, -1)
+            return
+
+        charset = html_parser.parse_charset(response.headers.get('Content-Type'))
+        soup = html_parser.HtmlParser(body, self.tag_dict, url, self.parser, charset,
+                                      self.with_fingerprint)
+        extract_url_list = soup.extract_url()
+        self.process_response(url_obj, 0, extract_url_list, soup.fingerprint)
+
+
+    def retry_later(self, url_obj, error):
+        """
+        schedule a failed url to be retried after backoff, 规则同 CrawlerThread.retry_later
+
+        Returns:
+            True/False: 是否已安排重试
+        """
+        if self.adaptive is None or self.process_retry is None:
+            return False
+        delay = self.adaptive.retry_delay(url_obj, error)
+        if delay is None:
+            return False
+        logging.info(' * Retry in %.2fs: %s' % (delay, url_obj.get_url()))
+        self.process_retry(url_obj, delay)
+        return True
+
+
+    @gen.coroutine
+    def check_robots(self, url):
+        """
+        check url against robots.txt, 规则未缓存时非阻塞地抓取该 host 的 robots.txt
+
+        Returns:
+            True/False: 允许抓取返回 True，否则返回 False
+        """
+        allowed = self.robots_cache.check(url)
+        if allowed is None:
+            robots_url = robots.get_robots_key(url)[1]
+            future = self.robots_fetching.get(robots_url)
+            if future is None:
+                future = self.fetch_robots(url, robots_url)
+                self.robots_fetching[robots_url] = future
+                future.add_done_callback(lambda _: self.robots_fetching.pop(robots_url, None))
+            yield future
+            # failure_ttl 为 0 时结果不会留在缓存中，按允许处理
+            allowed = self.robots_cache.check(url)
+        raise gen.Return(allowed is not False)
+
+
+    @gen.coroutine
+    def fetch_robots(self, url, robots_url):
+        """
+        fetch robots.txt of url's host and store it into robots cache
+        """
+        # 解压后超过 MAX_ROBOTS_SIZE 时截断，同 robots.make_pool_fetcher
+        decoder = StreamDecoder(2 * robots.MAX_ROBOTS_SIZE)
+        response = yield self.http_client.fetch(robots_url,
+                                                request_timeout=self.crawl_timeout,
+                                                validate_cert=False,
+                                                raise_error=False,
+                                                decompress_response=False,
+                                                headers={'Accept-Encoding':
+                                                         compression.ACCEPT_ENCODING},
+                                                header_callback=decoder.on_header,
+                                                streaming_callback=decoder.on_chunk)
+        status, body, error = response.code, '', response.error
+        if status == 599:
+            # 599 是 tornado 表示网络错误（含解压失败）的状态码
+            status = None
+        else:
+            try:
+                body = decoder.finish()
+            except IOError as e:
+                status, error = None, e
+        if status is None:
+            logging.warn(' * Fetch robots.txt failed: %s - %s' % (robots_url, error))
+        decoder.count()
+        self.robots_cache.store(url, status, body[:robots.MAX_ROBOTS_SIZE])
+
+
+    @gen.coroutine
+    def fetch(self, url, sink=None, tries=None):
+        """
+        非阻塞下载 url 并按 Content-Encoding 流式解压，失败时重试 try_times 次；
+        启用自适应控制时只尝试一次，由调用方通过 frontier 延迟重试
+
+        Args:
+            url   : 待下载 url
+            sink  : 若指定，解压后的 body 分块交给该回调，不在内存中保留
+            tries : 尝试次数，缺省为 try_times
+
+        Returns:
+            (HTTPResponse, 解压后的 body, None)/(None, None, 异常): 下载成功/失败，
+            指定了 sink 时 body 为空串
+        """
+        tries = tries or self.try_times
+        if self.adaptive is not None:
+            tries = 1
+        error = None
+        for i in xrange(tries):
+            start = ioloop.IOLoop.current().time()
+            # 每次尝试使用新的解压器，失败的尝试不留下数据
+            decoder = StreamDecoder(self.max_body_size, sink)
+            try:
+                response = yield self.http_client.fetch(url,
+                                                        request_timeout=self.crawl_timeout,
+                                                        validate_cert=False,
+                                                        decompress_response=False,
+                                                        headers={'Accept-Encoding':
+                                                                 compression.ACCEPT_ENCODING},
+                                                        header_callback=decoder.on_header,
+                                                        streaming_callback=decoder.on_chunk)
+                body = decoder.finish()
+            except Exception as e:
+                error = e
+                if self.adaptive is not None:
+                    self.adaptive.record(url, None, e)
+                logging.warn(' * Try for {}th times'.format(i + 1))
+                if i == tries - 1:
+                    logging.warn('* Downloading failed : %s - %s' % (url, e))
+                continue
+            finally:
+                decoder.count()
+            # tornado 不区分 DNS / 连接 / 首字节耗时，只记录整个请求的耗时
+            metrics.observe('fetch_time', response.request_time)
+            if self.adaptive is not None:
+                # 流式下载的耗时与 body 大小有关，不作为延迟样本
+                latency = None
+                if sink is None:
+                    latency = ioloop.IOLoop.current().time() - start
+                self.adaptive.record(url, latency, None)
+            raise gen.Return((response, body, None))
+        raise gen.Return((None, None, error))
+
+
+    @gen.coroutine
+    def save_target(self, url):
+        """
+        stream target into target store through a temp file, 存储布局与线程引擎一致
+
+        Returns:
+            None/异常: 保存成功/失败
+        """
+        try:
+            writer = self.target_store.open_writer(url)
+        except (IOError, OSError) as e:
+            logging.warn(' * Save target Faild: %s - %s' % (url, e))
+            raise gen.Return(e)
+
+        # 流式写入的数据无法回滚，所以只尝试一次
+        response, _, error = yield self.fetch(url, sink=writer.write, tries=1)
+        if response is None:
+            writer.abort()
+            raise gen.Return(error)
+        writer.commit()
+        raise gen.Return(None)
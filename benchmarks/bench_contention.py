@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: bench_contention.py
+Description: process_response 锁竞争基准：不发起网络请求，多个线程并发地从调度器取 url
+             并以合成的链接列表调用 process_response，统计 pages/sec 随线程数的变化。
+             --global_lock 模拟改造前用一把全局锁包住整个 process_response 的情况
+
+Usage:
+    python bench_contention.py [--pages 20000] [--threads 1,2,4,8,16] [--global_lock]
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import Queue
+import argparse
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import mini_spider
+import scheduler
+import seen_store
+import url_object
+
+
+def make_spider(seen_backend):
+    """
+    build a MiniSpider without config file and network
+    """
+    spider = mini_spider.MiniSpider()
+    spider.seen_urls = seen_store.create_seen_store(seen_backend, path='./bench_seen.db')
+    spider.checking_urls = scheduler.HostScheduler(0)
+    spider.target_urls = scheduler.HostScheduler(0)
+    spider.url_pattern = re.compile(r'.*\.(gif|png|jpg|bmp)$')
+    # 不在入队时丢弃任何链接
+    spider.max_depth = sys.maxint
+    return spider
+
+
+def run_once(thread_num, args):
+    """
+    run the benchmark with thread_num threads
+
+    Returns:
+        pages per second
+    """
+    spider = make_spider(args.seen_store)
+    rng = random.Random(7)
+    universe = ['http://host%d.example.com/page/%d.html' % (i % args.hosts, i)
+                for i in xrange(args.universe)]
+    link_lists = [rng.sample(universe, args.links) for _ in xrange(256)]
+    for i in xrange(thread_num * 64):
+        spider.enqueue_url(url_object.Url(universe[i], 0))
+
+    process_response = spider.process_response
+    if args.global_lock:
+        global_lock = threading.Lock()
+
+        def process_response(url_obj, flag, extract_url_list=None):
+            with global_lock:
+                spider.process_response(url_obj, flag, extract_url_list)
+
+    counter = {'pages': 0}
+    counter_lock = threading.Lock()
+
+    def worker(index):
+        while True:
+            with counter_lock:
+                if counter['pages'] >= args.pages:
+                    return
+                counter['pages'] += 1
+                page_index = counter['pages']
+            try:
+                url_obj = spider.checking_urls.get(block=False)
+            except Queue.Empty:
+                return
+            process_response(url_obj, 0, link_lists[page_index % len(link_lists)])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in xrange(thread_num)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    spider.seen_urls.close()
+    return counter['pages'] / elapsed
+
+
+def main():
+    """
+    run benchmark for each thread count and print a report
+    """
+    parser = argparse.ArgumentParser(description='process_response contention benchmark')
+    parser.add_argument('--pages', type=int, default=20000, help='pages per run')
+    parser.add_argument('--links', type=int, default=50, help='links per page')
+    parser.add_argument('--universe', type=int, default=200000, help='distinct urls')
+    parser.add_argument('--hosts', type=int, default=200, help='distinct hosts')
+    parser.add_argument('--threads', default='1,2,4,8,16', help='thread counts')
+    parser.add_argument('--seen_store', default='memory', help='seen store backend')
+    parser.add_argument('--global_lock', action='store_true',
+                        help='serialize process_response with one global lock')
+    args = parser.parse_args()
+
+    print '%-10s %12s' % ('threads', 'pages/s')
+    for thread_num in [int(n) for n in args.threads.split(',')]:
+        print '%-10d %12.1f' % (thread_num, run_once(thread_num, args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: bench_e2e.py
+Description: 端到端基准：在本地启动合成站点（fake_web.py），用 MiniSpider 完整抓取一遍，
+             报告 pages/sec、请求延迟 p50/p99、CPU 时间和峰值 RSS，无需访问外网
+
+Usage:
+    python bench_e2e.py [--fanout 10] [--depth 3] [--latency 0.01] [--error_rate 0.01]
+                        [--thread_count 8] [--parser lxml] [--set parse_processes=2] [--json]
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import fake_web
+import metrics
+import mini_spider
+
+LATENCY_METRICS = ('ttfb_time', 'download_time', 'fetch_time', 'parse_time')
+
+
+def write_config(work_dir, seed_url, args):
+    """
+    write seed file and spider.conf for the run
+
+    Returns:
+        配置文件路径
+    """
+    url_list_file = os.path.join(work_dir, 'urls.txt')
+    with open(url_list_file, 'w') as f:
+        f.write(seed_url + '\n')
+
+    options = [('url_list_file', url_list_file),
+               ('output_directory', os.path.join(work_dir, 'output')),
+               # 最深一层页面的图片也要抓到
+               ('max_depth', args.depth + 1),
+               ('crawl_interval', args.crawl_interval),
+               ('crawl_timeout', args.crawl_timeout),
+               ('target_url', r'.*\.(gif|png|jpg|bmp)$'),
+               ('thread_count', args.thread_count),
+               ('try_times', args.try_times),
+               ('engine', args.engine),
+               ('parser', args.parser),
+               ('stats_interval', 0)]
+    for item in args.set:
+        key, _, value = item.partition('=')
+        options.append((key.strip(), value.strip()))
+
+    conf_path = os.path.join(work_dir, 'spider.conf')
+    with open(conf_path, 'w') as f:
+        f.write('[spider]\n')
+        for key, value in options:
+            f.write('%s = %s\n' % (key, value))
+    return conf_path
+
+
+def run_spider(conf_path, verbose):
+    """
+    run MiniSpider in this process
+
+    Returns:
+        (spider, elapsed)，初始化失败时 spider 为 None
+    """
+    spider = mini_spider.MiniSpider(conf_path)
+    stdout = sys.stdout
+    if not verbose:
+        sys.stdout = open(os.devnull, 'w')
+    try:
+        if not spider.initialize():
+            return (None, 0)
+        start = time.time()
+        spider.run()
+        return (spider, time.time() - start)
+    finally:
+        if not verbose:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+
+def main():
+    """
+    serve the synthetic site, crawl it and print a report
+    """
+    parser = argparse.ArgumentParser(description='end-to-end crawl benchmark')
+    fake_web.add_site_arguments(parser)
+    parser.add_argument('--thread_count', type=int, default=8, help='crawler threads')
+    parser.add_argument('--crawl_interval', type=float, default=0.0, help='per-host interval')
+    parser.add_argument('--crawl_timeout', type=float, default=10.0, help='request timeout')
+    parser.add_argument('--try_times', type=int, default=3, help='download tries')
+    parser.add_argument('--engine', default='thread', help='thread / async')
+    parser.add_argument('--parser', default='html5lib', help='html parser backend')
+    parser.add_argument('--set', action='append', default=[],
+                        help='extra spider.conf option, e.g. --set parse_processes=2')
+    parser.add_argument('--json', action='store_true', help='print the report as json')
+    parser.add_argument('--verbose', action='store_true', help='show MiniSpider output')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING if args.verbose else logging.CRITICAL)
+
+    # 站点运行在子进程中，其 CPU 不计入爬虫
+    server = fake_web.create_server(args)
+    server_process = multiprocessing.Process(target=server.serve_forever)
+    server_process.daemon = True
+    server_process.start()
+    server.socket.close()
+
+    work_dir = tempfile.mkdtemp(prefix='bench-e2e-')
+    try:
+        conf_path = write_config(work_dir, server.get_url(), args)
+        self_before = resource.getrusage(resource.RUSAGE_SELF)
+        children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        spider, elapsed = run_spider(conf_path, args.verbose)
+        if spider is None:
+            print 'MiniSpider initialize failed, see --verbose'
+            return
+        # 解析进程已被回收，站点进程尚未回收，RUSAGE_CHILDREN 只包含解析进程
+        self_after = resource.getrusage(resource.RUSAGE_SELF)
+        children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    finally:
+        server_process.terminate()
+        server_process.join()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    cpu = (self_after.ru_utime - self_before.ru_utime + self_after.ru_stime -
+           self_before.ru_stime + children_after.ru_utime - children_before.ru_utime +
+           children_after.ru_stime - children_before.ru_stime)
+    snapshot = metrics.snapshot()
+    report = {'site_urls': server.graph.total_urls(),
+              'pages': spider.checked_num,
+              'errors': spider.error_num,
+              'elapsed': elapsed,
+              'pages_per_sec': spider.checked_num / elapsed if elapsed else 0.0,
+              'cpu_seconds': cpu,
+              'cpu_per_page_ms': cpu * 1000 / spider.checked_num if spider.checked_num else 0.0,
+              # linux 下 ru_maxrss 的单位为 KB
+              'peak_rss_mb': self_after.ru_maxrss / 1024.0,
+              'bytes_downloaded': snapshot['counters'].get('bytes_downloaded', 0),
+              'bytes_decoded': snapshot['counters'].get('bytes_decoded', 0)}
+    for name in LATENCY_METRICS:
+        summary = snapshot['histograms'].get(name)
+        if summary:
+            report[name] = {'p50': summary['p50'], 'p99': summary['p99']}
+
+    if args.json:
+        print json.dumps(report, sort_keys=True)
+        return
+    print '%-18s %d / %d (%d errors)' % ('pages', report['pages'], report['site_urls'],
+                                         report['errors'])
+    print '%-18s %.2f s' % ('elapsed', report['elapsed'])
+    print '%-18s %.1f' % ('pages/sec', report['pages_per_sec'])
+    for name in LATENCY_METRICS:
+        if name in report:
+            print '%-18s p50 %.2f ms, p99 %.2f ms' % (name, report[name]['p50'] * 1000,
+                                                      report[name]['p99'] * 1000)
+    print '%-18s %.2f s (%.2f ms/page)' % ('cpu', report['cpu_seconds'],
+                                           report['cpu_per_page_ms'])
+    print '%-18s %.1f MB' % ('peak rss', report['peak_rss_mb'])
+
+
+if __name__ == '__main__':
+    main()
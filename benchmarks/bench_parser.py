@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: bench_parser.py
+Description: 比较 html 解析后端（html5lib / lxml / streaming）的吞吐量与链接集合一致性
+
+Usage:
+    python bench_parser.py                 # 使用合成页面
+    python bench_parser.py page1.html ...  # 使用本地保存的页面
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import html_parser
+
+TAG_DICT = {'a': 'href', 'img': 'src', 'link': 'href', 'script': 'src'}
+BASE_URL = 'http://bench.example.com/dir/index.html'
+
+
+def make_page(rng, link_num, text_kb):
+    """
+    generate a synthetic html page with link_num links and ~text_kb KB text
+    """
+    parts = ['<!DOCTYPE html><html><head><meta charset="utf-8">',
+             '<title>基准测试页面</title>',
+             '<link rel="stylesheet" href="/static/site.css">',
+             '<script src="/static/app.js"></script></head><body>']
+    for i in xrange(link_num):
+        kind = rng.random()
+        if kind < 0.6:
+            parts.append('<p>段落 %d <a href="page_%d.html?a=1&amp;b=2">链接 %d</a></p>'
+                         % (i, rng.randint(0, 100000), i))
+        elif kind < 0.85:
+            parts.append('<div><img src="/img/%d.jpg" alt="图片"></div>' % rng.randint(0, 100000))
+        elif kind < 0.95:
+            parts.append('<a href="http://other%d.example.com/x">外链</a>' % rng.randint(0, 50))
+        else:
+            parts.append('<a href="javascript:void(0)">js</a>')
+    filler = u'这是一段用于填充页面的正文文字。'.encode('utf-8')
+    parts.append('<p>%s</p>' % (filler * (text_kb * 1024 / len(filler))))
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+
+def jaccard(set_a, set_b):
+    """
+    jaccard similarity of two link sets
+    """
+    if not set_a and not set_b:
+        return 1.0
+    return float(len(set_a & set_b)) / len(set_a | set_b)
+
+
+def run_backend(backend, pages, rounds):
+    """
+    parse all pages rounds times with backend
+
+    Returns:
+        (seconds, link sets of the last round)
+    """
+    link_sets = []
+    start = time.time()
+    for _ in xrange(rounds):
+        link_sets = [set(html_parser.HtmlParser(page, TAG_DICT, BASE_URL, backend).extract_url())
+                     for page in pages]
+    return time.time() - start, link_sets
+
+
+def main():
+    """
+    run benchmark and print a report
+    """
+    parser = argparse.ArgumentParser(description='HtmlParser backend benchmark')
+    parser.add_argument('files', nargs='*', help='html files, default synthetic pages')
+    parser.add_argument('--pages', type=int, default=50, help='synthetic page number')
+    parser.add_argument('--links', type=int, default=300, help='links per synthetic page')
+    parser.add_argument('--text_kb', type=int, default=40, help='text KB per synthetic page')
+    parser.add_argument('--rounds', type=int, default=3, help='rounds per backend')
+    args = parser.parse_args()
+
+    if args.files:
+        pages = []
+        for file_name in args.files:
+            with open(file_name, 'rb') as f:
+                pages.append(f.read())
+    else:
+        rng = random.Random(42)
+        pages = [make_page(rng, args.links, args.text_kb) for _ in xrange(args.pages)]
+    total_mb = sum(len(page) for page in pages) * args.rounds / 1024.0 / 1024.0
+
+    backends = [backend for backend in html_parser.PARSER_BACKENDS
+                if backend != 'lxml' or html_parser.lxml is not None]
+    results = {}
+    for backend in backends:
+        results[backend] = run_backend(backend, pages, args.rounds)
+
+    reference = results['html5lib'][1]
+    print '%-10s %10s %10s %10s %12s' % ('backend', 'seconds', 'pages/s', 'MB/s', 'agreement')
+    for backend in backends:
+        seconds, link_sets = results[backend]
+        agreement = sum(jaccard(a, b) for a, b in zip(reference, link_sets)) / len(pages)
+        print '%-10s %10.3f %10.1f %10.2f %11.2f%%' % (backend, seconds,
+                                                       len(pages) * args.rounds / seconds,
+                                                       total_mb / seconds, agreement * 100)
+
+
+if __name__ == '__main__':
+    main()
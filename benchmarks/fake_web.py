@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: fake_web.py
+Description: 合成站点：按 fan-out / 深度生成确定的页面图（含图片链接和回链），
+             由本地 HTTP/1.1 keep-alive 服务器提供，可注入延迟和错误，用于离线基准测试
+
+    页面 n 的子页面为 n * fanout + 1 ... n * fanout + fanout（广度优先编号），
+    另外每页有 back_links 条指向已有页面的回链，用于触发去重。
+
+Usage:
+    python fake_web.py [--port 8900] [--fanout 10] [--depth 3] [--latency 0.01] ...
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import BaseHTTPServer
+import SocketServer
+import argparse
+import random
+import re
+import time
+
+PAGE_PATTERN = re.compile(r'^/p/(\d+)\.html$')
+IMAGE_PATTERN = re.compile(r'^/img/(\d+)_(\d+)\.png$')
+
+
+class SiteGraph(object):
+    """
+    Deterministic synthetic site
+
+    Attributes:
+        fanout      : 每页的子页面数
+        depth       : 最大深度（首页为 0）
+        page_size   : 页面字节数（填充文字后）
+        image_ratio : 每页图片链接数与子页面链接数之比
+        image_size  : 图片字节数
+        back_links  : 每页指向已有页面的回链数
+        page_num    : 页面总数
+    """
+    def __init__(self, fanout=10, depth=3, page_size=16384, image_ratio=0.5,
+                 image_size=4096, back_links=5, seed=7):
+        self.fanout = fanout
+        self.depth = depth
+        self.page_size = page_size
+        self.image_ratio = image_ratio
+        self.image_size = image_size
+        self.back_links = back_links
+        self.seed = seed
+        self.page_num = sum(fanout ** level for level in xrange(depth + 1))
+        self.image_num_per_page = int(round(fanout * image_ratio))
+        self.image_body = ('\x89PNG' + 'x' * image_size)[:image_size]
+
+
+    def children(self, page_id):
+        """
+        child page ids of page_id
+        """
+        first = page_id * self.fanout + 1
+        return [child for child in xrange(first, first + self.fanout) if child < self.page_num]
+
+
+    def render_page(self, page_id):
+        """
+        render html of page_id, 同一页面每次渲染结果相同
+        """
+        rng = random.Random(self.seed * 1000003 + page_id)
+        parts = ['<!DOCTYPE html><html><head><meta charset="utf-8">',
+                 '<title>page %d</title></head><body>' % page_id]
+        for child in self.children(page_id):
+            parts.append('<p><a href="/p/%d.html">page %d</a></p>' % (child, child))
+        for _ in xrange(self.back_links):
+            target = rng.randint(0, max(page_id, 1) - 1) if page_id else 0
+            parts.append('<a href="/p/%d.html#top">back</a>' % target)
+        for index in xrange(self.image_num_per_page):
+            parts.append('<img src="/img/%d_%d.png">' % (page_id, index))
+        html = ''.join(parts)
+        filler = '<p>lorem ipsum dolor sit amet consectetur adipiscing elit</p>'
+        padding = max(self.page_size - len(html) - len('</body></html>'), 0)
+        html += (filler * (padding / len(filler) + 1))[:padding]
+        return html + '</body></html>'
+
+
+    def total_urls(self):
+        """
+        number of distinct urls reachable from the home page
+        """
+        return self.page_num * (1 + self.image_num_per_page)
+
+
+class FakeWebHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    serve pages and images of server.graph with injected latency and errors
+    """
+    protocol_version = 'HTTP/1.1'
+    # 响应头和 body 合并发送，避免 Nagle 与延迟确认叠加造成约 40ms 的停顿
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        if server.latency > 0:
+            # 均匀分布在 [0, 2 * latency]，平均值为 latency
+            time.sleep(random.uniform(0, 2 * server.latency))
+        if server.error_rate > 0 and random.random() < server.error_rate:
+            self.reply(500, 'text/plain', 'injected error')
+            return
+
+        path = self.path.split('?', 1)[0]
+        match = PAGE_PATTERN.match(path)
+        if path == '/':
+            match = PAGE_PATTERN.match('/p/0.html')
+        if match and int(match.group(1)) < server.graph.page_num:
+            html = server.graph.render_page(int(match.group(1)))
+            self.reply(200, 'text/html; charset=utf-8', html)
+            return
+        if IMAGE_PATTERN.match(path):
+            self.reply(200, 'image/png', server.graph.image_body)
+            return
+        self.reply(404, 'text/plain', 'not found')
+
+
+    def reply(self, code, content_type, body):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeWebServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Threaded keep-alive server of a SiteGraph
+
+    Attributes:
+        graph       : 站点图
+        latency     : 平均注入延迟（秒）
+        error_rate  : 返回 500 的概率
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, graph, port=0, latency=0.0, error_rate=0.0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), FakeWebHandler)
+        self.graph = graph
+        self.latency = latency
+        self.error_rate = error_rate
+
+
+    def get_url(self):
+        """
+        home page url
+        """
+        return 'http://127.0.0.1:%d/p/0.html' % self.server_address[1]
+
+
+def add_site_arguments(parser):
+    """
+    add arguments describing the synthetic site to an ArgumentParser
+    """
+    parser.add_argument('--fanout', type=int, default=10, help='child pages per page')
+    parser.add_argument('--depth', type=int, default=3, help='depth of the site graph')
+    parser.add_argument('--page_size', type=int, default=16384, help='bytes per page')
+    parser.add_argument('--image_ratio', type=float, default=0.5,
+                        help='image links per child link')
+    parser.add_argument('--image_size', type=int, default=4096, help='bytes per image')
+    parser.add_argument('--back_links', type=int, default=5, help='back links per page')
+    parser.add_argument('--latency', type=float, default=0.0, help='mean latency in seconds')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='ratio of 500 responses')
+
+
+def create_server(args, port=0):
+    """
+    create a FakeWebServer from parsed arguments
+    """
+    graph = SiteGraph(args.fanout, args.depth, args.page_size, args.image_ratio,
+                      args.image_size, args.back_links)
+    return FakeWebServer(graph, port, args.latency, args.error_rate)
+
+
+def main():
+    """
+    serve the synthetic site until interrupted
+    """
+    parser = argparse.ArgumentParser(description='synthetic site server')
+    parser.add_argument('--port', type=int, default=8900, help='listening port')
+    add_site_arguments(parser)
+    args = parser.parse_args()
+
+    server = create_server(args, args.port)
+    print 'serving %d pages, %d urls at %s' % (server.graph.page_num,
+                                                server.graph.total_urls(), server.get_url())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: canonicalize.py
+Description: URL 规范化，使指向同一资源的不同写法在去重前得到同一个字符串
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import re
+import urllib
+import urlparse
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+DEFAULT_STRIP_PARAMS = ('utm_source', 'utm_medium', 'utm_campaign', 'utm_term',
+                        'utm_content', 'gclid', 'fbclid')
+
+UNRESERVED = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~')
+PERCENT_PATTERN = re.compile(r'%([0-9A-Fa-f]{2})')
+LONE_PERCENT_PATTERN = re.compile(r'%(?![0-9A-Fa-f]{2})')
+# 允许原样出现的字符（'%' 已在前一步规范化）
+PATH_SAFE = "/:@!$&'()*+,;=-._~%"
+QUERY_SAFE = "/:@!$'()*+,;-._~%?"
+
+
+def normalize_percent(component, safe):
+    """
+    normalize percent-encoding of a url component
+
+    未保留字符的转义被解码（%7E -> ~），其余转义统一为大写（%2f -> %2F），
+    不合法字符（空格、非 ASCII 等）被转义
+
+    Args:
+        component: url 的一个组成部分（bytes）
+        safe     : 不需要转义的字符
+
+    Returns:
+        规范化后的字符串
+    """
+    def replace_escape(match):
+        char = chr(int(match.group(1), 16))
+        if char in UNRESERVED:
+            return char
+        return '%' + match.group(1).upper()
+
+    component = LONE_PERCENT_PATTERN.sub('%25', component)
+    component = PERCENT_PATTERN.sub(replace_escape, component)
+    return urllib.quote(component, safe=safe)
+
+
+def remove_dot_segments(path):
+    """
+    resolve '.' and '..' segments of a path (RFC 3986 5.2.4)
+    """
+    output = []
+    segments = path.split('/')
+    for index, segment in enumerate(segments):
+        is_last = index == len(segments) - 1
+        if segment == '.':
+            if is_last:
+                output.append('')
+        elif segment == '..':
+            if len(output) > 1:
+                output.pop()
+            if is_last:
+                output.append('')
+        else:
+            output.append(segment)
+    result = '/'.join(output)
+    if path.startswith('/') and not result.startswith('/'):
+        result = '/' + result
+    return result
+
+
+class Canonicalizer(object):
+    """
+    This class is used to canonicalize urls before dedup.
+
+    规则：scheme 和 host 小写、去掉缺省端口和 fragment、解析 '.' 与 '..'、
+    规范化百分号编码，可选地排序 query 参数、去掉跟踪参数和末尾斜杠
+
+    Attributes:
+        sort_query           : 是否按参数名排序 query
+        strip_params         : 需要去掉的 query 参数名（小写）
+        strip_trailing_slash : 是否去掉非根路径末尾的 '/'
+    """
+    def __init__(self, sort_query=False, strip_params=DEFAULT_STRIP_PARAMS,
+                 strip_trailing_slash=False):
+        self.sort_query = sort_query
+        self.strip_params = frozenset(param.lower() for param in strip_params)
+        self.strip_trailing_slash = strip_trailing_slash
+
+
+    def canonicalize(self, url):
+        """
+        canonicalize url
+
+        Args:
+            url: 绝对 url
+
+        Returns:
+            规范化后的 url；非 http(s) url 或无法解析时原样返回
+        """
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+        try:
+            parts = urlparse.urlsplit(url.strip())
+            port = parts.port
+        except ValueError:
+            return url
+
+        scheme = parts.scheme.lower()
+        if scheme not in DEFAULT_PORTS or not parts.hostname:
+            return url
+
+        netloc = parts.hostname.lower()
+        if port is not None and port != DEFAULT_PORTS[scheme]:
+            netloc = '%s:%d' % (netloc, port)
+        if parts.username is not None:
+            userinfo = parts.username
+            if parts.password is not None:
+                userinfo += ':' + parts.password
+            netloc = '%s@%s' % (userinfo, netloc)
+
+        path = normalize_percent(remove_dot_segments(parts.path or '/'), PATH_SAFE)
+        if not path.startswith('/'):
+            path = '/' + path
+        if self.strip_trailing_slash and len(path) > 1 and path.endswith('/'):
+            path = path.rstrip('/') or '/'
+
+        query = self.canonicalize_query(parts.query)
+        return urlparse.urlunsplit((scheme, netloc, path, query, ''))
+
+
+    def canonicalize_query(self, query):
+        """
+        normalize query string: 去掉跟踪参数，可选排序，规范化百分号编码
+        """
+        if not query:
+            return ''
+        params = []
+        for pair in query.split('&'):
+            if not pair:
+                continue
+            name, sep, value = pair.partition('=')
+            name = normalize_percent(name, QUERY_SAFE)
+            if urllib.unquote(name).lower() in self.strip_params:
+                continue
+            params.append((name, sep, normalize_percent(value, QUERY_SAFE + '=')))
+        if self.sort_query:
+            # 稳定排序，同名参数保持原有顺序
+            params.sort(key=lambda param: param[0])
+        return '&'.join(name + sep + value for name, sep, value in params)
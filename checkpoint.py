@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: checkpoint.py
+Description: 抓取状态的增量 checkpoint 与断点续爬
+
+    journal 是一个只追加的文本文件，每行一条记录：
+        A <depth> <url>    url 入队（同时意味着 url 已见）
+        D <flag> <url>     url 处理完成，flag 同 process_response
+        S <url>            url 已见但无需再抓取（compact 后产生）
+        C <checked> <error> 计数器快照（compact 后产生）
+    待抓取 frontier = 所有 A 减去所有 D，已见集合 = 所有 A 和 S。
+    记录按处理顺序追加，子链接的 A 总在父页面的 D 之前，所以任意时刻
+    崩溃后回放 journal 得到的状态都是一致的（至多重复抓取少量页面）。
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import collections
+import logging
+import os
+import threading
+
+JOURNAL_NAME = 'journal.log'
+
+
+def _to_bytes(url):
+    if isinstance(url, unicode):
+        url = url.encode('utf-8')
+    # 分隔符不能出现在 url 中
+    return url.replace('\t', '%09').replace('\n', '%0A').replace('\r', '%0D')
+
+
+def _to_unicode(url):
+    return url.decode('utf-8', 'replace')
+
+
+class CrawlJournal(object):
+    """
+    Append-only crawl journal with periodic fsync.
+
+    Attributes:
+        checkpoint_dir : checkpoint 目录
+        interval       : 落盘（flush + fsync）间隔（秒）
+        path           : journal 文件路径
+    """
+    def __init__(self, checkpoint_dir, interval=10.0):
+        self.checkpoint_dir = checkpoint_dir
+        self.interval = interval
+        self.path = os.path.join(checkpoint_dir, JOURNAL_NAME)
+        self.file = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.flusher = None
+
+
+    def exists(self):
+        """
+        whether a journal from a previous run exists
+        """
+        return os.path.isfile(self.path)
+
+
+    def iter_records(self):
+        """
+        iterate records of the journal file, 忽略崩溃时写了一半的最后一行
+
+        Yields:
+            记录字段列表
+        """
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break
+                yield line[:-1].split('\t', 2)
+
+
+    def load(self, add_seen):
+        """
+        replay journal of the previous run
+
+        Args:
+            add_seen: 回调函数，每个已见 url 调用一次
+
+        Returns:
+            (pending, checked_num, error_num)
+            pending 为 url -> depth 的有序字典，即中断时尚未处理完的 url
+        """
+        pending = collections.OrderedDict()
+        checked_num = 0
+        error_num = 0
+        for record in self.iter_records():
+            kind = record[0]
+            if kind == 'A':
+                url = _to_unicode(record[2])
+                pending[url] = int(record[1])
+                add_seen(url)
+            elif kind == 'D':
+                pending.pop(_to_unicode(record[2]), None)
+                if record[1] in ('0', '1'):
+                    checked_num += 1
+                elif record[1] == '-1':
+                    error_num += 1
+            elif kind == 'S':
+                add_seen(_to_unicode(record[1]))
+            elif kind == 'C':
+                checked_num += int(record[1])
+                error_num += int(record[2])
+        return (pending, checked_num, error_num)
+
+
+    def compact(self, pending, checked_num, error_num):
+        """
+        rewrite the journal into a snapshot: 计数器 + 已见 url + 待抓取 url，
+        写入临时文件后原子替换
+        """
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write('C\t%d\t%d\n' % (checked_num, error_num))
+            for record in self.iter_records():
+                if record[0] == 'A' and _to_unicode(record[2]) not in pending:
+                    f.write('S\t%s\n' % record[2])
+                elif record[0] == 'S':
+                    f.write('S\t%s\n' % record[1])
+            for url, depth in pending.iteritems():
+                f.write('A\t%d\t%s\n' % (depth, _to_bytes(url)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self.path)
+
+
+    def open(self, truncate):
+        """
+        open journal for appending and start the flusher thread
+
+        Args:
+            truncate: True 表示丢弃旧的 journal，重新开始
+        """
+        if not os.path.isdir(self.checkpoint_dir):
+            os.makedirs(self.checkpoint_dir)
+        self.file = open(self.path, 'wb' if truncate else 'ab')
+        self.flusher = threading.Thread(target=self.flush_loop, name='checkpoint flusher')
+        self.flusher.setDaemon(True)
+        self.flusher.start()
+
+
+    def record_enqueue(self, url, depth):
+        """
+        record that url is put into frontier
+        """
+        line = 'A\t%d\t%s\n' % (depth, _to_bytes(url))
+        with self.lock:
+            self.file.write(line)
+
+
+    def record_enqueue_many(self, url_objs):
+        """
+        record that url objects are put into frontier
+        """
+        lines = ''.join('A\t%d\t%s\n' % (url_obj.get_depth(), _to_bytes(url_obj.get_url()))
+                        for url_obj in url_objs)
+        with self.lock:
+            self.file.write(lines)
+
+
+    def record_done(self, url, flag):
+        """
+        record that url is finished with flag
+        """
+        line = 'D\t%d\t%s\n' % (flag, _to_bytes(url))
+        with self.lock:
+            self.file.write(line)
+
+
+    def flush(self):
+        """
+        flush buffered records and fsync, 只在 flush 时持锁，fsync 不阻塞写入
+        """
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.flush()
+            fileno = self.file.fileno()
+        os.fsync(fileno)
+
+
+    def flush_loop(self):
+        """
+        flusher thread: 每隔 interval 秒落盘一次
+        """
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.flush()
+            except (IOError, OSError) as e:
+                logging.error(' * Checkpoint flush failed: %s' % e)
+
+
+    def close(self):
+        """
+        stop flusher thread, flush and close journal
+        """
+        self.stop_event.set()
+        if self.flusher is not None:
+            self.flusher.join()
+        self.flush()
+        with self.lock:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,494 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: cluster.py
+Description: 多节点协同抓取：按 host 哈希划分归属节点，每个节点只抓取自己的 host（抓取间隔和
+             并发限制仍在本地生效），提取出的其它节点的链接按批转发；节点 0 兼任协调节点，
+             负责检测全局终止并汇总各节点的统计
+
+    节点之间的消息（JSON）：
+        urls     : 转发的链接 [[url, depth], ...]
+        status?  : 协调节点询问状态
+        status   : 是否空闲、累计转发和接收的链接数
+        stop     : 全局终止
+        report   : 节点终止时的统计，发给协调节点
+
+    终止检测使用计数法：连续两轮询问中所有节点都空闲、转发总数等于接收总数、且计数没有变化，
+    说明既没有节点在工作，也没有在途的链接。
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import Queue
+import binascii
+import itertools
+import json
+import logging
+import socket
+import struct
+import threading
+import time
+
+import metrics
+import scheduler
+import url_object
+
+COORDINATOR_ID = 0
+HEADER = struct.Struct('!I')
+# 对端尚未启动时，建立连接的重试时间（秒）
+CONNECT_TIMEOUT = 60.0
+
+
+def _to_unicode(url):
+    if isinstance(url, str):
+        return url.decode('utf-8', 'replace')
+    return url
+
+
+def parse_address(address):
+    """
+    parse 'host:port' into (host, port)
+    """
+    host, _, port = address.strip().rpartition(':')
+    return (host or '127.0.0.1', int(port))
+
+
+class TcpTransport(object):
+    """
+    Length-prefixed JSON messages over TCP, 每个对端一条长连接
+
+    Attributes:
+        node_id   : 本节点序号
+        addresses : 所有节点的 (host, port)，按节点序号排列
+    """
+
+    name = 'tcp'
+
+    def __init__(self, node_id, addresses):
+        self.node_id = node_id
+        self.addresses = addresses
+        self.handler = None
+        self.listener = None
+        # 监听线程和读线程，及读线程所用的连接，关闭时一并结束
+        self.threads = []
+        self.conns = []
+        self.peers = {}
+        self.peer_locks = dict((peer_id, threading.Lock()) for peer_id in xrange(len(addresses)))
+        self.closed = False
+
+
+    def start(self, handler):
+        """
+        listen on own address, 收到的每条消息在该连接的读线程中交给 handler
+        """
+        self.handler = handler
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(self.addresses[self.node_id])
+        self.listener.listen(len(self.addresses) * 2)
+        self.start_thread(self.accept_loop, 'cluster listener')
+
+
+    def start_thread(self, target, name, *args):
+        thread = threading.Thread(target=target, args=args, name=name)
+        thread.setDaemon(True)
+        thread.start()
+        self.threads.append(thread)
+
+
+    def accept_loop(self):
+        while not self.closed:
+            try:
+                conn, _ = self.listener.accept()
+            except socket.error:
+                return
+            self.conns.append(conn)
+            self.start_thread(self.read_loop, 'cluster reader', conn)
+
+
+    def read_loop(self, conn):
+        """
+        read messages from one peer connection until it is closed
+        """
+        stream = conn.makefile('rb')
+        try:
+            while True:
+                header = stream.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return
+                body = stream.read(HEADER.unpack(header)[0])
+                self.handler(json.loads(body))
+        except (socket.error, ValueError) as e:
+            if not self.closed:
+                logging.warn(' * Cluster connection broken: %s' % e)
+        finally:
+            stream.close()
+            conn.close()
+
+
+    def connect(self, peer_id):
+        """
+        connect to a peer, 对端尚未启动时重试直到 CONNECT_TIMEOUT
+        """
+        deadline = time.time() + CONNECT_TIMEOUT
+        while True:
+            try:
+                sock = socket.create_connection(self.addresses[peer_id])
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                return sock
+            except socket.error:
+                if time.time() > deadline or self.closed:
+                    raise
+                time.sleep(0.2)
+
+
+    def send(self, peer_id, message):
+        """
+        send a message to peer, 连接断开时重连一次
+
+        Raises:
+            socket.error: 无法连接对端
+        """
+        body = json.dumps(message)
+        data = HEADER.pack(len(body)) + body
+        with self.peer_locks[peer_id]:
+            for retry in (False, True):
+                sock = self.peers.get(peer_id)
+                if sock is None:
+                    sock = self.peers[peer_id] = self.connect(peer_id)
+                try:
+                    sock.sendall(data)
+                    return
+                except socket.error:
+                    sock.close()
+                    del self.peers[peer_id]
+                    if retry:
+                        raise
+
+
+    def close(self):
+        """
+        close all connections and wait for the listener and reader threads
+        """
+        self.closed = True
+        for peer_id, lock in self.peer_locks.iteritems():
+            with lock:
+                sock = self.peers.pop(peer_id, None)
+                if sock is not None:
+                    sock.close()
+        # close() 不能唤醒阻塞在 accept/recv 上的线程，需先 shutdown
+        for sock in [self.listener] + self.conns:
+            if sock is None:
+                continue
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        for thread in self.threads:
+            thread.join(1.0)
+        if self.listener is not None:
+            self.listener.close()
+
+
+class LocalHub(object):
+    """
+    In-process message hub connecting LocalTransports, 用于在一个进程内测试多个节点
+    """
+    def __init__(self):
+        self.transports = {}
+
+
+class LocalTransport(object):
+    """
+    In-process transport, 每个节点一个投递线程，保持与 TCP 相同的异步语义
+
+    Attributes:
+        node_id : 本节点序号
+        hub     : 共享的 LocalHub
+    """
+
+    name = 'local'
+
+    def __init__(self, node_id, hub):
+        self.node_id = node_id
+        self.hub = hub
+        self.inbox = Queue.Queue()
+        self.handler = None
+
+
+    def start(self, handler):
+        self.handler = handler
+        self.hub.transports[self.node_id] = self
+        thread = threading.Thread(target=self.deliver_loop, name='cluster inbox')
+        thread.setDaemon(True)
+        thread.start()
+
+
+    def deliver_loop(self):
+        while True:
+            message = self.inbox.get()
+            if message is None:
+                return
+            self.handler(message)
+
+
+    def send(self, peer_id, message):
+        # 经过一次序列化，与 TCP 传输得到的消息一致
+        self.hub.transports[peer_id].inbox.put(json.loads(json.dumps(message)))
+
+
+    def close(self):
+        self.inbox.put(None)
+
+
+class ClusterNode(object):
+    """
+    One node of a crawl cluster.
+
+    Attributes:
+        node_id        : 本节点序号，0 为协调节点
+        node_num       : 节点总数
+        transport      : 消息传输，需提供 start(handler) / send(node_id, message) / close()
+        batch_size     : 发往同一节点的链接攒够该数量时立即发送
+        flush_interval : 未攒够的链接最长等待时间（秒）
+        forwarded_num  : 转发给其它节点的链接数
+        received_num   : 从其它节点接收的链接数
+        reports        : 协调节点收到的各节点统计，node_id -> dict
+    """
+    def __init__(self, node_id, node_num, transport, on_urls, is_idle, get_stats,
+                 batch_size=100, flush_interval=0.2, poll_interval=0.5):
+        self.node_id = node_id
+        self.node_num = node_num
+        self.transport = transport
+        self.on_urls = on_urls
+        self.is_idle = is_idle
+        self.get_stats = get_stats
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.poll_interval = poll_interval
+        # node_id -> 待转发的 [url, depth] 列表
+        self.outboxes = dict((peer_id, []) for peer_id in xrange(node_num) if peer_id != node_id)
+        self.sending_num = 0
+        self.forwarded_num = 0
+        self.received_num = 0
+        self.lock = threading.Lock()
+        self.status_cond = threading.Condition(threading.Lock())
+        self.statuses = {}
+        self.reports = {}
+        self.stop_event = threading.Event()
+
+
+    def owner(self, url):
+        """
+        get id of the node owning the host of url
+        """
+        host = scheduler.get_host(url)
+        if isinstance(host, unicode):
+            # 解析出的链接和转发来的链接是 unicode，按 utf-8 字节哈希，与 str 形式归属相同
+            host = host.encode('utf-8')
+        return (binascii.crc32(host) & 0xffffffff) % self.node_num
+
+
+    def is_local(self, url):
+        return self.owner(url) == self.node_id
+
+
+    def route(self, url_objs):
+        """
+        queue url objects owned by other nodes for forwarding
+
+        Returns:
+            本节点负责的 url 对象列表
+        """
+        local_url_objs = []
+        full_peers = []
+        with self.lock:
+            for url_obj in url_objs:
+                peer_id = self.owner(url_obj.get_url())
+                if peer_id == self.node_id:
+                    local_url_objs.append(url_obj)
+                    continue
+                outbox = self.outboxes[peer_id]
+                outbox.append([_to_unicode(url_obj.get_url()), url_obj.get_depth()])
+                self.forwarded_num += 1
+                if len(outbox) == self.batch_size:
+                    full_peers.append(peer_id)
+        for peer_id in full_peers:
+            self.flush_peer(peer_id)
+        return local_url_objs
+
+
+    def flush_peer(self, peer_id):
+        """
+        send queued urls of one peer
+        """
+        with self.lock:
+            urls = self.outboxes[peer_id]
+            if not urls:
+                return
+            self.outboxes[peer_id] = []
+            self.sending_num += len(urls)
+        try:
+            self.transport.send(peer_id, {'type': 'urls', 'from': self.node_id, 'urls': urls})
+            metrics.incr('cluster_forwarded', len(urls))
+        except socket.error as e:
+            logging.error(' * Cluster forward to node %d failed, %d urls lost: %s' %
+                          (peer_id, len(urls), e))
+            # 丢失的链接视为已被接收，避免终止检测永远等待
+            with self.lock:
+                self.forwarded_num -= len(urls)
+        finally:
+            with self.lock:
+                self.sending_num -= len(urls)
+
+
+    def flush_loop(self):
+        while not self.stop_event.wait(self.flush_interval):
+            for peer_id in self.outboxes:
+                self.flush_peer(peer_id)
+
+
+    def handle(self, message):
+        """
+        handle a message from the transport
+        """
+        message_type = message['type']
+        if message_type == 'urls':
+            url_objs = [url_object.Url(url, depth) for url, depth in message['urls']]
+            self.on_urls(url_objs)
+            # 先入队再计数，终止检测看到计数相等时这些 url 已在本地 frontier 中
+            with self.lock:
+                self.received_num += len(url_objs)
+            metrics.incr('cluster_received', len(url_objs))
+        elif message_type == 'status?':
+            self.transport.send(COORDINATOR_ID, dict(self.status(), round=message['round']))
+        elif message_type == 'status':
+            with self.status_cond:
+                self.statuses[(message['round'], message['from'])] = message
+                self.status_cond.notify_all()
+        elif message_type == 'stop':
+            self.transport.send(COORDINATOR_ID, {'type': 'report', 'from': self.node_id,
+                                                 'stats': self.get_stats()})
+            self.stop_event.set()
+        elif message_type == 'report':
+            with self.status_cond:
+                self.reports[message['from']] = message['stats']
+                self.status_cond.notify_all()
+
+
+    def status(self):
+        """
+        get status of this node, 先读计数再判断空闲，保证两者的先后关系
+        """
+        with self.lock:
+            forwarded_num = self.forwarded_num
+            received_num = self.received_num
+            outbox_empty = self.sending_num == 0 and not any(self.outboxes.itervalues())
+        return {'type': 'status', 'from': self.node_id, 'forwarded': forwarded_num,
+                'received': received_num, 'idle': outbox_empty and self.is_idle()}
+
+
+    def collect_statuses(self, round_id):
+        """
+        ask all nodes for their status
+
+        Returns:
+            node_id -> status，未及时回复的节点不在其中
+        """
+        for peer_id in self.outboxes:
+            try:
+                self.transport.send(peer_id, {'type': 'status?', 'round': round_id})
+            except socket.error as e:
+                logging.warn(' * Cluster node %d unreachable: %s' % (peer_id, e))
+        statuses = {self.node_id: self.status()}
+        deadline = time.time() + max(self.poll_interval, 1.0) * 5
+        with self.status_cond:
+            while True:
+                for peer_id in self.outboxes:
+                    status = self.statuses.pop((round_id, peer_id), None)
+                    if status is not None:
+                        statuses[peer_id] = status
+                remaining = deadline - time.time()
+                if len(statuses) == self.node_num or remaining <= 0:
+                    return statuses
+                self.status_cond.wait(remaining)
+
+
+    def detect_loop(self):
+        """
+        coordinator: poll statuses until global termination, then stop all nodes
+        """
+        last_counts = None
+        for round_id in itertools.count():
+            if self.stop_event.wait(self.poll_interval):
+                return
+            statuses = self.collect_statuses(round_id)
+            if len(statuses) < self.node_num or not all(s['idle'] for s in statuses.values()):
+                last_counts = None
+                continue
+            counts = tuple((statuses[i]['forwarded'], statuses[i]['received'])
+                           for i in xrange(self.node_num))
+            if sum(c[0] for c in counts) != sum(c[1] for c in counts):
+                last_counts = None
+                continue
+            if counts == last_counts:
+                break
+            last_counts = counts
+
+        logging.info(' * Cluster terminated after %d status rounds' % (round_id + 1))
+        for peer_id in self.outboxes:
+            try:
+                self.transport.send(peer_id, {'type': 'stop'})
+            except socket.error as e:
+                logging.warn(' * Cluster node %d unreachable: %s' % (peer_id, e))
+        self.stop_event.set()
+
+
+    def start(self):
+        """
+        start transport, flusher and (on the coordinator) termination detection
+        """
+        self.transport.start(self.handle)
+        threads = [threading.Thread(target=self.flush_loop, name='cluster flusher')]
+        if self.node_id == COORDINATOR_ID:
+            threads.append(threading.Thread(target=self.detect_loop, name='cluster detector'))
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+
+
+    def wait(self):
+        """
+        block until the whole cluster is done
+        """
+        # 不带超时的 wait 无法被 Ctrl-C 打断
+        while not self.stop_event.wait(1.0):
+            pass
+
+
+    def is_stopped(self):
+        return self.stop_event.is_set()
+
+
+    def gather_reports(self, timeout=30.0):
+        """
+        coordinator: wait for reports of all other nodes
+
+        Returns:
+            node_id -> stats，包括本节点
+        """
+        deadline = time.time() + timeout
+        with self.status_cond:
+            while len(self.reports) < self.node_num - 1:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.status_cond.wait(remaining)
+            reports = dict(self.reports)
+        reports[self.node_id] = self.get_stats()
+        return reports
+
+
+    def close(self):
+        self.transport.close()
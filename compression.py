@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: compression.py
+Description: HTTP 压缩协商（Accept-Encoding）和响应 body 的流式解压（gzip / deflate，
+             安装了 brotli 时支持 br），解压后的大小有上限，防止压缩炸弹
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    # brotli 为可选依赖，未安装时不声明支持 br
+    brotli = None
+
+ACCEPT_ENCODING = 'gzip, deflate, br' if brotli is not None else 'gzip, deflate'
+# 每次 inflate 最多输出的字节数，保证超过上限时最多多占用这么多内存
+DECODE_CHUNK_SIZE = 65536
+
+
+class BodyTooLargeError(IOError):
+    """
+    raised when a response body exceeds max_body_size
+    """
+    pass
+
+
+class ContentDecoder(object):
+    """
+    Incremental decoder of one response body by its Content-Encoding.
+
+    压缩前（线上传输）和解压后的字节数都不能超过 max_size。gzip / deflate 按
+    DECODE_CHUNK_SIZE 分段输出，brotli 没有限制输出长度的接口，每个输入块解压后检查。
+
+    Attributes:
+        encoding     : 小写的 Content-Encoding，identity 表示未压缩
+        max_size     : body 的最大字节数
+        wire_size    : 已输入（线上传输）的字节数
+        decoded_size : 已输出（解压后）的字节数
+        pending      : deflate 判断是否带 zlib 头前缓存的输入，头部需要 2 个字节
+    """
+    def __init__(self, encoding, max_size):
+        self.encoding = (encoding or 'identity').strip().lower()
+        self.max_size = max_size
+        self.wire_size = 0
+        self.decoded_size = 0
+        self.pending = ''
+        self.decompressor = None
+        if self.encoding in ('gzip', 'x-gzip'):
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == 'br' and brotli is not None:
+            self.decompressor = brotli.Decompressor()
+        elif self.encoding not in ('identity', 'deflate'):
+            raise IOError('unsupported content encoding: %s' % self.encoding)
+
+
+    def count(self, data):
+        """
+        count decoded data, 超过 max_size 时抛出 BodyTooLargeError
+        """
+        self.decoded_size += len(data)
+        if self.decoded_size > self.max_size:
+            raise BodyTooLargeError('decoded body too large: > %d bytes' % self.max_size)
+        return data
+
+
+    def decode(self, chunk):
+        """
+        decode a chunk of the body
+
+        Returns:
+            解压后的数据，可能为空串
+
+        Raises:
+            BodyTooLargeError: 压缩前或解压后超过 max_size
+            IOError: 数据无法解压
+        """
+        self.wire_size += len(chunk)
+        if self.wire_size > self.max_size:
+            raise BodyTooLargeError('body too large: > %d bytes' % self.max_size)
+        if self.encoding == 'identity':
+            return self.count(chunk)
+        if self.encoding == 'deflate' and self.decompressor is None:
+            # 第一个输入块可能不足 2 个字节，凑够 zlib 头后再选择格式
+            self.pending += chunk
+            if len(self.pending) < 2:
+                return ''
+            chunk = self.pending
+            self.pending = ''
+            self.create_deflate_decompressor(chunk)
+        try:
+            if self.encoding == 'br':
+                return self.count(self.decompressor.process(chunk))
+            parts = []
+            while chunk:
+                parts.append(self.count(self.decompressor.decompress(chunk, DECODE_CHUNK_SIZE)))
+                chunk = self.decompressor.unconsumed_tail
+            return ''.join(parts)
+        except (zlib.error, getattr(brotli, 'error', zlib.error)) as e:
+            raise IOError('bad %s content: %s' % (self.encoding, e))
+
+
+    def create_deflate_decompressor(self, head):
+        """
+        create the deflate decompressor by the first bytes of the body
+        """
+        # 规范要求 zlib 格式，但不少服务端发送不带 zlib 头的原始 deflate 数据
+        is_zlib = len(head) >= 2 and (ord(head[0]) & 0x0f) == 8 and \
+            (ord(head[0]) * 256 + ord(head[1])) % 31 == 0
+        self.decompressor = zlib.decompressobj(zlib.MAX_WBITS if is_zlib else -zlib.MAX_WBITS)
+
+
+    def flush(self):
+        """
+        get data left in the decompressor at the end of the body
+        """
+        if self.encoding in ('identity', 'br'):
+            return ''
+        try:
+            data = ''
+            if self.pending:
+                # 整个 body 不足 2 个字节，不可能带 zlib 头
+                self.create_deflate_decompressor(self.pending)
+                data = self.count(self.decompressor.decompress(self.pending))
+                self.pending = ''
+            if self.decompressor is None:
+                return data
+            return data + self.count(self.decompressor.flush())
+        except zlib.error as e:
+            raise IOError('bad %s content: %s' % (self.encoding, e))
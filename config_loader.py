@@ -10,6 +10,20 @@ Date: 2020-11-02 23:41:00
 import ConfigParser
 import logging
 
+import seen_store
+import html_parser
+import canonicalize
+import scheduler
+import target_store
+import simhash
+
+ENGINES = ('thread', 'async')
+# 只对线程引擎生效的配置项：异步引擎使用 tornado 自己的连接管理，在事件循环中解析，
+# 不区分下载通道，也不读写 HTTP 校验器缓存
+THREAD_ENGINE_OPTIONS = ('max_conn_per_host', 'max_conn_total', 'parse_processes',
+                         'parse_batch_size', 'parse_queue_size', 'http_cache_path',
+                         'target_thread_count', 'target_crawl_interval')
+
 class ConfigLoader(object):
     """
     This class is used to load config file.
@@ -49,15 +63,216 @@ class ConfigLoader(object):
             self.configs['thread_count'] = config_parser.getint('spider', 'thread_count')
             self.configs['try_times'] = config_parser.getint('spider', 'try_times')
             self.configs['tag_dict'] = {'a':'href', 'img':'src', 'link':'href', 'script':'src'}
+
+            # 以下为可选配置项，缺省时使用默认值
+            self.configs['seen_store'] = self.get_optional(config_parser, 'seen_store',
+                                                           'memory').strip()
+            self.configs['bloom_error_rate'] = self.get_optional(config_parser, 'bloom_error_rate',
+                                                                 0.001, float)
+            self.configs['bloom_initial_capacity'] = self.get_optional(config_parser,
+                                                                       'bloom_initial_capacity',
+                                                                       100000, int)
+            self.configs['seen_store_path'] = self.get_optional(config_parser, 'seen_store_path',
+                                                                './seen.db').strip()
+            self.configs['engine'] = self.get_optional(config_parser, 'engine', 'thread').strip()
+            self.configs['async_concurrency'] = self.get_optional(config_parser,
+                                                                  'async_concurrency', 100, int)
+            self.configs['max_conn_per_host'] = self.get_optional(config_parser,
+                                                                  'max_conn_per_host', 8, int)
+            self.configs['max_conn_total'] = self.get_optional(config_parser, 'max_conn_total',
+                                                               64, int)
+            self.configs['max_host_concurrency'] = self.get_optional(config_parser,
+                                                                     'max_host_concurrency',
+                                                                     0, int)
+            self.configs['parser'] = self.get_optional(config_parser, 'parser',
+                                                       'html5lib').strip()
+            self.configs['parse_processes'] = self.get_optional(config_parser, 'parse_processes',
+                                                                0, int)
+            self.configs['parse_batch_size'] = self.get_optional(config_parser,
+                                                                 'parse_batch_size', 16, int)
+            self.configs['parse_queue_size'] = self.get_optional(config_parser,
+                                                                 'parse_queue_size', 256, int)
+            self.configs['checkpoint_dir'] = self.get_optional(config_parser, 'checkpoint_dir',
+                                                               '').strip()
+            self.configs['checkpoint_interval'] = self.get_optional(config_parser,
+                                                                    'checkpoint_interval',
+                                                                    10.0, float)
+            self.configs['max_body_size'] = self.get_optional(config_parser, 'max_body_size',
+                                                              10 * 1024 * 1024, int)
+            self.configs['canonicalize'] = self.get_optional(config_parser, 'canonicalize',
+                                                             1, int) != 0
+            self.configs['canonical_sort_query'] = self.get_optional(config_parser,
+                                                                     'canonical_sort_query',
+                                                                     0, int) != 0
+            self.configs['canonical_strip_params'] = self.get_optional(
+                config_parser, 'canonical_strip_params',
+                canonicalize.DEFAULT_STRIP_PARAMS, self.parse_list)
+            self.configs['canonical_strip_trailing_slash'] = self.get_optional(
+                config_parser, 'canonical_strip_trailing_slash', 0, int) != 0
+            self.configs['frontier_scorer'] = self.get_optional(config_parser, 'frontier_scorer',
+                                                                'none').strip()
+            self.configs['frontier_memory_limit'] = self.get_optional(config_parser,
+                                                                      'frontier_memory_limit',
+                                                                      0, int)
+            self.configs['target_thread_count'] = self.get_optional(config_parser,
+                                                                    'target_thread_count', 4, int)
+            self.configs['target_crawl_interval'] = self.get_optional(
+                config_parser, 'target_crawl_interval', self.configs['crawl_interval'], float)
+            self.configs['http_cache_path'] = self.get_optional(config_parser, 'http_cache_path',
+                                                                '').strip()
+            self.configs['output_layout'] = self.get_optional(config_parser, 'output_layout',
+                                                              'flat').strip()
+            self.configs['cas_pack_max_size'] = self.get_optional(config_parser,
+                                                                  'cas_pack_max_size', 0, int)
+            self.configs['cas_segment_size'] = self.get_optional(config_parser,
+                                                                 'cas_segment_size',
+                                                                 64 * 1024 * 1024, int)
+            self.configs['stats_interval'] = self.get_optional(config_parser, 'stats_interval',
+                                                               10.0, float)
+            self.configs['stats_port'] = self.get_optional(config_parser, 'stats_port', 0, int)
+            self.configs['dns_cache_ttl'] = self.get_optional(config_parser, 'dns_cache_ttl',
+                                                              300.0, float)
+            self.configs['dns_negative_ttl'] = self.get_optional(config_parser, 'dns_negative_ttl',
+                                                                 30.0, float)
+            self.configs['dns_prefetch_threads'] = self.get_optional(config_parser,
+                                                                     'dns_prefetch_threads',
+                                                                     2, int)
+            self.configs['cluster_nodes'] = self.get_optional(config_parser, 'cluster_nodes', (),
+                                                              self.parse_list)
+            self.configs['cluster_node_id'] = self.get_optional(config_parser, 'cluster_node_id',
+                                                                0, int)
+            self.configs['cluster_batch_size'] = self.get_optional(config_parser,
+                                                                   'cluster_batch_size', 100, int)
+            self.configs['cluster_flush_interval'] = self.get_optional(config_parser,
+                                                                       'cluster_flush_interval',
+                                                                       0.2, float)
+            self.configs['near_dup_distance'] = self.get_optional(config_parser,
+                                                                  'near_dup_distance', -1, int)
+            self.configs['robots'] = self.get_optional(config_parser, 'robots', 1, int) != 0
+            self.configs['robots_ttl'] = self.get_optional(config_parser, 'robots_ttl',
+                                                           86400.0, float)
+            self.configs['robots_failure_ttl'] = self.get_optional(config_parser,
+                                                                   'robots_failure_ttl',
+                                                                   600.0, float)
+            self.configs['adaptive'] = self.get_optional(config_parser, 'adaptive', 1, int) != 0
+            self.configs['retry_base_delay'] = self.get_optional(config_parser,
+                                                                 'retry_base_delay', 1.0, float)
+            self.configs['retry_max_delay'] = self.get_optional(config_parser, 'retry_max_delay',
+                                                                60.0, float)
+            self.configs['breaker_threshold'] = self.get_optional(config_parser,
+                                                                  'breaker_threshold', 5, int)
+            self.configs['breaker_cooldown'] = self.get_optional(config_parser, 'breaker_cooldown',
+                                                                 30.0, float)
+            self.configs['adaptive_latency_factor'] = self.get_optional(config_parser,
+                                                                        'adaptive_latency_factor',
+                                                                        2.0, float)
+            self.configs['host_intervals'] = self.get_host_section(config_parser,
+                                                                   'host_interval', float)
+            self.configs['host_concurrency'] = self.get_host_section(config_parser,
+                                                                     'host_concurrency', int)
         except ConfigParser.NoSectionError as e:
             logging.error('CONFIG ERROR: No section: \'spider\', %s' % e)
             return False
         except ConfigParser.NoOptionError as e:
             logging.error('CONFIG ERROR: No option, %s' % e)
             return False
+        except ValueError as e:
+            logging.error('CONFIG ERROR: Bad value, %s' % e)
+            return False
+
+        if self.configs['seen_store'] not in seen_store.SEEN_STORE_BACKENDS:
+            logging.error('CONFIG ERROR: Unknown seen_store: %s' % self.configs['seen_store'])
+            return False
+        if self.configs['engine'] not in ENGINES:
+            logging.error('CONFIG ERROR: Unknown engine: %s' % self.configs['engine'])
+            return False
+        if self.configs['parser'] not in html_parser.PARSER_BACKENDS:
+            logging.error('CONFIG ERROR: Unknown parser: %s' % self.configs['parser'])
+            return False
+        if self.configs['frontier_scorer'] not in scheduler.FRONTIER_SCORERS:
+            logging.error('CONFIG ERROR: Unknown frontier_scorer: %s' %
+                          self.configs['frontier_scorer'])
+            return False
+        if self.configs['output_layout'] not in target_store.OUTPUT_LAYOUTS:
+            logging.error('CONFIG ERROR: Unknown output_layout: %s' %
+                          self.configs['output_layout'])
+            return False
+        if self.configs['near_dup_distance'] >= simhash.FINGERPRINT_BITS // 2:
+            logging.error('CONFIG ERROR: near_dup_distance must be less than %d' %
+                          (simhash.FINGERPRINT_BITS // 2))
+            return False
+        if self.configs['adaptive_latency_factor'] <= 1:
+            logging.error('CONFIG ERROR: adaptive_latency_factor must be greater than 1')
+            return False
+        if self.configs['parser'] == 'lxml' and html_parser.lxml is None:
+            logging.error('CONFIG ERROR: parser = lxml but lxml is not installed')
+            return False
+        self.configs['ignored_options'] = []
+        if self.configs['engine'] == 'async':
+            # 空值和 0 表示未启用该功能，不需要提示
+            self.configs['ignored_options'] = [
+                option for option in THREAD_ENGINE_OPTIONS
+                if config_parser.has_option('spider', option) and
+                config_parser.get('spider', option).strip() not in ('', '0')]
+            if self.configs['ignored_options']:
+                logging.warn('CONFIG WARNING: %s not supported with engine = async, ignored' %
+                             ', '.join(self.configs['ignored_options']))
         return True
 
 
+    def get_optional(self, config_parser, option, default, value_type=str, section='spider'):
+        """
+        get an optional option, return default if the option does not exist
+
+        Args:
+            config_parser: ConfigParser 对象
+            option       : 配置项名
+            default      : 缺省值
+            value_type   : 配置值类型转换函数
+            section      : 配置段名
+
+        Returns:
+            转换后的配置值
+
+        Raises:
+            ValueError: 配置值无法转换为 value_type
+        """
+        if not config_parser.has_option(section, option):
+            return default
+        return value_type(config_parser.get(section, option))
+
+
+    def parse_list(self, value):
+        """
+        parse a comma separated option value into a tuple, 忽略空项
+        """
+        return tuple(item.strip() for item in value.split(',') if item.strip())
+
+
+    def get_host_section(self, config_parser, section, value_type):
+        """
+        get an optional section of per-host settings, e.g.
+
+            [host_interval]
+            www.example.com = 2
+
+        Args:
+            config_parser: ConfigParser 对象
+            section      : 配置段名
+            value_type   : 配置值类型转换函数
+
+        Returns:
+            host -> 配置值 的字典，配置段不存在时返回空字典
+
+        Raises:
+            ValueError: 配置值无法转换为 value_type
+        """
+        if not config_parser.has_section(section):
+            return {}
+        return dict((host.strip().lower(), value_type(value))
+                    for host, value in config_parser.items(section))
+
+
     def get_url_list_file(self):
         """
         get path of 'seeds-url' file
@@ -119,3 +334,354 @@ class ConfigLoader(object):
         get pic flag for Url-object
         """
         return self.configs['tag_dict']
+
+
+    def get_seen_store(self):
+        """
+        get backend name of seen-url store: memory / bloom / sqlite
+        """
+        return self.configs['seen_store']
+
+
+    def get_bloom_error_rate(self):
+        """
+        get false-positive rate of bloom seen store
+        """
+        return self.configs['bloom_error_rate']
+
+
+    def get_bloom_initial_capacity(self):
+        """
+        get initial capacity of bloom seen store
+        """
+        return self.configs['bloom_initial_capacity']
+
+
+    def get_seen_store_path(self):
+        """
+        get database path of sqlite seen store
+        """
+        return self.configs['seen_store_path']
+
+
+    def get_engine(self):
+        """
+        get crawl engine: thread / async
+        """
+        return self.configs['engine']
+
+
+    def get_async_concurrency(self):
+        """
+        get number of concurrent fetches of async engine
+        """
+        return self.configs['async_concurrency']
+
+
+    def get_max_conn_per_host(self):
+        """
+        get max keep-alive connections per host
+        """
+        return self.configs['max_conn_per_host']
+
+
+    def get_max_conn_total(self):
+        """
+        get max keep-alive connections of all hosts
+        """
+        return self.configs['max_conn_total']
+
+
+    def get_max_host_concurrency(self):
+        """
+        get default max concurrency per host, 0 means unlimited
+        """
+        return self.configs['max_host_concurrency']
+
+
+    def get_host_intervals(self):
+        """
+        get host-specific crawl intervals
+        """
+        return self.configs['host_intervals']
+
+
+    def get_host_concurrency(self):
+        """
+        get host-specific max concurrency
+        """
+        return self.configs['host_concurrency']
+
+
+    def get_max_body_size(self):
+        """
+        get max size in bytes of a response body
+        """
+        return self.configs['max_body_size']
+
+
+    def get_parser(self):
+        """
+        get html parser backend: html5lib / lxml / streaming
+        """
+        return self.configs['parser']
+
+
+    def get_parse_processes(self):
+        """
+        get number of parse processes, 0 means parsing in crawler threads
+        """
+        return self.configs['parse_processes']
+
+
+    def get_parse_batch_size(self):
+        """
+        get max pages per batch sent to parse processes
+        """
+        return self.configs['parse_batch_size']
+
+
+    def get_parse_queue_size(self):
+        """
+        get max pages waiting for parse processes
+        """
+        return self.configs['parse_queue_size']
+
+
+    def get_checkpoint_dir(self):
+        """
+        get checkpoint directory, empty means checkpoint is disabled
+        """
+        return self.configs['checkpoint_dir']
+
+
+    def get_checkpoint_interval(self):
+        """
+        get interval in seconds of flushing checkpoint to disk
+        """
+        return self.configs['checkpoint_interval']
+
+
+    def get_canonicalize(self):
+        """
+        get whether urls are canonicalized before dedup
+        """
+        return self.configs['canonicalize']
+
+
+    def get_canonical_sort_query(self):
+        """
+        get whether query parameters are sorted by name when canonicalizing
+        """
+        return self.configs['canonical_sort_query']
+
+
+    def get_canonical_strip_params(self):
+        """
+        get query parameter names (e.g. tracking params) stripped when canonicalizing
+        """
+        return self.configs['canonical_strip_params']
+
+
+    def get_canonical_strip_trailing_slash(self):
+        """
+        get whether trailing slash of path is stripped when canonicalizing
+        """
+        return self.configs['canonical_strip_trailing_slash']
+
+
+    def get_frontier_scorer(self):
+        """
+        get name of the scorer ordering urls of the same depth in frontier
+        """
+        return self.configs['frontier_scorer']
+
+
+    def get_frontier_memory_limit(self):
+        """
+        get max urls kept in memory by frontier, 0 means unbounded
+        """
+        return self.configs['frontier_memory_limit']
+
+
+    def get_target_thread_count(self):
+        """
+        get number of threads downloading target urls
+        """
+        return self.configs['target_thread_count']
+
+
+    def get_target_crawl_interval(self):
+        """
+        get per-host crawl interval of the target download lane
+        """
+        return self.configs['target_crawl_interval']
+
+
+    def get_http_cache_path(self):
+        """
+        get path of the http validator cache, empty means conditional requests are disabled
+        """
+        return self.configs['http_cache_path']
+
+
+    def get_output_layout(self):
+        """
+        get layout of saved targets: flat or cas (content-addressed)
+        """
+        return self.configs['output_layout']
+
+
+    def get_cas_pack_max_size(self):
+        """
+        get max size of objects packed into segment files, 0 means no packing
+        """
+        return self.configs['cas_pack_max_size']
+
+
+    def get_cas_segment_size(self):
+        """
+        get max size of a segment file
+        """
+        return self.configs['cas_segment_size']
+
+
+    def get_stats_interval(self):
+        """
+        get interval in seconds of logging a stats line, 0 means disabled
+        """
+        return self.configs['stats_interval']
+
+
+    def get_stats_port(self):
+        """
+        get port of the local http stats endpoint, 0 means disabled
+        """
+        return self.configs['stats_port']
+
+
+    def get_dns_cache_ttl(self):
+        """
+        get seconds of caching a resolved host, 0 means no dns cache
+        """
+        return self.configs['dns_cache_ttl']
+
+
+    def get_dns_negative_ttl(self):
+        """
+        get seconds of caching a failed host resolution
+        """
+        return self.configs['dns_negative_ttl']
+
+
+    def get_dns_prefetch_threads(self):
+        """
+        get number of threads resolving hosts of extracted links, 0 means no prefetching
+        """
+        return self.configs['dns_prefetch_threads']
+
+
+    def get_cluster_nodes(self):
+        """
+        get 'host:port' addresses of all cluster nodes, empty means standalone
+        """
+        return self.configs['cluster_nodes']
+
+
+    def get_cluster_node_id(self):
+        """
+        get index of this node in cluster_nodes, 0 is the coordinator
+        """
+        return self.configs['cluster_node_id']
+
+
+    def get_cluster_batch_size(self):
+        """
+        get number of links forwarded to another node in one message
+        """
+        return self.configs['cluster_batch_size']
+
+
+    def get_cluster_flush_interval(self):
+        """
+        get max seconds a link waits before being forwarded
+        """
+        return self.configs['cluster_flush_interval']
+
+
+    def get_near_dup_distance(self):
+        """
+        get max hamming distance of simhash fingerprints of near-duplicate pages,
+        negative means no near-duplicate detection
+        """
+        return self.configs['near_dup_distance']
+
+
+    def get_robots(self):
+        """
+        get whether robots.txt is obeyed
+        """
+        return self.configs['robots']
+
+
+    def get_robots_ttl(self):
+        """
+        get seconds of caching a fetched robots.txt
+        """
+        return self.configs['robots_ttl']
+
+
+    def get_robots_failure_ttl(self):
+        """
+        get seconds of caching a failed robots.txt fetch (5xx or network error)
+        """
+        return self.configs['robots_failure_ttl']
+
+
+    def get_adaptive(self):
+        """
+        get whether concurrency and retries adapt to observed latency and errors
+        """
+        return self.configs['adaptive']
+
+
+    def get_retry_base_delay(self):
+        """
+        get max seconds before the first retry, doubled on each further retry
+        """
+        return self.configs['retry_base_delay']
+
+
+    def get_retry_max_delay(self):
+        """
+        get upper bound of seconds before a retry
+        """
+        return self.configs['retry_max_delay']
+
+
+    def get_breaker_threshold(self):
+        """
+        get number of consecutive failures pausing a host, 0 means no circuit breaker
+        """
+        return self.configs['breaker_threshold']
+
+
+    def get_breaker_cooldown(self):
+        """
+        get seconds a host is paused when its circuit breaker first opens
+        """
+        return self.configs['breaker_cooldown']
+
+
+    def get_adaptive_latency_factor(self):
+        """
+        get ratio of recent to long-term latency regarded as congestion
+        """
+        return self.configs['adaptive_latency_factor']
+
+
+    def get_ignored_options(self):
+        """
+        get options set in the config file but not supported by the selected engine
+        """
+        return self.configs['ignored_options']
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: connection_pool.py
+Description: 按 host 划分的 HTTP keep-alive 连接池，由所有抓取线程共享
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import httplib
+import socket
+import ssl
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+
+import compression
+import metrics
+
+USER_AGENT = 'MiniSpider/1.0'
+MAX_REDIRECTS = 5
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+# 对非 ASCII 字符做百分号编码时保留的 URL 合法字符
+URL_SAFE_CHARS = "%/:=&?~#+!$,;'@()*[]"
+
+
+class PooledResponse(object):
+    """
+    Response wrapper, 读完或关闭时自动把连接归还给连接池
+
+    Attributes:
+        pool     : 所属连接池
+        key      : 连接池 key (scheme, host, port)
+        conn     : httplib 连接
+        response : httplib.HTTPResponse
+        url      : 最终 url（跟随重定向之后）
+        code     : HTTP 状态码
+    """
+    def __init__(self, pool, key, conn, response, url):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.url = url
+        self.code = response.status
+        self.released = False
+
+
+    def read(self, amt=None):
+        """
+        read body, 读到末尾时归还连接
+        """
+        data = self.response.read(amt)
+        if self.response.isclosed():
+            self.close()
+        return data
+
+
+    def getheader(self, name, default=None):
+        """
+        get response header
+        """
+        return self.response.getheader(name, default)
+
+
+    def info(self):
+        return self.response.msg
+
+
+    def geturl(self):
+        return self.url
+
+
+    def getcode(self):
+        return self.code
+
+
+    def close(self):
+        """
+        归还连接：body 已读完且服务端允许 keep-alive 时放回空闲连接池，否则关闭连接
+        """
+        if self.released:
+            return
+        self.released = True
+        reusable = self.response.isclosed() and not self.response.will_close
+        self.pool.release(self.key, self.conn, reusable)
+
+
+class ConnectionPool(object):
+    """
+    Per-host keep-alive connection pool, thread-safe.
+
+    Attributes:
+        max_per_host : 单个 host 的最大连接数（包括使用中和空闲的）
+        max_total    : 全部 host 的最大连接数
+        ssl_context  : 所有 https 连接共享的 SSL context
+        dns_cache    : 共享的 DNS 缓存，None 时每个新连接都调用 getaddrinfo
+        idle_conns   : key -> 空闲连接列表
+        host_conns   : key -> 该 host 的连接数
+        total_conns  : 全部连接数
+        request_num  : 发出的请求数
+        reused_num   : 复用已有连接的请求数
+    """
+    def __init__(self, max_per_host=8, max_total=64, dns_cache=None):
+        self.max_per_host = max_per_host
+        self.max_total = max_total
+        self.dns_cache = dns_cache
+        # 与原先 urllib2 的行为一致，不校验证书；只创建一次
+        self.ssl_context = ssl._create_unverified_context()
+        self.idle_conns = {}
+        self.host_conns = {}
+        self.total_conns = 0
+        self.request_num = 0
+        self.reused_num = 0
+        self.cond = threading.Condition(threading.Lock())
+
+
+    def urlopen(self, url, timeout, headers=None):
+        """
+        send a GET request through a pooled connection, following redirects
+
+        Args:
+            url     : 请求 url
+            timeout : socket 超时时间
+            headers : 额外的请求头
+
+        Returns:
+            PooledResponse 对象
+
+        Raises:
+            urllib2.HTTPError: HTTP 状态码 >= 400
+            IOError/httplib.HTTPException: 网络错误
+        """
+        for _ in xrange(MAX_REDIRECTS + 1):
+            response = self.request(url, timeout, headers)
+            location = response.getheader('location')
+            if response.code not in REDIRECT_CODES or not location:
+                break
+            self.discard_body(response)
+            url = urlparse.urljoin(url, location)
+        else:
+            raise urllib2.HTTPError(url, response.code, 'too many redirects', None, None)
+
+        if response.code >= 400:
+            self.discard_body(response)
+            raise urllib2.HTTPError(url, response.code, response.response.reason,
+                                    response.info(), None)
+        return response
+
+
+    def request(self, url, timeout, headers=None):
+        """
+        send a single GET request without following redirects
+
+        复用的空闲连接可能已被服务端关闭，此时换一个新连接重试一次
+        """
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+        url = urllib.quote(url, safe=URL_SAFE_CHARS)
+        parsed = urlparse.urlsplit(url)
+        scheme = parsed.scheme.lower()
+        if scheme not in DEFAULT_PORTS:
+            raise IOError('unsupported url scheme: %s' % url)
+        key = (scheme, parsed.hostname, parsed.port or DEFAULT_PORTS[scheme])
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+
+        request_headers = {'User-Agent': USER_AGENT,
+                           'Accept-Encoding': compression.ACCEPT_ENCODING}
+        if headers:
+            request_headers.update(headers)
+
+        while True:
+            conn, reused = self.acquire(key, timeout)
+            try:
+                if not reused:
+                    self.connect(conn, key, timeout)
+                start = time.time()
+                conn.request('GET', path, headers=request_headers)
+                response = conn.getresponse()
+                metrics.observe('ttfb_time', time.time() - start)
+            except (httplib.HTTPException, socket.error) as e:
+                self.release(key, conn, False)
+                if reused and not isinstance(e, socket.timeout):
+                    continue
+                raise
+            except Exception:
+                self.release(key, conn, False)
+                raise
+            with self.cond:
+                self.request_num += 1
+                if reused:
+                    self.reused_num += 1
+            return PooledResponse(self, key, conn, response, url)
+
+
+    def discard_body(self, response):
+        """
+        读掉剩余 body 以便连接可以复用
+        """
+        try:
+            while response.read(65536):
+                pass
+        except (httplib.HTTPException, socket.error):
+            pass
+        response.close()
+
+
+    def acquire(self, key, timeout):
+        """
+        get an idle connection of key, or create a new one within limits
+
+        Returns:
+            (conn, reused): 连接对象，是否为复用的连接
+        """
+        with self.cond:
+            while True:
+                idle = self.idle_conns.get(key)
+                if idle:
+                    conn = idle.pop()
+                    if conn.sock is not None:
+                        conn.sock.settimeout(timeout)
+                    return (conn, True)
+
+                if self.host_conns.get(key, 0) < self.max_per_host:
+                    if self.total_conns >= self.max_total:
+                        # 总数已满时关闭其它 host 的一个空闲连接腾出名额
+                        self.evict_idle()
+                    if self.total_conns < self.max_total:
+                        self.host_conns[key] = self.host_conns.get(key, 0) + 1
+                        self.total_conns += 1
+                        break
+                self.cond.wait()
+
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(host, port, timeout=timeout,
+                                           context=self.ssl_context)
+        else:
+            conn = httplib.HTTPConnection(host, port, timeout=timeout)
+        return (conn, False)
+
+
+    def connect(self, conn, key, timeout):
+        """
+        resolve and connect a new connection, 分别统计 DNS 解析和建立连接（含 TLS 握手）的耗时
+        """
+        scheme, host, port = key
+        start = time.time()
+        if self.dns_cache is not None:
+            addrinfo = self.dns_cache.resolve(host, port)
+        else:
+            addrinfo = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        family, socktype, proto, _, sockaddr = addrinfo[0]
+        resolved = time.time()
+        metrics.observe('dns_time', resolved - start)
+        sock = socket.socket(family, socktype, proto)
+        try:
+            sock.settimeout(timeout)
+            sock.connect(sockaddr)
+            if scheme == 'https':
+                sock = self.ssl_context.wrap_socket(sock, server_hostname=host)
+        except Exception:
+            sock.close()
+            raise
+        metrics.observe('connect_time', time.time() - resolved)
+        conn.sock = sock
+
+
+    def evict_idle(self):
+        """
+        close one idle connection of any host, 调用方需持有 self.cond
+        """
+        for key, idle in self.idle_conns.iteritems():
+            if idle:
+                conn = idle.pop(0)
+                conn.close()
+                self.drop(key)
+                return True
+        return False
+
+
+    def drop(self, key):
+        """
+        forget a closed connection of key, 调用方需持有 self.cond
+        """
+        self.host_conns[key] -= 1
+        self.total_conns -= 1
+        self.cond.notify_all()
+
+
+    def release(self, key, conn, reusable):
+        """
+        return a connection to the pool, or close it if not reusable
+        """
+        with self.cond:
+            if reusable and conn.sock is not None:
+                self.idle_conns.setdefault(key, []).append(conn)
+                self.cond.notify_all()
+                return
+            conn.close()
+            self.drop(key)
+
+
+    def reuse_ratio(self):
+        """
+        ratio of requests sent over a reused connection
+        """
+        if self.request_num == 0:
+            return 0.0
+        return float(self.reused_num) / self.request_num
+
+
+    def close(self):
+        """
+        close all idle connections
+        """
+        with self.cond:
+            for key, idle in self.idle_conns.iteritems():
+                while idle:
+                    idle.pop().close()
+                    self.drop(key)
@@ -9,13 +9,16 @@ Date: 2020-11-02 23:41:00
 
 import threading
 import logging
-import urllib
 import re
+import httplib
+import hashlib
 import time
-import os
 
 import html_parser
 import downloader
+import http_cache
+import metrics
+
 
 class CrawlerThread(threading.Thread):
     """
@@ -24,23 +27,49 @@ class CrawlerThread(threading.Thread):
     Attributes:
         process_request : request callback
         process_response: response callback
+        process_retry   : retry callback process_retry(url_obj, delay)，把失败的 url 延迟放回队列
         output_dir      : 存放爬取页面的目录
+        target_store    : target 文件的存储（flat / cas 布局）
         crawl_interval  : 爬取间隔
         crawl_timeout   : 爬取时间延迟
         target_url      : 目标文件链接格式
         max_depth       : 爬取最大深度
         tag_dict        : 链接标签字典
+        try_times       : 下载尝试次数
+        conn_pool       : 所有线程共享的 keep-alive 连接池
+        max_body_size   : 响应 body 的最大字节数
+        parser          : html 解析后端
+        parse_pool      : 解析进程池，None 表示在本线程中解析
+        http_cache      : HTTP 校验器缓存，None 表示不发送条件请求
+        with_fingerprint: 解析时是否计算页面的 SimHash 指纹
+        robots_cache    : robots.txt 规则缓存，None 表示不遵守 robots.txt
+        adaptive        : 自适应并发与重试控制器，None 表示在 Downloader 中立即重试
+        target_error    : 最近一次保存 target 失败的异常
+        accounted       : 当前 url 是否已回调 process_response / process_retry 或交给解析进程池
     """
-    def __init__(self, name, process_request, process_response, args_dict):
+    def __init__(self, name, process_request, process_response, args_dict, process_retry=None):
         super(CrawlerThread, self).__init__(name=name)
         self.process_request = process_request
-        self.process_response = process_response
+        self.process_response = self.track(process_response)
+        self.process_retry = self.track(process_retry) if process_retry is not None else None
+        self.accounted = False
         self.output_dir = args_dict['output_dir']
+        self.target_store = args_dict['target_store']
         self.crawl_interval = args_dict['crawl_interval']
         self.crawl_timeout = args_dict['crawl_timeout']
         self.url_pattern = args_dict['url_pattern']
         self.max_depth = args_dict['max_depth']
         self.tag_dict = args_dict['tag_dict']
+        self.try_times = args_dict['try_times']
+        self.conn_pool = args_dict['conn_pool']
+        self.max_body_size = args_dict['max_body_size']
+        self.parser = args_dict['parser']
+        self.parse_pool = args_dict['parse_pool']
+        self.http_cache = args_dict['http_cache']
+        self.with_fingerprint = args_dict['with_fingerprint']
+        self.robots_cache = args_dict['robots_cache']
+        self.adaptive = args_dict['adaptive']
+        self.target_error = None
 
 
     def run(self):
@@ -48,38 +77,205 @@ class CrawlerThread(threading.Thread):
         线程工作函数
         """
         while 1:
-            url_obj = self.process_request()
-            time.sleep(self.crawl_interval)
+            # 全局并发上限低于线程数时，多出的线程在这里等待
+            if self.adaptive is not None:
+                self.adaptive.acquire()
+            try:
+                # 抓取间隔由 scheduler 按 host 控制，这里不再 sleep
+                url_obj = self.process_request()
+                if url_obj is None:
+                    # frontier 已停止
+                    return
+                self.crawl_safely(url_obj, self.crawl)
+            finally:
+                if self.adaptive is not None:
+                    self.adaptive.release()
 
-            logging.info('%-12s  : get a url in depth: ' %
-                         threading.currentThread().getName() + str(url_obj.get_depth()))
 
-            # flag = 0 表示正常下载，-1 表示下载失败，2 表示 > max_depth 
-            if self.is_target_url(url_obj.get_url()):
-                flag = -1
-                if self.save_target_url_page(url_obj.get_url()):
-                    flag = 1
-                self.process_response(url_obj, flag)
-                continue
+    def track(self, callback):
+        """
+        wrap a callback so that calling it from this thread marks the current url accounted,
+        解析进程池的结果线程中的调用不影响本线程当前的 url
+        """
+        def tracked(*args, **kwargs):
+            if threading.current_thread() is self:
+                # 回调即使中途抛出异常也会 task_done（见 MiniSpider.process_response），
+                # 调用即算计入，再补报 -1 会重复 task_done
+                self.accounted = True
+            return callback(*args, **kwargs)
+        return tracked
+
+
+    def crawl_safely(self, url_obj, crawl):
+        """
+        call crawl(url_obj), 未预期的异常（如解析器的 bug）记录日志并按下载失败计入，
+        否则该 url 没有 task_done，join() 永远等待；线程继续处理下一个 url
+        """
+        self.accounted = False
+        try:
+            crawl(url_obj)
+        except Exception:
+            logging.exception(' * Crawl error: %s' % url_obj.get_url())
+            if not self.accounted:
+                try:
+                    self.process_response(url_obj, -1)
+                except Exception:
+                    logging.exception(' * Record error failed: %s' % url_obj.get_url())
+
+
+    def crawl(self, url_obj):
+        """
+        crawl a url and call process_response or process_retry exactly once
+        """
+        # 每个 url 一条，只在 debug 级别输出，参数延迟格式化
+        logging.debug('%-12s  : get a url in depth: %s', self.name, url_obj.get_depth())
+
+        # flag = 0 表示正常下载，-1 表示下载失败，2 表示 > max_depth，3 表示被 robots.txt 禁止
+        if not self.is_allowed(url_obj.get_url()):
+            self.process_response(url_obj, 3)
+            return
+
+        if self.adaptive is not None and self.adaptive.is_given_up(url_obj.get_url()):
+            # host 已被熔断器放弃，不再请求
+            self.process_response(url_obj, -1)
+            return
 
-            if url_obj.get_depth() < self.max_depth:
-                downloader_inst = downloader.Downloader(url_obj, self.crawl_timeout)
-                response, flag = downloader_inst.run()  # flag = 0 or -1
+        if self.is_target_url(url_obj.get_url()):
+            self.crawl_target(url_obj)
+            return
 
-                if flag == -1:  # download failed
-                    self.process_response(url_obj, flag)
-                    continue
+        if url_obj.get_depth() >= self.max_depth:
+            flag = 2  # depth > max_depth 的正常URL
+            self.process_response(url_obj, flag)
+            return
 
-                if flag == 0:  # download sucess
-                    content = response.read()
-                    url = url_obj.get_url()
-                    soup = html_parser.HtmlParser(content, self.tag_dict, url)
-                    extract_url_list = soup.extract_url()
+        cache_entry = None
+        if self.http_cache is not None:
+            cache_entry = self.http_cache.get(url_obj.get_url())
+            # 没有缓存链接时无法复用上次的结果，不发送条件请求
+            if cache_entry is not None and cache_entry.links is None:
+                cache_entry = None
+        # 启用自适应控制时只尝试一次，失败后由 frontier 延迟重试，不占用本线程
+        try_times = 1 if self.adaptive is not None else self.try_times
+        downloader_inst = downloader.Downloader(
+            url_obj, self.crawl_timeout, try_times, self.conn_pool,
+            http_cache.HttpCache.conditional_headers(cache_entry))
+        start = time.time()
+        response, flag = downloader_inst.run()  # flag = 0 or -1
+        if self.adaptive is not None:
+            self.adaptive.record(url_obj.get_url(), time.time() - start, downloader_inst.error)
 
-                    self.process_response(url_obj, flag, extract_url_list)
-            else:
-                flag = 2  # depth > max_depth 的正常URL
+        if flag == -1:  # download failed
+            if not self.retry_later(url_obj, downloader_inst.error):
                 self.process_response(url_obj, flag)
+            return
+
+        if cache_entry is not None and response.code == 304:
+            # 页面未变化，复用上次抽取的链接，不再下载和解析
+            self.conn_pool.discard_body(response)
+            self.http_cache.record_hit(cache_entry)
+            self.process_response(url_obj, flag, cache_entry.links)
+            return
+
+        # download sucess
+        try:
+            content = downloader.read_body(response, self.max_body_size)
+        except (IOError, httplib.HTTPException) as e:
+            logging.warn(' * Read body failed: %s - %s' % (url_obj.get_url(), e))
+            self.process_response(url_obj, -1)
+            return
+        url = url_obj.get_url()
+        charset = html_parser.parse_charset(response.getheader('content-type'))
+        store_links = self.make_cache_store(url, response, content)
+        if self.parse_pool is not None:
+            # 交给解析进程池，本线程继续抓取；解析完成后由回调调用 process_response
+            self.parse_pool.submit(content, url, charset,
+                                   self.make_parse_callback(url_obj, store_links))
+            self.accounted = True
+            return
+
+        with metrics.timer('parse_time'):
+            soup = html_parser.HtmlParser(content, self.tag_dict, url, self.parser,
+                                          charset, self.with_fingerprint)
+            extract_url_list = soup.extract_url()
+        store_links(extract_url_list)
+
+        self.process_response(url_obj, flag, extract_url_list, soup.fingerprint)
+
+
+    def crawl_target(self, url_obj):
+        """
+        save a target url, 失败时按 retry_later 的规则重试
+        """
+        flag = -1
+        if self.save_target_url_page(url_obj.get_url()):
+            flag = 1
+        if self.adaptive is not None:
+            # 流式保存的耗时与 body 大小有关，不作为延迟样本
+            self.adaptive.record(url_obj.get_url(), None, self.target_error)
+        if flag == -1 and self.retry_later(url_obj, self.target_error):
+            return
+        self.process_response(url_obj, flag)
+
+
+    def retry_later(self, url_obj, error):
+        """
+        schedule a failed url to be retried after backoff
+
+        Returns:
+            True/False: 已安排重试返回 True，不重试（未启用自适应控制、错误不可重试或次数用尽）
+                        返回 False
+        """
+        if self.adaptive is None or self.process_retry is None:
+            return False
+        delay = self.adaptive.retry_delay(url_obj, error)
+        if delay is None:
+            return False
+        logging.info(' * Retry in %.2fs: %s' % (delay, url_obj.get_url()))
+        self.process_retry(url_obj, delay)
+        return True
+
+
+    def is_allowed(self, url):
+        """
+        check url against robots.txt, 该 host 的规则未缓存时在本线程中抓取 robots.txt
+        """
+        return self.robots_cache is None or self.robots_cache.allowed(url)
+
+
+    def make_parse_callback(self, url_obj, store_links):
+        """
+        make callback for parse pool, 解析完成后缓存链接并调用 process_response
+        """
+        def parse_callback(extract_url_list, fingerprint):
+            store_links(extract_url_list)
+            self.process_response(url_obj, 0, extract_url_list, fingerprint)
+        return parse_callback
+
+
+    def make_cache_store(self, url, response, content):
+        """
+        make a function storing validators and extracted links of a page into http cache
+
+        Args:
+            url      : 页面 url
+            response : 页面的响应
+            content  : 页面内容
+
+        Returns:
+            以 extract_url_list 为参数的函数，未启用缓存时什么也不做
+        """
+        if self.http_cache is None:
+            return lambda extract_url_list: None
+        # 在解析前取出校验器，不必让 response 存活到解析完成
+        etag = response.getheader('etag')
+        last_modified = response.getheader('last-modified')
+        content_hash = hashlib.md5(content).hexdigest()
+
+        def store_links(extract_url_list):
+            self.http_cache.store(url, etag, last_modified, content_hash, len(content),
+                                  extract_url_list)
+        return store_links
 
 
     def is_target_url(self, url):
@@ -97,24 +293,61 @@ class CrawlerThread(threading.Thread):
 
     def save_target_url_page(self, url):
         """
-        save target_url page into output_dir
+        save target_url page into target store
 
         Args:
             url: 输入 url
 
         Returns:
-            none
+            True/False: 保存成功（或未变化）返回 True，否则返回 False
         """
-        if not os.path.isdir(self.output_dir):
-            os.mkdir(self.output_dir)
-
-        file_name = urllib.quote_plus(url)
-        if len(file_name) > 127:
-            file_name = file_name[-127:]
-        target_path = "{}/{}".format(self.output_dir, file_name)
+        self.target_error = None
+        cache_entry = None
+        if self.http_cache is not None and self.target_store.exists(url):
+            cache_entry = self.http_cache.get(url)
         try:
-            urllib.urlretrieve(url, target_path)
+            response = self.conn_pool.urlopen(url, self.crawl_timeout,
+                                              http_cache.HttpCache.conditional_headers(cache_entry))
+            if cache_entry is not None and response.code == 304:
+                # 文件未变化，不再重写
+                self.conn_pool.discard_body(response)
+                self.http_cache.record_hit(cache_entry)
+                return True
+            size, content_hash = self.target_store.save(url, response, self.max_body_size)
+            if self.http_cache is not None:
+                self.http_cache.store(url, response.getheader('etag'),
+                                      response.getheader('last-modified'), content_hash, size)
             return True
-        except IOError as e:
+        except (IOError, httplib.HTTPException) as e:
             logging.warn(' * Save target Faild: %s - %s' % (url, e))
-            return False
\ No newline at end of file
+            self.target_error = e
+            return False
+
+
+class TargetThread(CrawlerThread):
+    """
+    This class is a thread of the target download lane, 只负责保存 target url，
+    与抓取 HTML 的 CrawlerThread 互不阻塞
+    """
+    def run(self):
+        """
+        线程工作函数
+        """
+        while 1:
+            url_obj = self.process_request()
+            if url_obj is None:
+                return
+            self.crawl_safely(url_obj, self.crawl_lane_target)
+
+
+    def crawl_lane_target(self, url_obj):
+        """
+        crawl a url of the target lane
+        """
+        if not self.is_allowed(url_obj.get_url()):
+            self.process_response(url_obj, 3)
+            return
+        if self.adaptive is not None and self.adaptive.is_given_up(url_obj.get_url()):
+            self.process_response(url_obj, -1)
+            return
+        self.crawl_target(url_obj)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: dns_cache.py
+Description: 进程内 DNS 缓存，由所有抓取线程共享：解析结果按 TTL 缓存，解析失败也缓存一段时间，
+             同一 host 的并发解析只进行一次，并可在提取出链接后预先解析其 host
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import Queue
+import logging
+import socket
+import threading
+import time
+import urlparse
+
+import metrics
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+# 预解析队列上限，队列满时丢弃新的预解析请求
+PREFETCH_QUEUE_SIZE = 10000
+
+
+class DnsCache(object):
+    """
+    Thread-safe DNS cache with TTL and negative caching.
+
+    getaddrinfo 不返回记录的 TTL，这里对所有成功的解析结果使用同一个 ttl。
+
+    Attributes:
+        ttl               : 成功解析结果的缓存时间（秒）
+        negative_ttl      : 解析失败的缓存时间（秒）
+        max_size          : 最多缓存的 (host, port) 数
+        hit_num           : 命中缓存的次数（包括命中失败记录）
+        miss_num          : 未命中缓存、实际解析的次数
+        negative_hit_num  : 命中失败记录的次数
+        prefetch_num      : 预解析的次数
+    """
+    def __init__(self, ttl=300.0, negative_ttl=30.0, max_size=10000, prefetch_threads=0,
+                 resolver=socket.getaddrinfo, clock=time.time):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.resolver = resolver
+        self.clock = clock
+        # (host, port) -> (过期时间, addrinfo 列表或 socket.gaierror)
+        self.entries = {}
+        # (host, port) -> Event，正在解析的 key，其它线程等待其结果
+        self.pending = {}
+        self.hit_num = 0
+        self.miss_num = 0
+        self.negative_hit_num = 0
+        self.prefetch_num = 0
+        self.lock = threading.Lock()
+        self.prefetch_queue = Queue.Queue(PREFETCH_QUEUE_SIZE)
+        for index in xrange(prefetch_threads):
+            thread = threading.Thread(target=self.prefetch_loop,
+                                      name='dns prefetch - %d' % index)
+            thread.setDaemon(True)
+            thread.start()
+
+
+    def is_known(self, key):
+        """
+        whether key is cached or being resolved, 调用方需持有 self.lock
+        """
+        return key in self.pending or self.lookup(key) is not None
+
+
+    def lookup(self, key):
+        """
+        get unexpired entry of key, 调用方需持有 self.lock
+
+        Returns:
+            addrinfo 列表或 socket.gaierror，不存在或已过期时返回 None
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= self.clock():
+            del self.entries[key]
+            return None
+        return entry[1]
+
+
+    def store(self, key, result, ttl):
+        """
+        store a result of key, 缓存已满时先清理过期条目，仍满则任意淘汰一条，调用方需持有 self.lock
+        """
+        if len(self.entries) >= self.max_size and key not in self.entries:
+            now = self.clock()
+            for expired in [k for k, entry in self.entries.iteritems() if entry[0] <= now]:
+                del self.entries[expired]
+            if len(self.entries) >= self.max_size:
+                self.entries.popitem()
+        self.entries[key] = (self.clock() + ttl, result)
+
+
+    def resolve(self, host, port):
+        """
+        resolve host like socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+
+        Returns:
+            [(family, socktype, proto, canonname, sockaddr), ...]
+
+        Raises:
+            socket.gaierror: 解析失败（可能来自缓存的失败记录）
+        """
+        key = (host, port)
+        while True:
+            with self.lock:
+                result = self.lookup(key)
+                if result is not None:
+                    self.hit_num += 1
+                    metrics.incr('dns_hit')
+                    if isinstance(result, socket.gaierror):
+                        self.negative_hit_num += 1
+                        raise result
+                    return result
+                event = self.pending.get(key)
+                if event is None:
+                    self.pending[key] = threading.Event()
+                    self.miss_num += 1
+                    break
+            # 其它线程正在解析同一个 host，等待其结果后重新查缓存
+            event.wait()
+        metrics.incr('dns_miss')
+
+        result = None
+        ttl = 0
+        try:
+            result = self.resolver(host, port, 0, socket.SOCK_STREAM)
+            ttl = self.ttl
+        except socket.gaierror as e:
+            result = e
+            ttl = self.negative_ttl
+        finally:
+            # 其它异常不缓存，但同样要唤醒等待者
+            with self.lock:
+                if ttl > 0:
+                    self.store(key, result, ttl)
+                event = self.pending.pop(key)
+            event.set()
+        if isinstance(result, socket.gaierror):
+            raise result
+        return result
+
+
+    def prefetch(self, urls):
+        """
+        queue hosts of urls which are not cached yet for resolving in background
+
+        Args:
+            urls: url 字符串列表
+        """
+        keys = set()
+        for url in urls:
+            try:
+                parsed = urlparse.urlsplit(url)
+                scheme = parsed.scheme.lower()
+                if scheme in DEFAULT_PORTS and parsed.hostname:
+                    keys.add((parsed.hostname, parsed.port or DEFAULT_PORTS[scheme]))
+            except ValueError:
+                continue
+        with self.lock:
+            keys = [key for key in keys if not self.is_known(key)]
+        for key in keys:
+            try:
+                self.prefetch_queue.put_nowait(key)
+            except Queue.Full:
+                return
+
+
+    def prefetch_loop(self):
+        """
+        resolve queued hosts, 运行在预解析线程中
+        """
+        while True:
+            host, port = self.prefetch_queue.get()
+            with self.lock:
+                if self.is_known((host, port)):
+                    continue
+                self.prefetch_num += 1
+            metrics.incr('dns_prefetch')
+            try:
+                self.resolve(host, port)
+            except socket.gaierror:
+                pass
+            except Exception as e:
+                logging.warn(' * DNS prefetch failed: %s - %s' % (host, e))
+
+
+    def hit_ratio(self):
+        """
+        ratio of lookups served from cache
+        """
+        total = self.hit_num + self.miss_num
+        if total == 0:
+            return 0.0
+        return float(self.hit_num) / total
+
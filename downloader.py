@@ -7,10 +7,154 @@ Author: guiyilin(yilin.gui@gmail.com)
 Date: 2020-11-02 23:41:00
 """
 
-import ssl
 import urllib2
+import hashlib
 import socket
 import logging
+import httplib
+import os
+import tempfile
+import time
+
+import compression
+import connection_pool
+import metrics
+
+CHUNK_SIZE = 65536
+DEFAULT_MAX_BODY_SIZE = 10 * 1024 * 1024
+
+# mkstemp 创建的文件权限为 0600，提交时按进程 umask 恢复成普通文件权限
+# 在导入时读取一次 umask，避免多线程下反复修改
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+# 解压时也会抛出，定义在 compression 中
+BodyTooLargeError = compression.BodyTooLargeError
+
+
+def iter_body(response, max_body_size=DEFAULT_MAX_BODY_SIZE, chunk_size=CHUNK_SIZE):
+    """
+    iterate response body in bounded chunks, 按 Content-Encoding 边读边解压
+
+    Args:
+        response      : PooledResponse 对象
+        max_body_size : body 最大字节数（压缩前和解压后分别限制），Content-Length 超出时
+                        直接放弃，读取或解压过程中超出时立即中止
+        chunk_size    : 每次读取的字节数
+
+    Yields:
+        解压后的 body 数据块
+
+    Raises:
+        BodyTooLargeError: body 超过 max_body_size
+        IOError: 不支持的压缩格式或数据无法解压
+    """
+    content_length = response.getheader('content-length')
+    if content_length and content_length.isdigit() and int(content_length) > max_body_size:
+        response.close()
+        raise BodyTooLargeError('body too large: %s bytes' % content_length)
+
+    start = time.time()
+    decoder = None
+    try:
+        decoder = compression.ContentDecoder(response.getheader('content-encoding'),
+                                             max_body_size)
+        while True:
+            chunk = response.read(chunk_size)
+            if not chunk:
+                break
+            data = decoder.decode(chunk)
+            if data:
+                yield data
+        data = decoder.flush()
+        if data:
+            yield data
+        metrics.observe('download_time', time.time() - start)
+    finally:
+        if decoder is not None:
+            metrics.incr('bytes_downloaded', decoder.wire_size)
+            metrics.incr('bytes_decoded', decoder.decoded_size)
+        # 未读完时关闭会丢弃该连接，不会放回连接池
+        response.close()
+
+
+def read_body(response, max_body_size=DEFAULT_MAX_BODY_SIZE):
+    """
+    read the whole response body, bounded by max_body_size
+
+    Returns:
+        body 字符串
+    """
+    return ''.join(iter_body(response, max_body_size))
+
+
+class AtomicFile(object):
+    """
+    Write into a temp file in the target directory and rename it onto
+    target_path on commit, 保证 output_dir 中不会出现写了一半的文件
+
+    Attributes:
+        target_path : 目标文件路径
+        tmp_path    : 临时文件路径
+    """
+    def __init__(self, target_path):
+        self.target_path = target_path
+        fd, self.tmp_path = tempfile.mkstemp(prefix='.tmp-',
+                                             dir=os.path.dirname(target_path) or '.')
+        self.file = os.fdopen(fd, 'wb')
+
+
+    def write(self, data):
+        self.file.write(data)
+
+
+    def commit(self, target_path=None):
+        """
+        close temp file and atomically rename it onto target_path
+
+        Args:
+            target_path: 最终路径，缺省为构造时的 target_path；需与临时文件在同一文件系统
+        """
+        if target_path is not None:
+            self.target_path = target_path
+        self.file.close()
+        os.chmod(self.tmp_path, 0666 & ~UMASK)
+        os.rename(self.tmp_path, self.target_path)
+
+
+    def abort(self):
+        """
+        close and remove temp file
+        """
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def save_body(response, target_path, max_body_size=DEFAULT_MAX_BODY_SIZE):
+    """
+    stream response body into target_path through a temp file
+
+    Returns:
+        (size, content_hash): body 字节数和 md5 十六进制摘要
+
+    Raises:
+        BodyTooLargeError/IOError: 下载或写入失败，此时不会留下目标文件
+    """
+    atomic_file = AtomicFile(target_path)
+    md5 = hashlib.md5()
+    size = 0
+    try:
+        for chunk in iter_body(response, max_body_size):
+            atomic_file.write(chunk)
+            md5.update(chunk)
+            size += len(chunk)
+    except Exception:
+        atomic_file.abort()
+        raise
+    atomic_file.commit()
+    return (size, md5.hexdigest())
 
 class Downloader(object):
     """
@@ -20,11 +164,19 @@ class Downloader(object):
         url_obj
         try_times
         timeout
+        conn_pool: 共享的 keep-alive 连接池
+        headers  : 额外的请求头（如条件请求头）
+        error    : 最后一次尝试失败的异常，成功时为 None
     """
-    def __init__(self, url_obj, timeout, try_times=3):
+    def __init__(self, url_obj, timeout, try_times=3, conn_pool=None, headers=None):
         self.url_obj = url_obj
         self.timeout = timeout
         self.try_times = try_times
+        self.headers = headers
+        self.error = None
+        if conn_pool is None:
+            conn_pool = connection_pool.ConnectionPool()
+        self.conn_pool = conn_pool
 
     def run(self):
         """
@@ -36,33 +188,38 @@ class Downloader(object):
         """
         for i in range(self.try_times):
             try:
-                context = ssl._create_unverified_context()
-                response = urllib2.urlopen(self.url_obj.get_url(), timeout=self.timeout,
-                                           context=context)
+                response = self.conn_pool.urlopen(self.url_obj.get_url(), self.timeout,
+                                                  self.headers)
                 response.depth = self.url_obj.get_depth()
+                self.error = None
                 return (response, 0)
 
-            except urllib2.URLError as e:
+            except urllib2.HTTPError as e:
+                self.error = e
                 if i == self.try_times - 1:
                     error_info = \
                         '* Downloading failed : %s-%s' % (self.url_obj.get_url(), e)
 
-            except UnicodeEncodeError as e:
+            except httplib.HTTPException as e:
+                self.error = e
                 if i == self.try_times - 1:
                     error_info = \
                         '* Downloading failed : %s-%s' % (self.url_obj.get_url(), e)
 
-            except urllib2.HTTPError as e:
+            except UnicodeEncodeError as e:
+                self.error = e
                 if i == self.try_times - 1:
                     error_info = \
-                        '* Downloading failed : %s-%S' % (self.url_obj.get_url(), e)
+                        '* Downloading failed : %s-%s' % (self.url_obj.get_url(), e)
 
             except socket.timeout as e:
+                self.error = e
                 if i == self.try_times - 1:
                     error_info = \
                         '* Downloading failed : %s - %s' % (self.url_obj.get_url(), e)
 
             except Exception as e:
+                self.error = e
                 if i == self.try_times - 1:
                     error_info = \
                         '* Downloading failed : %s - %s' % (self.url_obj.get_url(), e)
@@ -8,10 +8,66 @@ Date: 2020-11-02 23:41:00
 """
 import urlparse
 import logging
+import codecs
+import collections
+import re
+import threading
+import HTMLParser as std_html_parser
 
 import bs4
 import chardet
 
+import simhash
+
+try:
+    import lxml.html
+except ImportError:
+    # lxml 为可选依赖，仅 parser = lxml 时需要
+    lxml = None
+
+PARSER_BACKENDS = ('html5lib', 'lxml', 'streaming')
+STREAM_CHUNK_SIZE = 65536
+
+# 编码检测：只在页面头部查找 <meta charset>，chardet 只检测有限长度的前缀
+META_SNIFF_SIZE = 4096
+CHARDET_PREFIX_SIZE = 32768
+META_CHARSET_PATTERN = re.compile(r'<meta[^>]+charset\s*=\s*["\']?\s*([\w:.-]+)', re.I)
+HEADER_CHARSET_PATTERN = re.compile(r'charset\s*=\s*["\']?([\w:.-]+)', re.I)
+BOMS = (('\xef\xbb\xbf', 'utf-8'),
+        ('\xff\xfe', 'utf-16'),
+        ('\xfe\xff', 'utf-16'))
+# gb2312/gbk 页面中常混有超出字符集的字符，统一按超集 gb18030 解码
+ENCODING_ALIASES = {'gb2312': 'gb18030', 'gbk': 'gb18030', 'x-gbk': 'gb18030'}
+
+# 编码来源计数：unicode / header / bom / meta / chardet / none
+ENCODING_STATS = collections.Counter()
+ENCODING_STATS_LOCK = threading.Lock()
+
+
+class LinkCollector(std_html_parser.HTMLParser):
+    """
+    Event-driven link collector, 单遍扫描且不构建文档树
+
+    Attributes:
+        link_tag_dict : 待解析的标签
+        links         : 按文档顺序收集到的链接属性值
+    """
+    def __init__(self, link_tag_dict):
+        std_html_parser.HTMLParser.__init__(self)
+        self.link_tag_dict = link_tag_dict
+        self.links = []
+
+
+    def handle_starttag(self, tag, attrs):
+        attr_name = self.link_tag_dict.get(tag)
+        if attr_name is None:
+            return
+        for name, value in attrs:
+            if name == attr_name and value is not None:
+                self.links.append(value)
+                return
+
+
 class HtmlParser(object):
     """
     This class is used to parse HTML.
@@ -20,12 +76,23 @@ class HtmlParser(object):
         content       : 待解析的html源码
         link_tag_dict : 待解析的标签
         url           : 待解析页面所处的url
+        backend       : 解析后端 html5lib / lxml / streaming
+        charset       : HTTP Content-Type 中声明的编码，可以为 None
+        encoding_source: 编码检测结果的来源
+        with_fingerprint: 是否在抽取链接时计算页面文本的 SimHash 指纹
+        fingerprint   : 页面指纹，未计算或文本太短时为 None
     """
 
-    def __init__(self, content, link_tag_dict, url):
+    def __init__(self, content, link_tag_dict, url, backend='html5lib', charset=None,
+                 with_fingerprint=False):
         self.link_tag_dict = link_tag_dict
         self.content = content
         self.url = url
+        self.backend = backend
+        self.charset = charset
+        self.encoding_source = None
+        self.with_fingerprint = with_fingerprint
+        self.fingerprint = None
 
 
     def extract_url(self):
@@ -36,85 +103,240 @@ class HtmlParser(object):
             extract_url_list : urls extracted from html
         """
         extract_url_list = []
-        if not self.encode_to_utf8():
+        encoding = self.detect_encoding()
+        if encoding is None:
             return extract_url_list
 
-        host_name = urlparse.urlparse(self.url).netloc
-        # 使用 html5lib 解析器
-        soup = bs4.BeautifulSoup(self.content, 'html5lib')
+        if self.backend == 'streaming':
+            found_links = self.find_links_streaming(encoding)
+        elif self.backend == 'lxml':
+            found_links = self.find_links_lxml(encoding)
+        else:
+            found_links = self.find_links_html5lib(encoding)
+        if self.with_fingerprint:
+            self.fingerprint = self.compute_fingerprint(encoding)
+
+        for extract_url in found_links:
+            extract_url = extract_url.strip()
+
+            if extract_url.startswith("javascript") or len(extract_url) > 256:
+                continue
+
+            if not (extract_url.startswith('http:') or extract_url.startswith('https:')):
+                extract_url = urlparse.urljoin(self.url, extract_url)
+
+            extract_url_list.append(extract_url)
+
+        return extract_url_list
+
+
+    def compute_fingerprint(self, encoding):
+        """
+        compute simhash fingerprint of the page text
+
+        Args:
+            encoding: 页面编码
+
+        Returns:
+            指纹整数，文本太短时返回 None
+        """
+        content = self.content
+        if encoding != 'unicode':
+            try:
+                content = content.decode(encoding, 'replace')
+            except LookupError:
+                return None
+        return simhash.fingerprint(content)
+
+
+    def find_links_html5lib(self, encoding):
+        """
+        find link attributes with bs4 + html5lib, 容错性最好但最慢
+
+        Args:
+            encoding: 页面编码
+
+        Returns:
+            链接属性值列表
+        """
+        # 直接以检测出的编码解码原始字节，不再额外生成一份 utf-8 重新编码的副本
+        if encoding == 'unicode':
+            soup = bs4.BeautifulSoup(self.content, 'html5lib')
+        else:
+            soup = bs4.BeautifulSoup(self.content, 'html5lib', from_encoding=encoding)
 
         # 检查链接标签中的元素
+        found_links = []
         for tag, attr in self.link_tag_dict.iteritems():
             all_found_tags = soup.find_all(tag)
             for found_tag in all_found_tags:
                 if found_tag.has_attr(attr):
-                    extract_url = found_tag.get(attr).strip()
+                    found_links.append(found_tag.get(attr))
+        return found_links
 
-                    if extract_url.startswith("javascript") or len(extract_url) > 256:
-                        continue
 
-                    if not (extract_url.startswith('http:') or extract_url.startswith('https:')):
-                        extract_url = urlparse.urljoin(self.url, extract_url)
+    def find_links_lxml(self, encoding):
+        """
+        find link attributes with lxml (libxml2), 一次遍历所有链接标签
 
-                    extract_url_list.append(extract_url)
+        Args:
+            encoding: 页面编码
 
-        return extract_url_list
+        Returns:
+            链接属性值列表
+        """
+        if lxml is None:
+            logging.error(' * HtmlParser: lxml is not installed')
+            return []
+
+        content = self.content
+        if encoding == 'unicode':
+            content = content.encode('utf-8')
+            encoding = 'utf-8'
+        try:
+            parser = lxml.html.HTMLParser(encoding=encoding)
+            doc = lxml.html.document_fromstring(content, parser=parser)
+        except (LookupError, ValueError, lxml.etree.ParserError) as e:
+            logging.warn(' * HtmlParserError - %s - %s' % (self.url, e))
+            return []
+
+        found_links = []
+        for element in doc.iter(*self.link_tag_dict.keys()):
+            value = element.get(self.link_tag_dict[element.tag])
+            if value is not None:
+                found_links.append(value)
+        return found_links
+
+
+    def find_links_streaming(self, encoding):
+        """
+        find link attributes in a single streaming pass without building a tree,
+        按块增量解码并送入事件驱动的解析器
+
+        Args:
+            encoding: 页面编码
+
+        Returns:
+            链接属性值列表
+        """
+        collector = LinkCollector(self.link_tag_dict)
+        try:
+            if encoding == 'unicode':
+                collector.feed(self.content)
+            else:
+                decoder = codecs.getincrementaldecoder(encoding)('ignore')
+                for offset in xrange(0, len(self.content), STREAM_CHUNK_SIZE):
+                    collector.feed(decoder.decode(self.content[offset:offset + STREAM_CHUNK_SIZE]))
+                collector.feed(decoder.decode('', final=True))
+            collector.close()
+        except (LookupError, std_html_parser.HTMLParseError) as e:
+            # 遇到无法解析的标记时保留已收集到的链接
+            logging.warn(' * HtmlParserError - %s - %s' % (self.url, e))
+        return collector.links
 
 
     def detect_encoding(self):
         """
-        检测 self.content 文本编码
+        检测 self.content 文本编码，依次尝试：
+            HTTP Content-Type 中的 charset -> BOM -> 页面头部的 <meta charset>
+            -> 对有限长度前缀运行 chardet（最慢，作为兜底）
+
+        检测结果的来源记录在 self.encoding_source，并计入 ENCODING_STATS
 
         Returns:
             encode_name/None: 检测成功返回编码名字，否则返回 None 
         """
+        encode_name, self.encoding_source = self.resolve_encoding()
+        count_encoding_source(self.encoding_source)
+        return encode_name
+
+
+    def resolve_encoding(self):
+        """
+        resolve encoding of self.content
+
+        Returns:
+            (encode_name/None, source)
+        """
         if isinstance(self.content, unicode):
-            return 'unicode'
+            return ('unicode', 'unicode')
+
+        encode_name = normalize_encoding(self.charset)
+        if encode_name is not None:
+            return (encode_name, 'header')
+
+        for bom, bom_encoding in BOMS:
+            if self.content.startswith(bom):
+                return (bom_encoding, 'bom')
+
+        match = META_CHARSET_PATTERN.search(self.content, 0, META_SNIFF_SIZE)
+        if match is not None:
+            encode_name = normalize_encoding(match.group(1))
+            if encode_name is not None:
+                return (encode_name, 'meta')
 
         try:
-            encode_dict = chardet.detect(self.content)
-            encode_name = encode_dict['encoding']
-            return encode_name
+            encode_dict = chardet.detect(self.content[:CHARDET_PREFIX_SIZE])
+            encode_name = normalize_encoding(encode_dict['encoding'])
+            return (encode_name, 'chardet' if encode_name else 'none')
         except Exception as e:
             logging.error(' * HtmlParserEncodingError detect_encoding: %s' % e)
-            return None
+            return (None, 'none')
 
 
-    def encode_to_utf8(self):
-        """
-        将 self.content 的文本编码转为utf8
+def normalize_encoding(encode_name):
+    """
+    normalize an encoding name, 无法识别的编码返回 None
 
-        Returns:
-            True/False : 能正常转为utf-8则返回True，否则返回False
-        """
-        encoding = self.detect_encoding()
-        try:
-            if encoding is None:
-                return False
+    Args:
+        encode_name: 编码名字
 
-            elif encoding.lower() == 'unicode':
-                self.content = self.content.encode('utf-8')
-                return True
+    Returns:
+        规范化的编码名字/None
+    """
+    if not encode_name:
+        return None
+    encode_name = encode_name.strip().strip('"\'').lower()
+    encode_name = ENCODING_ALIASES.get(encode_name, encode_name)
+    try:
+        codecs.lookup(encode_name)
+    except LookupError:
+        return None
+    return encode_name
 
-            elif encoding.lower() == 'utf-8':
-                return True
 
-            else:
-                self.content = self.content.decode(encoding, 'ignore').encode('utf-8')
-                return True
+def parse_charset(content_type):
+    """
+    get charset from a Content-Type header value
 
-        except UnicodeError as e:
-            logging.warn(' * HtmlParserEncodingError - %s - %s:' % (self.url, e))
-            return False
+    Args:
+        content_type: 例如 'text/html; charset=gbk'
 
-        except UnicodeEncodeError as e:
-            logging.warn(' * HtmlParserEncodingError - %s - %s:' % (self.url, e))
-            return False
+    Returns:
+        charset/None
+    """
+    if not content_type:
+        return None
+    match = HEADER_CHARSET_PATTERN.search(content_type)
+    if match is None:
+        return None
+    return match.group(1)
 
-        except UnicodeDecodeError as e:
-            logging.warn(' * HtmlParserEncodingError - %s - %s:' % (self.url, e))
-            return False
 
-        except Exception as e:
-            logging.warn(' * HtmlParserEncodingError - %s - %s:' % (self.url, e))
-            return False
+def count_encoding_source(source):
+    """
+    increase the counter of an encoding source
+    """
+    with ENCODING_STATS_LOCK:
+        ENCODING_STATS[source] += 1
+
+
+def get_encoding_stats():
+    """
+    get a copy of encoding source counters
+
+    Returns:
+        source -> 页面数 的字典
+    """
+    with ENCODING_STATS_LOCK:
+        return dict(ENCODING_STATS)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: http_cache.py
+Description: 持久化的 HTTP 校验器缓存（url -> ETag / Last-Modified / 内容哈希 / 上次抽取的链接），
+             重复抓取时发送条件请求，304 时复用上次的结果
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import collections
+import json
+import os
+import sqlite3
+import threading
+
+CacheEntry = collections.namedtuple('CacheEntry',
+                                    ['etag', 'last_modified', 'content_hash', 'size', 'links'])
+
+
+def _to_unicode(value):
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+class HttpCache(object):
+    """
+    Validator cache backed by sqlite, 跨多次运行保留
+
+    Attributes:
+        path        : 数据库文件路径
+        lookup_num  : 本次运行中查询缓存的请求数
+        hit_num     : 本次运行中返回 304 的请求数
+        bytes_saved : 本次运行中因 304 而未下载的字节数（按缓存的 body 大小计）
+    """
+
+    COMMIT_EVERY = 100
+
+    def __init__(self, path):
+        self.path = path
+        path_dirname = os.path.dirname(path)
+        if path_dirname and not os.path.isdir(path_dirname):
+            os.makedirs(path_dirname)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA synchronous = OFF')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS validators ('
+                          'url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, '
+                          'content_hash TEXT, size INTEGER, links TEXT)')
+        self.lock = threading.Lock()
+        self.pending_writes = 0
+        self.lookup_num = 0
+        self.hit_num = 0
+        self.bytes_saved = 0
+
+
+    def get(self, url):
+        """
+        get cached validators of url
+
+        Returns:
+            CacheEntry 对象，未缓存时返回 None；links 为 None 表示没有缓存链接
+        """
+        with self.lock:
+            self.lookup_num += 1
+            row = self.conn.execute('SELECT etag, last_modified, content_hash, size, links '
+                                    'FROM validators WHERE url = ?',
+                                    (_to_unicode(url),)).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, content_hash, size, links = row
+        if links is not None:
+            links = json.loads(links)
+        return CacheEntry(etag, last_modified, content_hash, size, links)
+
+
+    @staticmethod
+    def conditional_headers(entry):
+        """
+        build If-None-Match / If-Modified-Since headers from a cache entry
+
+        Returns:
+            请求头字典，没有校验器时为空字典
+        """
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag.encode('utf-8')
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified.encode('utf-8')
+        return headers
+
+
+    def store(self, url, etag, last_modified, content_hash, size, links=None):
+        """
+        store validators of a 200 response, 没有校验器的响应不缓存
+
+        Args:
+            url           : 请求 url
+            etag          : ETag 响应头
+            last_modified : Last-Modified 响应头
+            content_hash  : body 的哈希
+            size          : body 字节数
+            links         : 抽取出的链接列表，target url 为 None
+        """
+        if not etag and not last_modified:
+            return
+        if links is not None:
+            links = json.dumps([_to_unicode(link) for link in links])
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO validators '
+                              '(url, etag, last_modified, content_hash, size, links) '
+                              'VALUES (?, ?, ?, ?, ?, ?)',
+                              (_to_unicode(url), _to_unicode(etag), _to_unicode(last_modified),
+                               content_hash, size, links))
+            self.pending_writes += 1
+            if self.pending_writes >= self.COMMIT_EVERY:
+                self.conn.commit()
+                self.pending_writes = 0
+
+
+    def record_hit(self, entry):
+        """
+        count a 304 response served from entry
+        """
+        with self.lock:
+            self.hit_num += 1
+            self.bytes_saved += entry.size or 0
+
+
+    def hit_ratio(self):
+        """
+        ratio of 304 responses among cache lookups
+        """
+        if self.lookup_num == 0:
+            return 0.0
+        return float(self.hit_num) / self.lookup_num
+
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
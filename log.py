@@ -3,17 +3,209 @@
 
 """
 File: log.py
+Description: 日志初始化；可选异步模式（工作线程只把记录放入队列，由单独的写线程批量写文件）
+             和按调用位置的限速，使逐 url 的调试日志可以在生产环境中保持开启
 Author: guiyilin(yilin.gui@gmail.com)
 Date: 2020-11-02 23:41:00
 """
 
+import Queue
+import atexit
 import os
 import logging
 import logging.handlers
+import threading
+import time
+
+# 写线程一次最多写入的记录数
+BATCH_SIZE = 256
+# 队列上限，写线程落后太多时调用方阻塞，避免内存无限增长
+QUEUE_SIZE = 10000
+
+_writer = None
+_queue_handler = None
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Per call-site rate limit: 同一 (文件, 行号) 的日志每秒最多输出 rate 条，
+    被丢弃的条数附加在该位置下一条输出的日志上。
+
+    Attributes:
+        rate           : 每个调用位置每秒最多输出的条数
+        level          : 只限制低于该级别的日志，ERROR 及以上总是输出
+        suppressed_num : 累计丢弃的日志条数
+    """
+    def __init__(self, rate, level=logging.ERROR, clock=time.time):
+        logging.Filter.__init__(self)
+        self.rate = rate
+        self.level = level
+        self.clock = clock
+        # (pathname, lineno) -> [窗口开始时间, 窗口内已输出条数, 已丢弃条数]
+        self.sites = {}
+        self.suppressed_num = 0
+        self.lock = threading.Lock()
+
+
+    def filter(self, record):
+        if record.levelno >= self.level:
+            return True
+        now = self.clock()
+        key = (record.pathname, record.lineno)
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None:
+                site = self.sites[key] = [now, 0, 0]
+            elif now - site[0] >= 1.0:
+                site[0] = now
+                site[1] = 0
+            if site[1] >= self.rate:
+                site[2] += 1
+                self.suppressed_num += 1
+                return False
+            site[1] += 1
+            suppressed = site[2]
+            site[2] = 0
+        if suppressed:
+            record.msg = '%s (%d similar messages suppressed)' % (record.getMessage(), suppressed)
+            record.args = None
+        return True
+
+
+class BatchRotatingFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """
+    TimedRotatingFileHandler that can write several records with a single flush
+    """
+    def emit_batch(self, records):
+        """
+        write records and flush once
+        """
+        self.acquire()
+        try:
+            for record in records:
+                if record.levelno < self.level:
+                    continue
+                try:
+                    if self.shouldRollover(record):
+                        self.doRollover()
+                    msg = self.format(record)
+                    if isinstance(msg, unicode):
+                        msg = msg.encode('utf-8')
+                    self.stream.write(msg + '\n')
+                except Exception:
+                    self.handleError(record)
+            self.flush()
+        finally:
+            self.release()
+
+
+class QueueHandler(logging.Handler):
+    """
+    Handler putting records into a queue, 在调用线程中只做格式化消息这一步
+
+    Attributes:
+        queue: 记录队列，由 LogWriter 消费
+    """
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+
+    def prepare(self, record):
+        """
+        merge args and exception into the record, 避免写线程格式化时参数已被修改
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+    def emit(self, record):
+        try:
+            self.queue.put(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+
+class LogWriter(threading.Thread):
+    """
+    Thread writing queued records into handler in batches
+
+    Attributes:
+        queue      : 记录队列
+        handler    : BatchRotatingFileHandler
+        batch_size : 一次最多写入的记录数
+    """
+    def __init__(self, queue, handler, batch_size=BATCH_SIZE):
+        super(LogWriter, self).__init__(name='log writer')
+        self.setDaemon(True)
+        self.queue = queue
+        self.handler = handler
+        self.batch_size = batch_size
+
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            batch = [record]
+            try:
+                while len(batch) < self.batch_size:
+                    record = self.queue.get_nowait()
+                    if record is None:
+                        self.handler.emit_batch(batch)
+                        return
+                    batch.append(record)
+            except Queue.Empty:
+                pass
+            self.handler.emit_batch(batch)
+
+
+    def stop(self):
+        """
+        write out all queued records and stop
+        """
+        self.queue.put(None)
+        self.join()
+
+
+def shutdown_log():
+    """
+    stop the async log writer if any, 进程退出时自动调用
+    """
+    global _writer, _queue_handler
+    if _writer is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _writer.stop()
+        _writer.handler.close()
+        _writer = None
+        _queue_handler = None
+
+
+def init_child_log():
+    """
+    make a forked child process write log records directly, 子进程中没有写线程：
+    继承来的队列不会被消费，其锁也可能在 fork 时正被父进程的写线程持有
+    """
+    global _writer, _queue_handler
+    if _writer is None:
+        return
+    handler = _writer.handler
+    handler.createLock()
+    logger = logging.getLogger()
+    # 不调用 removeHandler，避免获取 fork 时可能被其它线程持有的 logging 模块锁
+    logger.handlers = [handler if item is _queue_handler else item for item in logger.handlers]
+    _writer = None
+    _queue_handler = None
+
 
 def init_log(log_path, level=logging.INFO, when="D", backup=7,
              format="%(levelname)s: %(asctime)s: %(filename)s:%(lineno)d * %(thread)d %(message)s",
-             datefmt="%m-%d %H:%M:%S"):
+             datefmt="%m-%d %H:%M:%S", async_mode=False, rate_limit=0):
     """
     init_log - initialize logging module
 
@@ -37,11 +229,16 @@ def init_log(log_path, level=logging.INFO, when="D", backup=7,
                     e.g. INFO: 12-09 18:02:42: log.py:40 * 139814749787872 HELLO WORLD
         backup: how many backup file to keep
                     default value: 7
+        async_mode: whether to write log in a separate thread
+                    default value: False
+        rate_limit: max messages per second of each call site below ERROR, 0 means no limit
+                    default value: 0
 
     Raises:
         OSError: fail to create log directories
         IOError: fail to open log file
     """
+    global _writer, _queue_handler
     formatter = logging.Formatter(format, datefmt)
     logger = logging.getLogger()
     logger.setLevel(level)
@@ -50,9 +247,24 @@ def init_log(log_path, level=logging.INFO, when="D", backup=7,
     if not os.path.isdir(log_path_dirname):
         os.makedirs(log_path_dirname)
 
-    handler = logging.handlers.TimedRotatingFileHandler(log_path + ".log",
-                                                        when=when,
-                                                        backupCount=backup)
+    handler = BatchRotatingFileHandler(log_path + ".log",
+                                       when=when,
+                                       backupCount=backup)
     handler.setLevel(level)
     handler.setFormatter(formatter)
+
+    if async_mode:
+        shutdown_log()
+        _queue_handler = QueueHandler(Queue.Queue(QUEUE_SIZE))
+        _queue_handler.setLevel(level)
+        _writer = LogWriter(_queue_handler.queue, handler)
+        _writer.start()
+        handler = _queue_handler
+    # 限速在调用线程中进行，被丢弃的日志不进入队列
+    if rate_limit > 0:
+        handler.addFilter(RateLimitFilter(rate_limit))
     logger.addHandler(handler)
+    return handler
+
+
+atexit.register(shutdown_log)
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: metrics.py
+Description: 计数器与直方图，用于观察抓取过程（延迟、字节数、frontier 大小、锁等待、
+             各 host 错误率），支持周期性统计日志和本地 HTTP 统计接口
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import BaseHTTPServer
+import json
+import logging
+import math
+import threading
+import time
+
+# 直方图按 2 的幂分桶，第 0 个桶的上界为 HISTOGRAM_BASE
+HISTOGRAM_BASE = 1e-4
+
+
+class Histogram(object):
+    """
+    Log-bucketed histogram, 分位数按桶上界估计（相对误差不超过 2 倍）
+
+    Attributes:
+        count   : 样本数
+        total   : 样本总和
+        max     : 最大样本
+        buckets : 桶序号 -> 样本数
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = {}
+
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        index = 0
+        if value > HISTOGRAM_BASE:
+            index = int(math.ceil(math.log(value / HISTOGRAM_BASE, 2)))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+
+    def merge(self, other):
+        """
+        merge another histogram into this one
+        """
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+
+    def quantile(self, q):
+        """
+        estimate q-quantile (0 < q <= 1)
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(HISTOGRAM_BASE * 2 ** index, self.max)
+        return self.max
+
+
+    def summary(self):
+        mean = self.total / self.count if self.count else 0.0
+        return {'count': self.count, 'mean': mean, 'p50': self.quantile(0.5),
+                'p99': self.quantile(0.99), 'max': self.max}
+
+
+class Shard(object):
+    """
+    Metrics written by one thread, 热路径上只写本线程的分片，无需加锁
+    """
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+
+class Metrics(object):
+    """
+    Registry of counters, histograms and gauges.
+
+    计数器和直方图按线程分片，snapshot() 时合并；gauge 为读取时调用的函数。
+    计数器可以带一个 label（如 host），用于按 host 统计。
+
+    Attributes:
+        shards : 所有线程的分片
+        gauges : 名称 -> 无参函数
+    """
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = []
+        self.gauges = {}
+        self.lock = threading.Lock()
+
+
+    def shard(self):
+        """
+        get the shard of the current thread
+        """
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = Shard()
+            self.local.shard = shard
+            with self.lock:
+                self.shards.append(shard)
+        return shard
+
+
+    def incr(self, name, value=1, label=None):
+        """
+        increase counter name (with optional label) by value
+        """
+        counters = self.shard().counters
+        key = (name, label)
+        counters[key] = counters.get(key, 0) + value
+
+
+    def observe(self, name, value):
+        """
+        add a sample into histogram name
+        """
+        histograms = self.shard().histograms
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        histogram.observe(value)
+
+
+    def register_gauge(self, name, func):
+        """
+        register a gauge read by calling func when taking snapshots
+        """
+        with self.lock:
+            self.gauges[name] = func
+
+
+    def snapshot(self):
+        """
+        merge all shards
+
+        Returns:
+            {'counters': {name: value}, 'labeled': {name: {label: value}},
+             'histograms': {name: summary}, 'gauges': {name: value}}
+        """
+        with self.lock:
+            shards = list(self.shards)
+            gauges = dict(self.gauges)
+        counters = {}
+        labeled = {}
+        histograms = {}
+        for shard in shards:
+            # 其它线程可能正在写入，复制后再遍历
+            for (name, label), value in shard.counters.items():
+                if label is None:
+                    counters[name] = counters.get(name, 0) + value
+                else:
+                    by_label = labeled.setdefault(name, {})
+                    by_label[label] = by_label.get(label, 0) + value
+            for name, histogram in shard.histograms.items():
+                histograms.setdefault(name, Histogram()).merge(histogram)
+        return {'counters': counters,
+                'labeled': labeled,
+                'histograms': dict((name, histogram.summary())
+                                   for name, histogram in histograms.iteritems()),
+                'gauges': dict((name, func()) for name, func in gauges.iteritems())}
+
+
+def host_error_rates(snapshot):
+    """
+    get per-host error rates from a snapshot
+
+    Returns:
+        host -> (请求数, 错误数, 错误率)
+    """
+    requests = snapshot['labeled'].get('host_requests', {})
+    errors = snapshot['labeled'].get('host_errors', {})
+    return dict((host, (num, errors.get(host, 0), float(errors.get(host, 0)) / num))
+                for host, num in requests.iteritems() if num)
+
+
+def format_stats(snapshot):
+    """
+    format a snapshot as a single stats line
+    """
+    items = ['%s=%s' % item for item in sorted(snapshot['gauges'].items())]
+    items.extend('%s=%s' % item for item in sorted(snapshot['counters'].items()))
+    for name, summary in sorted(snapshot['histograms'].items()):
+        items.append('%s(p50=%.4f p99=%.4f n=%d)' % (name, summary['p50'], summary['p99'],
+                                                     summary['count']))
+    error_hosts = sorted((rate, host) for host, (_, errors, rate)
+                         in host_error_rates(snapshot).iteritems() if errors)
+    if error_hosts:
+        items.append('host_error_rate(%s)' % ' '.join('%s=%.2f' % (host, rate)
+                                                      for rate, host in error_hosts[-5:]))
+    return ' '.join(items)
+
+
+class Timer(object):
+    """
+    Context manager observing elapsed seconds into a histogram
+    """
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+        self.start = 0
+
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.registry.observe(self.name, time.time() - self.start)
+
+
+class StatsReporter(threading.Thread):
+    """
+    Thread writing a stats line into log every interval seconds
+    """
+    def __init__(self, registry, interval):
+        super(StatsReporter, self).__init__(name='stats reporter')
+        self.setDaemon(True)
+        self.registry = registry
+        self.interval = interval
+        self.stop_event = threading.Event()
+
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            logging.info(' * stats: %s' % format_stats(self.registry.snapshot()))
+
+
+    def stop(self):
+        """
+        stop and wait for the thread, 避免解释器退出时守护线程仍在等待
+        """
+        self.stop_event.set()
+        self.join()
+
+
+class StatsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    GET /stats 返回 JSON 格式的 snapshot，其它路径返回单行统计文本
+    """
+    def do_GET(self):
+        snapshot = self.server.registry.snapshot()
+        if self.path.startswith('/stats'):
+            body = json.dumps(snapshot, sort_keys=True, indent=1)
+            content_type = 'application/json'
+        else:
+            body = format_stats(snapshot) + '\n'
+            content_type = 'text/plain'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stats_server(registry, port, host='127.0.0.1'):
+    """
+    serve snapshots of registry over HTTP in a daemon thread
+
+    Returns:
+        HTTPServer 对象，调用 shutdown() 停止
+    """
+    server = BaseHTTPServer.HTTPServer((host, port), StatsHandler)
+    server.registry = registry
+    thread = threading.Thread(target=server.serve_forever, name='stats server')
+    thread.setDaemon(True)
+    thread.start()
+    return server
+
+
+# 全局 registry，各模块直接使用下列函数
+REGISTRY = Metrics()
+incr = REGISTRY.incr
+observe = REGISTRY.observe
+register_gauge = REGISTRY.register_gauge
+snapshot = REGISTRY.snapshot
+
+
+def timer(name):
+    """
+    time a block into histogram name, e.g. with metrics.timer('parse_time'): ...
+    """
+    return Timer(REGISTRY, name)
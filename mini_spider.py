@@ -13,8 +13,8 @@ Date: 2020-11-02 23:41:00
 # * 第三方库
 # * 应用程序自有库
 
-import Queue
 import threading
+import time
 import os
 import logging
 import re
@@ -23,8 +23,23 @@ import argparse
 import termcolor
 
 import url_object
+import canonicalize
 import config_loader
+import seen_store
+import connection_pool
+import http_cache
+import target_store
+import scheduler
+import simhash
+import html_parser
+import parse_pool
+import checkpoint
+import metrics
 import crawl_thread
+import cluster
+import dns_cache
+import robots
+import adaptive
 import log
 
 class MiniSpider(object):
@@ -32,22 +47,69 @@ class MiniSpider(object):
     This class is a crawler-master-class for operating serveral crawling threads
 
     Attributes:
-        checking_urls      : 存放待爬取 URL 的队列
-        checked_urls       : 存放已经爬取过的 URL 的队列
-        error_urls         : 存放访问出错 URL 的队列
+        checking_urls      : 存放待爬取 URL 的按 host 调度、按深度优先的 frontier
+        target_urls        : 存放待保存 target URL 的 frontier（下载通道），异步引擎下与
+                             checking_urls 为同一对象
+        checked_num        : 已经爬取过的 URL 数
+        error_num          : 访问出错的 URL 数
+        seen_urls          : 已入队（含已爬取、出错、待爬取）URL 的 seen store，用于去重
+        canonicalizer      : 去重前的 URL 规范化器，canonicalize = 0 时为 None
+        canonical_dup_num  : 因规范化而避免的重复抓取数
+        raw_variants       : 已见过的、与规范形式不同的原始写法，同一写法重复出现时不计入
+                             canonical_dup_num，canonicalize = 0 时为 None
+        dropped_num        : 入队时因超过 max_depth 且非 target 而丢弃的链接数
+        near_dup_index     : 已抓取页面的 SimHash 指纹索引，near_dup_distance 为负时为 None
+        near_dup_num       : 被判定为近似重复、未展开链接的页面数
+        near_dup_avoided   : 因近似重复页面未展开而避免的抓取数
+        conn_pool          : 所有抓取线程共享的 keep-alive 连接池
+        dns_cache          : 所有抓取路径共享的 DNS 缓存，dns_cache_ttl 为 0 时为 None
+        robots_cache       : 按 host 缓存的 robots.txt 规则，robots = 0 时为 None
+        adaptive           : 自适应并发、重试和熔断控制器，adaptive = 0 时为 None
+        http_cache         : 跨运行保留的 HTTP 校验器缓存，未配置 http_cache_path 时为 None
+        target_store       : target 文件的存储（flat / cas 布局）
+        stats_reporter     : 周期性输出统计日志的线程，stats_interval 为 0 时为 None
+        stats_server       : 本地 HTTP 统计接口，stats_port 为 0 时为 None
+        parse_pool         : HTML 解析进程池，parse_processes 为 0 时为 None
+        journal            : 断点续爬 journal，未配置 checkpoint_dir 时为 None
+        cluster            : 多节点抓取时本节点的 ClusterNode，未配置 cluster_nodes 时为 None
+        node_id            : 命令行指定的节点序号，None 时使用配置中的 cluster_node_id
         config_file_path   : 配置文件路径
-        lock               : 线程锁
+        resume             : 是否从上次中断处继续抓取
+        stats_lock         : 保护 checked_num / error_num 的锁
     """
 
-    def __init__(self, config_file_path='spider.conf'):
+    def __init__(self, config_file_path='spider.conf', resume=False, node_id=None):
         """
         Initialize variables
         """
-        self.checking_urls = Queue.Queue(0)
-        self.checked_urls = set()
-        self.error_urls = set()
+        self.checking_urls = None
+        self.target_urls = None
+        self.checked_num = 0
+        self.error_num = 0
+        self.seen_urls = None
+        self.canonicalizer = None
+        self.canonical_dup_num = 0
+        self.raw_variants = None
+        self.dropped_num = 0
+        self.near_dup_index = None
+        self.near_dup_num = 0
+        self.near_dup_avoided = 0
+        self.conn_pool = None
+        self.dns_cache = None
+        self.robots_cache = None
+        self.adaptive = None
+        self.http_cache = None
+        self.target_store = None
+        self.stats_reporter = None
+        self.stats_server = None
+        self.parse_pool = None
+        self.journal = None
+        self.cluster = None
+        self.node_id = node_id
         self.config_file_path = config_file_path
-        self.lock = threading.Lock()
+        self.resume = resume
+        # 去重、入队和 journal 各自有细粒度的锁，这里只保护计数器
+        self.stats_lock = threading.Lock()
 
 
     def initialize(self):
@@ -70,13 +132,256 @@ class MiniSpider(object):
         self.crawl_timeout = config_loader_inst.get_crawl_timeout()
         self.target_url = config_loader_inst.get_target_url()
         self.thread_count = config_loader_inst.get_thread_count()
-        self.tag_dict = config_loader_inst.get_tag_dict()
+        self.target_thread_count = config_loader_inst.get_target_thread_count()
+        self.try_times = config_loader_inst.get_try_times()
+        self.engine = config_loader_inst.get_engine()
+        self.async_concurrency = config_loader_inst.get_async_concurrency()
+        self.ignored_options = config_loader_inst.get_ignored_options()
+        self.max_conn_per_host = config_loader_inst.get_max_conn_per_host()
+        self.max_conn_total = config_loader_inst.get_max_conn_total()
+        self.max_body_size = config_loader_inst.get_max_body_size()
+        self.parser = config_loader_inst.get_parser()
+        self.parse_processes = config_loader_inst.get_parse_processes()
+        self.parse_batch_size = config_loader_inst.get_parse_batch_size()
+        self.parse_queue_size = config_loader_inst.get_parse_queue_size()
+        self.http_cache_path = config_loader_inst.get_http_cache_path()
+        self.output_layout = config_loader_inst.get_output_layout()
+        self.cas_pack_max_size = config_loader_inst.get_cas_pack_max_size()
+        self.cas_segment_size = config_loader_inst.get_cas_segment_size()
+        self.stats_interval = config_loader_inst.get_stats_interval()
+        self.stats_port = config_loader_inst.get_stats_port()
+        self.dns_cache_ttl = config_loader_inst.get_dns_cache_ttl()
+        self.dns_negative_ttl = config_loader_inst.get_dns_negative_ttl()
+        self.dns_prefetch_threads = config_loader_inst.get_dns_prefetch_threads()
+        if config_loader_inst.get_robots():
+            self.robots_cache = robots.RobotsCache(
+                ttl=config_loader_inst.get_robots_ttl(),
+                failure_ttl=config_loader_inst.get_robots_failure_ttl(),
+                on_rules=self.apply_crawl_delay)
         self.url_pattern = re.compile(self.target_url)  # 使用 re.complie 预先编译提升正则匹配性能
+        self.checking_urls = scheduler.HostScheduler(
+            self.crawl_interval,
+            config_loader_inst.get_max_host_concurrency(),
+            config_loader_inst.get_host_intervals(),
+            config_loader_inst.get_host_concurrency(),
+            scheduler.create_scorer(config_loader_inst.get_frontier_scorer(), self.url_pattern),
+            config_loader_inst.get_frontier_memory_limit())
+        if self.engine == 'async':
+            # 异步引擎在同一事件循环中处理所有 url，不区分通道
+            self.target_urls = self.checking_urls
+        else:
+            self.target_urls = scheduler.HostScheduler(
+                config_loader_inst.get_target_crawl_interval(),
+                config_loader_inst.get_max_host_concurrency(),
+                config_loader_inst.get_host_intervals(),
+                config_loader_inst.get_host_concurrency(),
+                memory_limit=config_loader_inst.get_frontier_memory_limit())
+        if config_loader_inst.get_adaptive():
+            frontiers = [self.checking_urls]
+            if self.target_urls is not self.checking_urls:
+                frontiers.append(self.target_urls)
+            self.adaptive = adaptive.AdaptiveController(
+                frontiers,
+                self.async_concurrency if self.engine == 'async' else self.thread_count,
+                config_loader_inst.get_max_host_concurrency(),
+                config_loader_inst.get_host_concurrency(),
+                self.try_times,
+                config_loader_inst.get_retry_base_delay(),
+                config_loader_inst.get_retry_max_delay(),
+                config_loader_inst.get_breaker_threshold(),
+                config_loader_inst.get_breaker_cooldown(),
+                config_loader_inst.get_adaptive_latency_factor())
+        self.tag_dict = config_loader_inst.get_tag_dict()
+        if config_loader_inst.get_canonicalize():
+            self.canonicalizer = canonicalize.Canonicalizer(
+                config_loader_inst.get_canonical_sort_query(),
+                config_loader_inst.get_canonical_strip_params(),
+                config_loader_inst.get_canonical_strip_trailing_slash())
+            self.raw_variants = seen_store.MemorySeenStore()
+        self.seen_urls = seen_store.create_seen_store(
+            config_loader_inst.get_seen_store(),
+            error_rate=config_loader_inst.get_bloom_error_rate(),
+            initial_capacity=config_loader_inst.get_bloom_initial_capacity(),
+            path=config_loader_inst.get_seen_store_path())
+        if config_loader_inst.get_near_dup_distance() >= 0:
+            self.near_dup_index = simhash.SimHashIndex(config_loader_inst.get_near_dup_distance())
+        if config_loader_inst.get_cluster_nodes() and not self.init_cluster(config_loader_inst):
+            self.program_end('MiniSpider Load config failed!')
+            return False
+
+        checkpoint_dir = config_loader_inst.get_checkpoint_dir()
+        if checkpoint_dir:
+            self.journal = checkpoint.CrawlJournal(checkpoint_dir,
+                                                   config_loader_inst.get_checkpoint_interval())
+            if self.resume and self.journal.exists():
+                self.resume_from_journal()
+                return True
+            if self.resume:
+                logging.warn(' * No checkpoint found in %s, start a new crawl' % checkpoint_dir)
+            self.journal.open(truncate=True)
+        elif self.resume:
+            # 没有 journal 无从续爬，提示后从种子重新开始
+            print termcolor.colored('No checkpoint_dir configured, --resume is ignored', 'yellow')
+            logging.warn(' * No checkpoint_dir configured, --resume is ignored')
 
         seedfile_is_exist = self.get_seed_urls()
         return seedfile_is_exist
 
 
+    def init_cluster(self, config_loader_inst):
+        """
+        create the cluster node of this process
+
+        Returns:
+            True/False: 节点配置有效返回 True，否则返回 False
+        """
+        nodes = config_loader_inst.get_cluster_nodes()
+        if self.node_id is None:
+            self.node_id = config_loader_inst.get_cluster_node_id()
+        if not 0 <= self.node_id < len(nodes):
+            logging.error('CONFIG ERROR: node id %d out of cluster_nodes' % self.node_id)
+            return False
+        try:
+            addresses = [cluster.parse_address(node) for node in nodes]
+        except ValueError as e:
+            logging.error('CONFIG ERROR: Bad cluster_nodes, %s' % e)
+            return False
+        self.cluster = cluster.ClusterNode(self.node_id,
+                                           len(addresses),
+                                           cluster.TcpTransport(self.node_id, addresses),
+                                           self.receive_urls,
+                                           self.is_idle,
+                                           self.node_stats,
+                                           config_loader_inst.get_cluster_batch_size(),
+                                           config_loader_inst.get_cluster_flush_interval())
+        return True
+
+
+    def receive_urls(self, url_objs):
+        """
+        enqueue urls forwarded by other nodes, 去重由本节点（host 的归属节点）负责
+
+        Args:
+            url_objs: url 对象列表
+        """
+        new_url_objs = [url_obj for url_obj in url_objs if self.seen_urls.add(url_obj.get_url())]
+        if new_url_objs:
+            if self.journal is not None:
+                self.journal.record_enqueue_many(new_url_objs)
+            self.put_urls(new_url_objs)
+
+
+    def is_idle(self):
+        """
+        whether both frontiers have no unfinished tasks
+        """
+        return self.checking_urls.unfinished_tasks == 0 and self.target_urls.unfinished_tasks == 0
+
+
+    def node_stats(self):
+        """
+        counters of this node reported to the coordinator
+        """
+        return {'checked_num': self.checked_num,
+                'error_num': self.error_num,
+                'dropped_num': self.dropped_num,
+                'canonical_dup_num': self.canonical_dup_num,
+                'forwarded_num': self.cluster.forwarded_num,
+                'received_num': self.cluster.received_num}
+
+
+    def report_cluster(self):
+        """
+        coordinator: print stats aggregated over all nodes
+        """
+        reports = self.cluster.gather_reports()
+        if len(reports) < self.cluster.node_num:
+            logging.warn(' * Cluster reports missing from %d nodes' %
+                         (self.cluster.node_num - len(reports)))
+        total = {}
+        for node_id in sorted(reports):
+            stats = reports[node_id]
+            for name, value in stats.iteritems():
+                total[name] = total.get(name, 0) + value
+            node_info = 'crawled {}, errors {}, forwarded {}, received {}'.format(
+                stats['checked_num'], stats['error_num'], stats['forwarded_num'],
+                stats['received_num'])
+            print termcolor.colored('* node {} : {}'.format(node_id, node_info), 'green')
+            logging.info('node {} : {}'.format(node_id, node_info))
+        cluster_info = '{} nodes, crawled {}, errors {}, dropped {}, forwarded {}'.format(
+            len(reports), total['checked_num'], total['error_num'], total['dropped_num'],
+            total['forwarded_num'])
+        print termcolor.colored('* cluster : {}'.format(cluster_info), 'green')
+        logging.info('cluster : {}'.format(cluster_info))
+
+
+    def stop_cluster(self):
+        """
+        print the aggregated report on the coordinator and close the transport
+        """
+        if self.cluster is None:
+            return
+        if self.cluster.node_id == cluster.COORDINATOR_ID:
+            self.report_cluster()
+        self.cluster.close()
+
+
+    def resume_from_journal(self):
+        """
+        restore seen urls, frontier and counters from the journal of last run
+        """
+        pending, self.checked_num, self.error_num = self.journal.load(self.seen_urls.add)
+        # 压缩 journal，避免多次续爬后 journal 无限增长
+        self.journal.compact(pending, self.checked_num, self.error_num)
+        self.journal.open(truncate=False)
+        self.put_urls([url_object.Url(url, depth) for url, depth in pending.iteritems()])
+
+        resume_info = 'resume with {} pending urls, {} seen urls'.format(len(pending),
+                                                                          len(self.seen_urls))
+        print termcolor.colored('* ' + resume_info, 'yellow')
+        logging.info(resume_info)
+
+
+    def enqueue_url(self, url_obj):
+        """
+        put url_obj into checking_urls if it has not been seen
+
+        Args:
+            url_obj: url 对象
+
+        Returns:
+            True/False: 入队返回 True，已见过返回 False
+        """
+        # 入队时即标记，避免同一链接在首次抓取完成前被重复入队
+        if not self.seen_urls.add(url_obj.get_url()):
+            return False
+        # 先写 journal 再入队，保证子链接的记录总在父页面完成记录之前
+        if self.journal is not None:
+            self.journal.record_enqueue(url_obj.get_url(), url_obj.get_depth())
+        self.put_urls([url_obj])
+        return True
+
+
+    def put_urls(self, url_objs):
+        """
+        route url objects: target url 进入下载通道，其余进入 HTML 抓取通道
+
+        Args:
+            url_objs: url 对象列表
+        """
+        html_url_objs = []
+        target_url_objs = []
+        for url_obj in url_objs:
+            if self.url_pattern.match(url_obj.get_url()):
+                target_url_objs.append(url_obj)
+            else:
+                html_url_objs.append(url_obj)
+        if html_url_objs:
+            self.checking_urls.put_many(html_url_objs)
+        if target_url_objs:
+            self.target_urls.put_many(target_url_objs)
+
+
     def get_seed_urls(self):
         """
         get seed urls from seedUrlFile
@@ -96,11 +401,42 @@ class MiniSpider(object):
             if line.strip() == '' or line.startswith('#'):
                 continue
 
-            url_obj = url_object.Url(line.strip(), 0)
-            self.checking_urls.put(url_obj)
+            url_obj = url_object.Url(self.canonicalize_url(line.strip()), 0)
+            # 每个节点读取相同的种子文件，只入队自己负责的 host
+            if self.cluster is not None and not self.cluster.is_local(url_obj.get_url()):
+                continue
+            self.enqueue_url(url_obj)
         return True
 
 
+    def apply_crawl_delay(self, url, rules):
+        """
+        raise crawl interval of url's host to the Crawl-delay of its robots.txt
+
+        Args:
+            url   : 该 host 下的任意 url
+            rules : 该 host 的 RobotsRules 对象
+        """
+        if not rules.crawl_delay:
+            return
+        host = scheduler.get_host(url)
+        delay = min(rules.crawl_delay, robots.MAX_CRAWL_DELAY)
+        for frontier in set([self.checking_urls, self.target_urls]):
+            # 只会放慢抓取，不会缩短配置中指定的间隔
+            if delay > frontier.get_interval(host):
+                frontier.set_interval(host, delay)
+        logging.info(' * Crawl-delay of %s : %s' % (host, delay))
+
+
+    def canonicalize_url(self, url):
+        """
+        canonicalize url before dedup, 未启用规范化时原样返回
+        """
+        if self.canonicalizer is None:
+            return url
+        return self.canonicalizer.canonicalize(url)
+
+
     def print_conf_info(self):
         """
         显示配置信息
@@ -116,6 +452,11 @@ class MiniSpider(object):
                                                    'green'
                                                    )
 
+        print termcolor.colored('* %-25s : %s' % ('output_layout   :',
+                                                   self.output_layout),
+                                                   'green'
+                                                   )
+
         print termcolor.colored('* %-25s : %s' % ('max_depth       :',
                                                   self.max_depth),
                                                   'green'
@@ -141,6 +482,21 @@ class MiniSpider(object):
                                                   'green'
                                                   )
 
+        print termcolor.colored('* %-25s : %s' % ('target_threads  :',
+                                                  self.target_thread_count),
+                                                  'green'
+                                                  )
+
+        print termcolor.colored('* %-25s : %s' % ('engine          :',
+                                                  self.engine),
+                                                  'green'
+                                                  )
+
+        print termcolor.colored('* %-25s : %s' % ('parser          :',
+                                                  self.parser),
+                                                  'green'
+                                                  )
+
 
     def program_end(self, info):
         """
@@ -152,20 +508,152 @@ class MiniSpider(object):
         Returns:
             none
         """
-        print termcolor.colored('* crawled page num : {}'.format(len(self.checked_urls)), 'green')
-        logging.info('crawled  pages  num : {}'.format(len(self.checked_urls)))
-        print termcolor.colored('* error page num : {}'.format(len(self.error_urls)), 'green')
-        logging.info('error page num : {}'.format(len(self.error_urls)))
+        print termcolor.colored('* crawled page num : {}'.format(self.checked_num), 'green')
+        logging.info('crawled  pages  num : {}'.format(self.checked_num))
+        print termcolor.colored('* error page num : {}'.format(self.error_num), 'green')
+        logging.info('error page num : {}'.format(self.error_num))
+        print termcolor.colored('* dropped links beyond max_depth : {}'.format(self.dropped_num),
+                                'green')
+        logging.info('dropped links beyond max_depth : {}'.format(self.dropped_num))
+        if self.canonicalizer is not None:
+            print termcolor.colored('* duplicate fetches saved by canonicalization : {}'.format(
+                self.canonical_dup_num), 'green')
+            logging.info('duplicate fetches saved by canonicalization : {}'.format(
+                self.canonical_dup_num))
+        if self.near_dup_index is not None:
+            near_dup_info = '{} pages not expanded, {} fetches avoided'.format(
+                self.near_dup_num, self.near_dup_avoided)
+            print termcolor.colored('* near duplicates : {}'.format(near_dup_info), 'green')
+            logging.info('near duplicates : {}'.format(near_dup_info))
+        if self.journal is not None and self.journal.file is not None:
+            self.journal.close()
+        if self.seen_urls is not None:
+            seen_info = '{} urls, {} bytes, {:.2f} bytes/url'.format(
+                len(self.seen_urls), self.seen_urls.memory_usage(), self.seen_urls.bytes_per_url())
+            print termcolor.colored('* seen store ({}) : {}'.format(self.seen_urls.name, seen_info),
+                                    'green')
+            logging.info('seen store ({}) : {}'.format(self.seen_urls.name, seen_info))
+            self.seen_urls.close()
+        encoding_stats = html_parser.get_encoding_stats()
+        if encoding_stats:
+            encoding_info = ', '.join('%s %d' % item for item in sorted(encoding_stats.items()))
+            print termcolor.colored('* encoding sources : {}'.format(encoding_info), 'green')
+            logging.info('encoding sources : {}'.format(encoding_info))
+        if self.checking_urls is not None:
+            self.checking_urls.close()
+        if self.target_urls is not None and self.target_urls is not self.checking_urls:
+            self.target_urls.close()
+        if self.conn_pool is not None:
+            reuse_info = '{} requests, {} reused, reuse ratio {:.2%}'.format(
+                self.conn_pool.request_num, self.conn_pool.reused_num,
+                self.conn_pool.reuse_ratio())
+            print termcolor.colored('* connection pool : {}'.format(reuse_info), 'green')
+            logging.info('connection pool : {}'.format(reuse_info))
+            self.conn_pool.close()
+        if self.target_store is not None:
+            store_info = self.target_store.stats()
+            if store_info:
+                print termcolor.colored('* target store ({}) : {}'.format(self.target_store.name,
+                                                                          store_info), 'green')
+                logging.info('target store ({}) : {}'.format(self.target_store.name, store_info))
+            self.target_store.close()
+        if self.http_cache is not None:
+            cache_info = '{} lookups, {} not modified, hit ratio {:.2%}, {} bytes saved'.format(
+                self.http_cache.lookup_num, self.http_cache.hit_num,
+                self.http_cache.hit_ratio(), self.http_cache.bytes_saved)
+            print termcolor.colored('* http cache : {}'.format(cache_info), 'green')
+            logging.info('http cache : {}'.format(cache_info))
+            self.http_cache.close()
+        if self.dns_cache is not None:
+            dns_info = '{} hits, {} misses, {} negative hits, {} prefetched, hit ratio {:.2%}'
+            dns_info = dns_info.format(
+                self.dns_cache.hit_num, self.dns_cache.miss_num, self.dns_cache.negative_hit_num,
+                self.dns_cache.prefetch_num, self.dns_cache.hit_ratio())
+            print termcolor.colored('* dns cache : {}'.format(dns_info), 'green')
+            logging.info('dns cache : {}'.format(dns_info))
+        if self.robots_cache is not None:
+            robots_info = '{} fetched, {} failed, {} urls disallowed'.format(
+                self.robots_cache.fetch_num, self.robots_cache.failure_num,
+                self.robots_cache.blocked_num)
+            print termcolor.colored('* robots.txt : {}'.format(robots_info), 'green')
+            logging.info('robots.txt : {}'.format(robots_info))
+        if self.adaptive is not None:
+            adaptive_info = '{} retries, {} breaker trips, {} hosts given up'.format(
+                self.adaptive.retry_num, self.adaptive.trip_num, self.adaptive.given_up_num)
+            print termcolor.colored('* adaptive control : {}'.format(adaptive_info), 'green')
+            logging.info('adaptive control : {}'.format(adaptive_info))
+        self.report_metrics()
         print termcolor.colored('* finish_reason  :' + info, 'green')
         logging.info('reason of ending :' + info)
         print termcolor.colored('* program is ended ... ', 'green')
         logging.info('program is ended ... ')
 
 
+    def report_metrics(self):
+        """
+        stop live stats and print histograms and per-host error rates
+        """
+        if self.stats_reporter is not None:
+            self.stats_reporter.stop()
+        if self.stats_server is not None:
+            self.stats_server.shutdown()
+            self.stats_server.server_close()
+        snapshot = metrics.snapshot()
+        for name, summary in sorted(snapshot['histograms'].items()):
+            metric_info = 'n {count}, mean {mean:.4f}, p50 {p50:.4f}, p99 {p99:.4f}, ' \
+                          'max {max:.4f}'.format(**summary)
+            print termcolor.colored('* {} : {}'.format(name, metric_info), 'green')
+            logging.info('{} : {}'.format(name, metric_info))
+        wire_bytes = snapshot['counters'].get('bytes_downloaded', 0)
+        decoded_bytes = snapshot['counters'].get('bytes_decoded', 0)
+        bytes_info = '{} bytes on wire, {} bytes decoded, compression ratio {:.2f}'.format(
+            wire_bytes, decoded_bytes, decoded_bytes / float(wire_bytes) if wire_bytes else 1.0)
+        print termcolor.colored('* {}'.format(bytes_info), 'green')
+        logging.info(bytes_info)
+        for host, (request_num, error_num, rate) in sorted(
+                metrics.host_error_rates(snapshot).items()):
+            if error_num:
+                host_info = '{} : {} errors / {} requests ({:.2%})'.format(host, error_num,
+                                                                          request_num, rate)
+                print termcolor.colored('* host errors {}'.format(host_info), 'green')
+                logging.info('host errors {}'.format(host_info))
+
+
+    def start_metrics(self):
+        """
+        register frontier gauges and start periodic stats line / stats endpoint
+        """
+        metrics.register_gauge('frontier_size', self.checking_urls.qsize)
+        metrics.register_gauge('frontier_spilled', self.checking_urls.spilled_num)
+        if self.target_urls is not self.checking_urls:
+            metrics.register_gauge('target_frontier_size', self.target_urls.qsize)
+        if self.stats_interval > 0:
+            self.stats_reporter = metrics.StatsReporter(metrics.REGISTRY, self.stats_interval)
+            self.stats_reporter.start()
+        if self.stats_port > 0:
+            self.stats_server = metrics.start_stats_server(metrics.REGISTRY, self.stats_port)
+            print termcolor.colored('Stats endpoint: http://127.0.0.1:%d/stats' %
+                                    self.stats_port, 'yellow')
+            logging.info('Stats endpoint: http://127.0.0.1:%d/stats' % self.stats_port)
+
+
     def run(self):
         """
         设置线程池，启动线程任务
         """
+        # 解析进程须在本进程的其它线程（统计、DNS 预解析、多节点传输、抓取）启动前 fork，
+        # 否则子进程可能继承被这些线程持有的锁；异步日志的写线程由 log.init_child_log 处理
+        if self.parse_processes > 0 and self.engine != 'async':
+            self.parse_pool = parse_pool.ParsePool(self.parse_processes,
+                                                   self.tag_dict,
+                                                   self.parser,
+                                                   self.parse_batch_size,
+                                                   self.parse_queue_size,
+                                                   with_fingerprint=self.near_dup_index is not None)
+            print termcolor.colored('Parse pool starts with %d processes ...' %
+                                    self.parse_processes, 'yellow')
+            logging.info('Parse pool starts with %d processes ...' % self.parse_processes)
+        self.start_metrics()
         args_dict = {}
         args_dict['output_dir'] = self.output_dir
         args_dict['crawl_interval'] = self.crawl_interval
@@ -173,27 +661,126 @@ class MiniSpider(object):
         args_dict['url_pattern'] = self.url_pattern
         args_dict['max_depth'] = self.max_depth
         args_dict['tag_dict'] = self.tag_dict
-
+        args_dict['try_times'] = self.try_times
+        args_dict['max_body_size'] = self.max_body_size
+        args_dict['parser'] = self.parser
+        args_dict['with_fingerprint'] = self.near_dup_index is not None
+        self.target_store = target_store.create_target_store(self.output_layout,
+                                                             self.output_dir,
+                                                             self.cas_pack_max_size,
+                                                             self.cas_segment_size)
+        args_dict['target_store'] = self.target_store
+        if self.dns_cache_ttl > 0:
+            self.dns_cache = dns_cache.DnsCache(self.dns_cache_ttl, self.dns_negative_ttl,
+                                                prefetch_threads=self.dns_prefetch_threads)
+        args_dict['dns_cache'] = self.dns_cache
+        args_dict['robots_cache'] = self.robots_cache
+        args_dict['adaptive'] = self.adaptive
+        if self.cluster is not None:
+            self.cluster.start()
+            print termcolor.colored('Cluster node %d of %d starts working ...' %
+                                    (self.cluster.node_id, self.cluster.node_num), 'yellow')
+            logging.info('Cluster node %d of %d starts working ...' %
+                         (self.cluster.node_id, self.cluster.node_num))
+        args_dict['cluster'] = self.cluster
+
+        if self.engine == 'async':
+            self.run_async(args_dict)
+            return
+
+        self.conn_pool = connection_pool.ConnectionPool(self.max_conn_per_host,
+                                                        self.max_conn_total,
+                                                        self.dns_cache)
+        args_dict['conn_pool'] = self.conn_pool
+        if self.robots_cache is not None:
+            self.robots_cache.fetch = robots.make_pool_fetcher(self.conn_pool, self.crawl_timeout)
+        if self.http_cache_path:
+            self.http_cache = http_cache.HttpCache(self.http_cache_path)
+        args_dict['http_cache'] = self.http_cache
+
+        args_dict['parse_pool'] = self.parse_pool
+
+        threads = []
         for index in xrange(self.thread_count):
             thread_name = 'thread - %d' % index
             thread = crawl_thread.CrawlerThread(thread_name,
                                                 self.process_request,
                                                 self.process_response,
-                                                args_dict)
+                                                args_dict,
+                                                self.checking_urls.retry)
 
             thread.setDaemon(True)  # 守护进程，主线程执行完毕后会将子线程回收掉
             thread.start()
+            threads.append(thread)
             print termcolor.colored(("Thread %s starts working ...") % index, 'yellow')
             logging.info(("Thread %s starts working ...") % index)
 
-        # Queue.join 会在队列存在未完成任务时阻塞，等待队列无未完成任务，需要配合 Queue.task_done 使用
-        self.checking_urls.join()
+        for index in xrange(self.target_thread_count):
+            thread_name = 'target thread - %d' % index
+            thread = crawl_thread.TargetThread(thread_name,
+                                               self.process_target_request,
+                                               self.process_target_response,
+                                               args_dict,
+                                               self.target_urls.retry)
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        print termcolor.colored('%d target threads start working ...' %
+                                self.target_thread_count, 'yellow')
+        logging.info('%d target threads start working ...' % self.target_thread_count)
+
+        # join 会在队列存在未完成任务时阻塞，等待队列无未完成任务，需要配合 task_done 使用
+        # HTML 通道结束后不会再产生新的 target，此时再等待下载通道完成
+        if self.cluster is not None:
+            # 本地队列为空时其它节点仍可能转发链接过来，由协调节点检测全局终止
+            self.cluster.wait()
+        else:
+            self.checking_urls.join()
+        if self.parse_pool is not None:
+            self.parse_pool.close()
+        self.target_urls.join()
+        # 停止并等待抓取线程退出，避免解释器退出时守护线程仍在运行
+        self.checking_urls.stop()
+        self.target_urls.stop()
+        for thread in threads:
+            thread.join()
+        self.stop_cluster()
+        self.program_end('Normal exits.')
+
+
+    def run_async(self, args_dict):
+        """
+        使用异步引擎，在单个事件循环中并发抓取
+
+        Args:
+            args_dict: 与线程引擎相同的抓取参数
+        """
+        # tornado 为可选依赖，仅在 engine = async 时导入
+        import async_engine
+
+        if self.ignored_options:
+            # 连接池、解析进程池和 HTTP 缓存只在线程引擎中生效
+            print termcolor.colored('Ignored with engine = async: %s' %
+                                    ', '.join(self.ignored_options), 'yellow')
+
+        print termcolor.colored('Async engine starts working with %d concurrency ...' %
+                                self.async_concurrency, 'yellow')
+        logging.info('Async engine starts working with %d concurrency ...' %
+                     self.async_concurrency)
+        crawler = async_engine.AsyncCrawler(self.checking_urls,
+                                            self.process_response,
+                                            args_dict,
+                                            self.async_concurrency,
+                                            self.checking_urls.retry)
+        crawler.run()
+        self.stop_cluster()
         self.program_end('Normal exits.')
 
 
     def is_url_visited(self, url_obj):
         """
-        check whether url_obj is visited(including checked_urls and error_urls)
+        check whether url_obj is visited(including checked_urls, error_urls
+        and urls already put into checking_urls but not fetched yet)
 
         Args:
             url_obj: url 对象
@@ -201,11 +788,7 @@ class MiniSpider(object):
         Returns:
             True/False: 若访问过则返回 True ，否则返回 False
         """
-        checked_url_list = self.checked_urls.union(self.error_urls)
-        for checked_url in checked_url_list:
-            if url_obj.get_url() == checked_url.get_url():
-                return True
-        return False
+        return url_obj.get_url() in self.seen_urls
 
 
     def process_request(self):
@@ -220,45 +803,162 @@ class MiniSpider(object):
         return url_obj
 
 
-    def process_response(self, url_obj, flag, extract_url_list=None):
+    def process_target_request(self):
+        """
+        下载通道 request 回调函数：从 target_urls 中取出 url 对象
+        """
+        return self.target_urls.get()
+
+
+    def process_target_response(self, url_obj, flag):
+        """
+        下载通道 response 回调函数
+
+        Args:
+            url_obj: target url 对象
+            flag   : 1 表示保存成功，-1 表示保存失败，3 表示被 robots.txt 禁止
+        """
+        try:
+            with self.stats_lock:
+                if flag == -1:
+                    self.error_num += 1
+                elif flag == 1:
+                    self.checked_num += 1
+            self.count_host_result(url_obj, flag)
+
+            if self.journal is not None:
+                self.journal.record_done(url_obj.get_url(), flag)
+        finally:
+            # 与 process_response 相同，出错时也要 task_done
+            self.target_urls.task_done(url_obj)
+
+
+    def count_host_result(self, url_obj, flag):
+        """
+        count requests and errors per host, flag 2 和 3 没有发出请求，不计入
+        """
+        if flag in (2, 3):
+            return
+        host = scheduler.get_host(url_obj.get_url())
+        metrics.incr('host_requests', label=host)
+        if flag == -1:
+            metrics.incr('host_errors', label=host)
+
+
+    def count_new_links(self, url_obj, extract_url_list):
+        """
+        count links of a page which would be enqueued, 不修改 seen store
+
+        Args:
+            url_obj          : 页面的 url 对象
+            extract_url_list : 页面中抽取出的链接
+
+        Returns:
+            会入队的链接数
+        """
+        next_depth = int(url_obj.get_depth()) + 1
+        new_urls = set()
+        for ex_url in extract_url_list:
+            canonical_url = self.canonicalize_url(ex_url)
+            if next_depth >= self.max_depth and not self.url_pattern.match(canonical_url):
+                continue
+            if canonical_url not in self.seen_urls:
+                new_urls.add(canonical_url)
+        return len(new_urls)
+
+
+    def process_response(self, url_obj, flag, extract_url_list=None, fingerprint=None):
         """
         线程任务 response 回调函数：
             解析 HTML 源码，获取下一层 URLs 放入 checking_urls
 
         Args:
             extract_url_list: 返回抽取出的urls集合
+            fingerprint: 页面的 SimHash 指纹，未计算时为 None
             url_obj: 被下载页面所处的url链接对象
             flag: 页面下载具体情况的返回标志
                     - 0  : 表示下载成功且为非pattern页面
                     - 1  : 表示下载成功且为符合pattern的图片
                     - -1 : 表示页面下载失败
                     - 2  : depth >= max_depth 的非 target URL
+                    - 3  : 被 robots.txt 禁止，没有下载
         """
-        # 多个线程可能同时访问 self.checking_urls, self.checked_urls 和 self.error_urls
-        # 需要加锁
-        if self.lock.acquire():
-            if flag == -1:
-                self.error_urls.add(url_obj)
+        try:
+            self.record_response(url_obj, flag, extract_url_list, fingerprint)
+        finally:
+            # task_done() 向调度器发送任务完成的信号，并释放该 host 的并发名额
+            # 可以理解为，每 task_done 一次，就从队列里删掉一个元素
+            # 记录中途出错（journal 写失败、spill 文件写失败等）时也必须 task_done，
+            # 否则 join() 永远等待；抓取线程据此在回调抛出异常后不再重复回调
+            self.checking_urls.task_done(url_obj)
 
-            elif flag == 0:
-                self.checked_urls.add(url_obj)
-                for ex_url in extract_url_list:
-                    next_url_obj = url_object.Url(ex_url, int(url_obj.get_depth()) + 1)
-                    if not self.is_url_visited(next_url_obj):
-                        self.checking_urls.put(next_url_obj)
 
-            elif flag == 1:
-                self.checked_urls.add(url_obj)
+    def record_response(self, url_obj, flag, extract_url_list, fingerprint):
+        """
+        count a finished url and enqueue its new links, 参数同 process_response
+        """
+        # 不再使用全局锁：seen store 按 url 哈希分片加锁，调度器、journal 和计数器
+        # 各自持有独立的锁，且每个页面只批量获取一次调度器和 journal 的锁
+        canonical_dup_num = 0
+        dropped_num = 0
+        near_dup_num = 0
+        near_dup_avoided = 0
+        if (flag == 0 and fingerprint is not None and self.near_dup_index is not None and
+                not self.near_dup_index.add_if_new(fingerprint)):
+            # 与已抓取页面近似重复（镜像、session id 变体等），不再展开其链接
+            near_dup_num = 1
+            near_dup_avoided = self.count_new_links(url_obj, extract_url_list)
+            metrics.incr('near_dup_pages')
+            metrics.incr('near_dup_avoided', near_dup_avoided)
+        elif flag == 0:
+            next_depth = int(url_obj.get_depth()) + 1
+            new_url_objs = []
+            for ex_url in extract_url_list:
+                canonical_url = self.canonicalize_url(ex_url)
+                # 超过 max_depth 的非 target 链接抓到后也只会被丢弃（flag 2），入队前直接丢弃
+                if next_depth >= self.max_depth and not self.url_pattern.match(canonical_url):
+                    dropped_num += 1
+                    continue
+                # 入队前即标记，避免同一链接在首次抓取完成前被重复入队
+                if self.seen_urls.add(canonical_url):
+                    if canonical_url != ex_url:
+                        self.raw_variants.add(ex_url)
+                    # 已缓存 robots.txt 的 host 在入队前过滤；未缓存的 host 在抓取前检查
+                    if (self.robots_cache is not None and
+                            self.robots_cache.check(canonical_url) is False):
+                        continue
+                    new_url_objs.append(url_object.Url(canonical_url, next_depth))
+                elif canonical_url != ex_url and self.raw_variants.add(ex_url):
+                    # 该原始写法从未出现过，只因规范化才判为重复；同一写法再次出现本就不会重复抓取
+                    canonical_dup_num += 1
+            if self.cluster is not None:
+                new_url_objs = self.cluster.route(new_url_objs)
+            if new_url_objs:
+                # 先写 journal 再入队，保证子链接的记录总在父页面完成记录之前
+                if self.journal is not None:
+                    self.journal.record_enqueue_many(new_url_objs)
+                self.put_urls(new_url_objs)
+                if self.dns_cache is not None and self.dns_prefetch_threads > 0:
+                    self.dns_cache.prefetch([obj.get_url() for obj in new_url_objs])
+
+        start = time.time()
+        with self.stats_lock:
+            metrics.observe('lock_wait.stats', time.time() - start)
+            self.canonical_dup_num += canonical_dup_num
+            self.dropped_num += dropped_num
+            self.near_dup_num += near_dup_num
+            self.near_dup_avoided += near_dup_avoided
+            if flag == -1:
+                self.error_num += 1
+            elif flag in (0, 1):
+                self.checked_num += 1
+        self.count_host_result(url_obj, flag)
 
-            # Queue.task_done()函数向任务已经完成的队列发送一个信号
-            # 可以理解为，每 task_done 一次，就从队列里删掉一个元素
-            self.checking_urls.task_done()
-        self.lock.release()
+        if self.journal is not None:
+            self.journal.record_done(url_obj.get_url(), flag)
 
 
 if __name__ == '__main__':
-    log.init_log('./log/mini_spider')
-    logging.info('%-35s' % ' * MiniSpider is starting ... ')
     red_on_cyan = lambda x: termcolor.colored(x, 'red', 'on_cyan')
 
     parser = argparse.ArgumentParser(description='MiniSpider')
@@ -272,10 +972,47 @@ if __name__ == '__main__':
                         dest='CONF_PATH',
                         default='spider.conf',
                         help='Configuration file path')
+    parser.add_argument('-r',
+                        '--resume',
+                        action='store_true',
+                        dest='RESUME',
+                        help='Resume from the checkpoint of last run')
+    parser.add_argument('--log_level',
+                        action='store',
+                        dest='LOG_LEVEL',
+                        default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='Log level, DEBUG logs every url')
+    parser.add_argument('--async_log',
+                        action='store_true',
+                        dest='ASYNC_LOG',
+                        help='Write log in a separate thread')
+    parser.add_argument('--log_rate_limit',
+                        action='store',
+                        dest='LOG_RATE_LIMIT',
+                        type=int,
+                        default=0,
+                        help='Max log lines per second of each call site below ERROR, '
+                             '0 means no limit')
+    parser.add_argument('-n',
+                        '--node_id',
+                        action='store',
+                        dest='NODE_ID',
+                        type=int,
+                        default=None,
+                        help='Index of this node in cluster_nodes, overrides cluster_node_id')
     args = parser.parse_args()
 
+    log_path = './log/mini_spider'
+    if args.NODE_ID is not None:
+        # 同一台机器上的多个节点写各自的日志文件
+        log_path += '.%d' % args.NODE_ID
+    log.init_log(log_path, level=getattr(logging, args.LOG_LEVEL),
+                 async_mode=args.ASYNC_LOG, rate_limit=args.LOG_RATE_LIMIT)
+    logging.info('%-35s' % ' * MiniSpider is starting ... ')
+
     print red_on_cyan('* MiniSpider is Staring ... ')
-    mini_spider_inst = MiniSpider(args.CONF_PATH)
+    mini_spider_inst = MiniSpider(args.CONF_PATH, args.RESUME, args.NODE_ID)
     init_success = mini_spider_inst.initialize()
     if init_success:
         mini_spider_inst.print_conf_info()
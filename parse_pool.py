@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: parse_pool.py
+Description: 基于 multiprocessing 的 HTML 解析进程池，把解析从抓取线程中分离出来，
+             使解析可以利用多核而不受 GIL 限制
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import Queue
+import itertools
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+
+import html_parser
+import log
+import metrics
+
+# 子进程中的解析参数，由 init_worker 设置
+_WORKER_ARGS = {}
+
+
+def init_worker(tag_dict, backend, with_fingerprint=False):
+    """
+    initializer of parse processes
+    """
+    # Ctrl-C 由主进程处理
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    log.init_child_log()
+    _WORKER_ARGS['tag_dict'] = tag_dict
+    _WORKER_ARGS['backend'] = backend
+    _WORKER_ARGS['with_fingerprint'] = with_fingerprint
+
+
+def parse_batch(batch):
+    """
+    parse a batch of pages in a worker process
+
+    Args:
+        batch: [(job_id, content, url, charset), ...]
+
+    Returns:
+        [(job_id, extract_url_list, fingerprint, encoding_source, parse_time), ...]
+    """
+    results = []
+    for job_id, content, url, charset in batch:
+        start = time.time()
+        # python 2 的 Pool 没有 error_callback，单个页面出错时必须在这里兜住，
+        # 否则整批结果丢失、对应任务永远无法完成
+        try:
+            parser = html_parser.HtmlParser(content, _WORKER_ARGS['tag_dict'], url,
+                                            _WORKER_ARGS['backend'], charset,
+                                            _WORKER_ARGS['with_fingerprint'])
+            extract_url_list = parser.extract_url()
+            results.append((job_id, extract_url_list, parser.fingerprint,
+                            parser.encoding_source, time.time() - start))
+        except Exception as e:
+            logging.error(' * Parse failed: %s - %s' % (url, e))
+            results.append((job_id, [], None, 'none', time.time() - start))
+    return results
+
+
+class ParsePool(object):
+    """
+    Parse stage backed by a process pool.
+
+    抓取线程通过 submit() 提交页面，dispatcher 线程把页面攒成批次交给进程池，
+    解析结果通过回调交回。队列满或在途批次过多时 submit() 阻塞，形成背压。
+
+    Attributes:
+        processes     : 解析进程数
+        batch_size    : 每批最多页面数
+        batch_timeout : 攒批的最长等待时间（秒）
+        jobs          : 待分批的页面队列（有界）
+        callbacks     : job_id -> 回调函数
+    """
+    def __init__(self, processes, tag_dict, backend, batch_size=16, queue_size=256,
+                 batch_timeout=0.05, with_fingerprint=False):
+        self.processes = processes
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.jobs = Queue.Queue(queue_size)
+        self.callbacks = {}
+        self.callbacks_lock = threading.Lock()
+        self.job_ids = itertools.count()
+        # 在途批次数上限，避免进程池内部队列无限堆积
+        self.inflight_batches = threading.Semaphore(processes * 2)
+        self.pool = multiprocessing.Pool(processes, init_worker,
+                                         (tag_dict, backend, with_fingerprint))
+        self.dispatcher = threading.Thread(target=self.dispatch, name='parse dispatcher')
+        self.dispatcher.setDaemon(True)
+        self.dispatcher.start()
+
+
+    def submit(self, content, url, charset, callback):
+        """
+        submit a page for parsing, 队列满时阻塞
+
+        Args:
+            content : 页面内容
+            url     : 页面 url
+            charset : HTTP 头中的编码
+            callback: 解析完成后以 (extract_url_list, fingerprint) 为参数调用
+        """
+        job_id = next(self.job_ids)
+        with self.callbacks_lock:
+            self.callbacks[job_id] = callback
+        self.jobs.put((job_id, content, url, charset))
+
+
+    def dispatch(self):
+        """
+        dispatcher thread: 攒批并提交给进程池
+        """
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            batch = [job]
+            deadline = time.time() + self.batch_timeout
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self.jobs.get(timeout=remaining)
+                except Queue.Empty:
+                    break
+                if job is None:
+                    self.jobs.put(None)
+                    break
+                batch.append(job)
+
+            self.inflight_batches.acquire()
+            self.pool.apply_async(parse_batch, (batch,), callback=self.on_batch_done)
+
+
+    def on_batch_done(self, results):
+        """
+        callback of a finished batch, 在进程池的结果处理线程中执行
+        """
+        self.inflight_batches.release()
+        for job_id, extract_url_list, fingerprint, encoding_source, parse_time in results:
+            html_parser.count_encoding_source(encoding_source)
+            # 解析耗时在子进程中测量，在主进程中汇总
+            metrics.observe('parse_time', parse_time)
+            with self.callbacks_lock:
+                callback = self.callbacks.pop(job_id)
+            try:
+                callback(extract_url_list, fingerprint)
+            except Exception as e:
+                logging.error(' * Parse callback failed: %s' % e)
+
+
+    def close(self):
+        """
+        stop dispatcher and worker processes
+        """
+        self.jobs.put(None)
+        self.dispatcher.join()
+        self.pool.close()
+        self.pool.join()
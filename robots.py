@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: robots.py
+Description: robots.txt 的解析、按 host 缓存和匹配：每个 host 的 robots.txt 只抓取一次，
+             规则预编译为按优先级排序的前缀 / 正则列表，抓取失败的结果同样缓存
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import httplib
+import logging
+import re
+import threading
+import time
+import urllib2
+import urlparse
+
+import compression
+import metrics
+
+# 与 connection_pool.USER_AGENT 的产品名一致，匹配 User-agent 时不区分大小写
+ROBOTS_AGENT = 'minispider'
+# 超过此大小的 robots.txt 只解析前面的部分
+MAX_ROBOTS_SIZE = 512 * 1024
+# Crawl-delay 的上限（秒），避免个别站点把抓取拖到停滞
+MAX_CRAWL_DELAY = 30.0
+
+
+class RobotsRules(object):
+    """
+    Compiled Allow/Disallow rules of one user-agent group.
+
+    按最长匹配优先：规则按模式长度降序排列（等长时 Allow 优先），第一条匹配的规则决定结果；
+    不含通配符的规则用 str.startswith 匹配，含 * 或 $ 的规则编译为正则。
+
+    Attributes:
+        rules       : [(allow, prefix, regex), ...]，regex 为 None 时按 prefix 匹配
+        crawl_delay : Crawl-delay（秒），未指定时为 None
+    """
+    def __init__(self, rules=(), crawl_delay=None):
+        compiled = []
+        for allow, pattern in sorted(rules, key=lambda rule: (-len(rule[1]), not rule[0])):
+            if '*' in pattern or pattern.endswith('$'):
+                compiled.append((allow, None, self.compile_pattern(pattern)))
+            else:
+                compiled.append((allow, pattern, None))
+        self.rules = compiled
+        # 没有 Disallow 规则时无需逐条匹配
+        self.allow_all = not any(not allow for allow, _, _ in compiled)
+        self.crawl_delay = crawl_delay
+
+
+    @staticmethod
+    def compile_pattern(pattern):
+        """
+        compile a robots path pattern, * 匹配任意字符序列，结尾的 $ 表示匹配到路径末尾
+        """
+        anchored = pattern.endswith('$')
+        if anchored:
+            pattern = pattern[:-1]
+        regex = '.*'.join(re.escape(part) for part in pattern.split('*'))
+        return re.compile(regex + ('$' if anchored else ''), re.S)
+
+
+    def allowed(self, path):
+        """
+        check whether path (含 query) is allowed
+
+        Args:
+            path: 以 / 开头的路径
+
+        Returns:
+            True/False: 允许抓取返回 True，否则返回 False
+        """
+        if self.allow_all:
+            return True
+        for allow, prefix, regex in self.rules:
+            if regex is None:
+                if path.startswith(prefix):
+                    return allow
+            elif regex.match(path):
+                return allow
+        return True
+
+
+ALLOW_ALL = RobotsRules()
+
+
+def parse(content, agent=ROBOTS_AGENT):
+    """
+    parse robots.txt, 使用 User-agent 与 agent 匹配的分组，没有时使用 * 分组
+
+    Args:
+        content : robots.txt 内容
+        agent   : 小写的爬虫名
+
+    Returns:
+        RobotsRules 对象
+    """
+    # 分组：[(agents, rules, crawl_delay)]，连续的 User-agent 行属于同一分组
+    groups = []
+    agents = None
+    in_rules = True
+    for line in content.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if ':' not in line:
+            continue
+        field, value = line.split(':', 1)
+        field = field.strip().lower()
+        value = value.strip()
+        if field == 'user-agent':
+            if in_rules:
+                agents = set()
+                groups.append([agents, [], None])
+                in_rules = False
+            agents.add(value.lower())
+            continue
+        if agents is None:
+            continue
+        in_rules = True
+        group = groups[-1]
+        if field in ('allow', 'disallow'):
+            # 空的 Disallow 表示不限制
+            if value:
+                group[1].append((field == 'allow', value))
+        elif field == 'crawl-delay':
+            try:
+                group[2] = float(value)
+            except ValueError:
+                pass
+
+    matched = [group for group in groups
+               if any(name != '*' and name in agent for name in group[0])]
+    if not matched:
+        matched = [group for group in groups if '*' in group[0]]
+    if not matched:
+        return ALLOW_ALL
+    # 同一 agent 出现在多个分组时合并规则
+    rules = [rule for group in matched for rule in group[1]]
+    delays = [group[2] for group in matched if group[2] is not None]
+    return RobotsRules(rules, max(delays) if delays else None)
+
+
+def get_robots_key(url):
+    """
+    get (cache key, robots.txt url, path) of url, robots.txt 按 scheme + host + port 生效
+
+    Returns:
+        (key, robots_url, path)，url 不是 http(s) 时返回 None
+    """
+    try:
+        parsed = urlparse.urlsplit(url)
+    except ValueError:
+        return None
+    scheme = parsed.scheme.lower()
+    if scheme not in ('http', 'https') or not parsed.netloc:
+        return None
+    key = '%s://%s' % (scheme, parsed.netloc.lower())
+    path = parsed.path or '/'
+    if parsed.query:
+        path += '?' + parsed.query
+    return key, key + '/robots.txt', path
+
+
+def make_pool_fetcher(conn_pool, timeout):
+    """
+    make a robots.txt fetcher using the shared connection pool
+
+    Returns:
+        fetch(url) -> (status, body) 函数，网络错误时抛出 IOError/httplib.HTTPException
+    """
+    def fetch(url):
+        try:
+            response = conn_pool.urlopen(url, timeout)
+        except urllib2.HTTPError as e:
+            return e.code, ''
+        parts = []
+        size = 0
+        try:
+            # 解压后超过 MAX_ROBOTS_SIZE 时截断，解压上限放宽一倍以容纳最后一块
+            decoder = compression.ContentDecoder(response.getheader('content-encoding'),
+                                                 2 * MAX_ROBOTS_SIZE)
+            while size < MAX_ROBOTS_SIZE:
+                chunk = response.read(compression.DECODE_CHUNK_SIZE)
+                if not chunk:
+                    parts.append(decoder.flush())
+                    break
+                data = decoder.decode(chunk)
+                parts.append(data)
+                size += len(data)
+        finally:
+            response.close()
+        return response.code, ''.join(parts)[:MAX_ROBOTS_SIZE]
+    return fetch
+
+
+class RobotsCache(object):
+    """
+    Thread-safe per-host cache of robots.txt rules.
+
+    2xx 按内容解析；4xx 视为没有限制；5xx 和网络错误同样按没有限制处理，但只缓存
+    failure_ttl 秒，过期后重新抓取。
+
+    Attributes:
+        fetch       : fetch(robots_url) -> (status, body)，None 时只能通过 store 写入规则
+        ttl         : 成功抓取的 robots.txt 的缓存时间（秒）
+        failure_ttl : 抓取失败（5xx、网络错误）的缓存时间（秒）
+        on_rules    : 新规则生效时的回调 on_rules(url, rules)，用于应用 Crawl-delay
+        fetch_num   : 实际抓取 robots.txt 的次数
+        failure_num : 抓取失败的次数
+        blocked_num : 被 robots.txt 禁止的 url 数
+    """
+    def __init__(self, fetch=None, ttl=86400.0, failure_ttl=600.0, on_rules=None,
+                 clock=time.time):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.on_rules = on_rules
+        self.clock = clock
+        # key -> (过期时间, RobotsRules)
+        self.entries = {}
+        # key -> Event，正在抓取的 key，其它线程等待其结果
+        self.pending = {}
+        self.fetch_num = 0
+        self.failure_num = 0
+        self.blocked_num = 0
+        self.lock = threading.Lock()
+
+
+    def lookup(self, key):
+        """
+        get unexpired rules of key, 调用方需持有 self.lock
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= self.clock():
+            return None
+        return entry[1]
+
+
+    def check(self, url):
+        """
+        check url against cached rules only, 不发起抓取，用于入队前过滤
+
+        Returns:
+            True/False: 允许/禁止，规则未缓存时返回 None
+        """
+        robots_key = get_robots_key(url)
+        if robots_key is None:
+            return True
+        key, _, path = robots_key
+        with self.lock:
+            rules = self.lookup(key)
+        if rules is None:
+            return None
+        return self.count(rules.allowed(path))
+
+
+    def allowed(self, url):
+        """
+        check url, 规则未缓存时抓取 robots.txt，同一 host 的并发请求只抓取一次
+        """
+        robots_key = get_robots_key(url)
+        if robots_key is None:
+            return True
+        key, robots_url, path = robots_key
+        while True:
+            with self.lock:
+                rules = self.lookup(key)
+                event = self.pending.get(key)
+                if rules is None and event is None:
+                    self.pending[key] = threading.Event()
+                    break
+            if rules is not None:
+                return self.count(rules.allowed(path))
+            # 其它线程正在抓取同一个 host 的 robots.txt，等待其结果后重新查缓存
+            event.wait()
+
+        status, body = None, ''
+        try:
+            status, body = self.fetch(robots_url)
+        except (IOError, httplib.HTTPException) as e:
+            logging.warn(' * Fetch robots.txt failed: %s - %s' % (robots_url, e))
+        finally:
+            # 其它异常同样要写入结果并唤醒等待者
+            rules = self.store(url, status, body)
+            with self.lock:
+                event = self.pending.pop(key)
+            event.set()
+        return self.count(rules.allowed(path))
+
+
+    def store(self, url, status, body):
+        """
+        store the robots.txt fetch result of url's host
+
+        Args:
+            url    : 该 host 下的任意 url
+            status : HTTP 状态码，网络错误时为 None
+            body   : robots.txt 内容
+
+        Returns:
+            生效的 RobotsRules 对象
+        """
+        key = get_robots_key(url)[0]
+        failed = False
+        if status is not None and 200 <= status < 300:
+            rules = parse(body)
+        elif status is not None and 400 <= status < 500:
+            rules = ALLOW_ALL
+        else:
+            rules = ALLOW_ALL
+            failed = True
+        with self.lock:
+            self.fetch_num += 1
+            if failed:
+                self.failure_num += 1
+            self.entries[key] = (self.clock() + (self.failure_ttl if failed else self.ttl), rules)
+        metrics.incr('robots_fetch')
+        if failed:
+            metrics.incr('robots_failure')
+        if self.on_rules is not None:
+            self.on_rules(url, rules)
+        return rules
+
+
+    def count(self, allowed):
+        """
+        count a disallowed url, 原样返回 allowed
+        """
+        if not allowed:
+            with self.lock:
+                self.blocked_num += 1
+            metrics.incr('robots_blocked')
+        return allowed
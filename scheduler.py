@@ -0,0 +1,506 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: scheduler.py
+Description: 按 host 维护抓取间隔的 frontier 调度器，替代全局 time.sleep(crawl_interval)；
+             在已就绪的 host 之间按 (depth, score) 优先级出队，超出内存上限的 url 溢出到磁盘
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import Queue
+import collections
+import heapq
+import itertools
+import tempfile
+import threading
+import time
+import urlparse
+
+import metrics
+import url_object
+
+FRONTIER_SCORERS = ('none', 'target')
+
+
+def get_host(url):
+    """
+    get lower-cased host name of url, 作为调度的单位
+    """
+    try:
+        return (urlparse.urlsplit(url).hostname or '').lower()
+    except ValueError:
+        return ''
+
+
+class TargetScorer(object):
+    """
+    Score urls by target-pattern likelihood: 同一深度下优先抓取符合 target_url 的 url
+
+    Attributes:
+        url_pattern: 预编译的 target_url 正则
+    """
+    def __init__(self, url_pattern):
+        self.url_pattern = url_pattern
+
+
+    def __call__(self, url_obj):
+        return 1.0 if self.url_pattern.match(url_obj.get_url()) else 0.0
+
+
+def create_scorer(name, url_pattern):
+    """
+    create frontier scorer by name
+
+    Args:
+        name       : FRONTIER_SCORERS 之一
+        url_pattern: 预编译的 target_url 正则
+
+    Returns:
+        scorer: 以 url 对象为参数返回分数（越大越优先）的函数，'none' 时为 None
+    """
+    if name == 'target':
+        return TargetScorer(url_pattern)
+    return None
+
+
+class SpillFile(object):
+    """
+    Disk overflow of the frontier, 按先进先出顺序追加和读取 url
+
+    Attributes:
+        size: 文件中尚未读取的 url 数
+    """
+    def __init__(self):
+        self.file = None
+        self.read_pos = 0
+        self.write_pos = 0
+        self.size = 0
+
+
+    def append(self, url_obj):
+        """
+        append a url object to the spill file
+        """
+        if self.file is None:
+            self.file = tempfile.TemporaryFile(prefix='frontier-')
+        url = url_obj.get_url()
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+        url = url.replace('\t', '%09').replace('\n', '%0A').replace('\r', '%0D')
+        self.file.seek(self.write_pos)
+        self.file.write('%d\t%d\t%s\n' % (url_obj.get_depth(), url_obj.get_retry_num(), url))
+        self.write_pos = self.file.tell()
+        self.size += 1
+
+
+    def pop_many(self, num):
+        """
+        read at most num url objects from the spill file
+
+        Returns:
+            url 对象列表
+        """
+        url_objs = []
+        if self.size == 0:
+            return url_objs
+        self.file.seek(self.read_pos)
+        while len(url_objs) < num and self.size > 0:
+            depth, retry_num, url = self.file.readline()[:-1].split('\t', 2)
+            url_objs.append(url_object.Url(url.decode('utf-8'), int(depth), int(retry_num)))
+            self.size -= 1
+        self.read_pos = self.file.tell()
+        if self.size == 0:
+            # 全部读完后清空文件，避免文件无限增长
+            self.file.seek(0)
+            self.file.truncate()
+            self.read_pos = self.write_pos = 0
+        return url_objs
+
+
+    def close(self):
+        """
+        close and delete the spill file
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class HostScheduler(object):
+    """
+    Per-host politeness scheduler with priority and Queue-like interface.
+
+    每个 host 有独立的优先队列和下一次可抓取时间（ready time）。
+    ready time 未到的 host 放在 waiting_heap 中，已就绪的 host 按其队首 url 的
+    (depth, -score) 放在 available_heap 中，get() 总是取出所有已就绪 host 中
+    优先级最高的 url，所以一个 host 的抓取间隔只限制该 host，不影响其它 host。
+
+    Attributes:
+        default_interval    : 缺省的 host 抓取间隔
+        default_concurrency : 缺省的 host 最大并发数，0 表示不限制
+        host_intervals      : host -> 抓取间隔
+        host_concurrency    : host -> 最大并发数
+        scorer              : url 打分函数，分数越大越优先，None 表示只按深度排序
+        memory_limit        : 内存中最多保存的待抓取 url 数，0 表示不限制
+        unfinished_tasks    : 已 put 但尚未 task_done 的任务数
+        stopped             : 是否已调用 stop()，之后 get() 返回 None
+    """
+    def __init__(self, default_interval, default_concurrency=0,
+                 host_intervals=None, host_concurrency=None, scorer=None, memory_limit=0):
+        self.default_interval = default_interval
+        self.default_concurrency = default_concurrency
+        self.host_intervals = dict(host_intervals or {})
+        self.host_concurrency = dict(host_concurrency or {})
+        self.scorer = scorer
+        self.memory_limit = memory_limit
+        # host -> [(depth, -score, seq, url_obj), ...] 小顶堆
+        self.host_queues = collections.defaultdict(list)
+        self.host_ready = {}
+        self.host_inflight = collections.defaultdict(int)
+        # (ready_time, seq, host)：有待抓取 url、未达并发上限但 ready time 未到的 host
+        self.waiting_heap = []
+        # ((depth, -score, seq), host)：已就绪的 host，按队首 url 的优先级排序
+        self.available_heap = []
+        # host -> available_heap 中该 host 的有效 key，其余同 host 的条目已过期
+        self.available_keys = {}
+        # (due_time, seq, host, url_obj)：等待重试的 url，到期后放回 host 队列
+        self.retry_heap = []
+        self.scheduled_hosts = set()
+        self.spill = SpillFile()
+        self.seq = itertools.count()
+        self.unfinished_tasks = 0
+        self.stopped = False
+        self.pending_num = 0
+        self.memory_num = 0
+        # 唤醒 get()/join() 的等待者时同时调用的回调，供不能阻塞在 cond 上的异步引擎使用
+        self.listeners = []
+        self.cond = threading.Condition(threading.Lock())
+
+
+    def get_interval(self, host):
+        """
+        get crawl interval of host
+        """
+        return self.host_intervals.get(host, self.default_interval)
+
+
+    def set_interval(self, host, interval):
+        """
+        set crawl interval of host
+        """
+        with self.cond:
+            self.host_intervals[host] = interval
+
+
+    def get_concurrency(self, host):
+        """
+        get max concurrency of host, 0 表示不限制
+        """
+        return self.host_concurrency.get(host, self.default_concurrency)
+
+
+    def set_concurrency(self, host, concurrency):
+        """
+        set max concurrency of host, 放宽时该 host 立即可以被调度
+        """
+        with self.cond:
+            self.host_concurrency[host] = concurrency
+            self.schedule(host)
+
+
+    def pause(self, host, until):
+        """
+        pause host until the given time, 已在 available_heap 中的 host 移回 waiting_heap
+        """
+        with self.cond:
+            if until <= self.host_ready.get(host, 0):
+                return
+            self.host_ready[host] = until
+            if host in self.available_keys:
+                # available_heap 中的旧条目在出队时被跳过
+                del self.available_keys[host]
+                self.scheduled_hosts.discard(host)
+                self.schedule(host)
+
+
+    def add_listener(self, listener):
+        """
+        add a callback called whenever waiters are woken up (url 就绪、任务完成、重试入队)，
+        回调在持有 self.cond 时调用，必须立即返回且不能再调用本对象的方法
+        """
+        with self.cond:
+            self.listeners.append(listener)
+
+
+    def remove_listener(self, listener):
+        with self.cond:
+            self.listeners.remove(listener)
+
+
+    def notify(self):
+        """
+        wake up all waiters and listeners, 调用方需持有 self.cond
+        """
+        self.cond.notify_all()
+        for listener in self.listeners:
+            listener()
+
+
+    def next_wake_time(self):
+        """
+        get the earliest time a waiting host or a retry becomes ready
+
+        Returns:
+            时间戳，没有等待中的 host 和重试时返回 None
+        """
+        with self.cond:
+            wake_times = [heap[0][0] for heap in (self.waiting_heap, self.retry_heap) if heap]
+            return min(wake_times) if wake_times else None
+
+
+    def make_available(self, host):
+        """
+        put host into available heap keyed by its best url, 调用方需持有 self.cond
+        """
+        key = self.host_queues[host][0][:3]
+        self.available_keys[host] = key
+        heapq.heappush(self.available_heap, (key, host))
+
+
+    def schedule(self, host):
+        """
+        put host into waiting or available heap if it has pending urls and free slots,
+        调用方需持有 self.cond
+        """
+        if host in self.scheduled_hosts or not self.host_queues.get(host):
+            return
+        concurrency = self.get_concurrency(host)
+        if concurrency > 0 and self.host_inflight.get(host, 0) >= concurrency:
+            return
+        ready_time = self.host_ready.get(host, 0)
+        if ready_time <= time.time():
+            self.make_available(host)
+        else:
+            heapq.heappush(self.waiting_heap, (ready_time, next(self.seq), host))
+        self.scheduled_hosts.add(host)
+        # 等待者包括 get() 和 join()，需全部唤醒以免丢失通知
+        self.notify()
+
+
+    def add_url(self, host, url_obj, score):
+        """
+        add url object into host queue, 内存已满时溢出到磁盘，调用方需持有 self.cond
+        """
+        # 已有 url 溢出时新 url 也排在溢出文件末尾：BFS 中先溢出的 url 更浅，
+        # 直接进入内存会让更深的 url 先于已溢出的浅层 url 被抓取
+        if self.memory_limit > 0 and (self.memory_num >= self.memory_limit or self.spill.size > 0):
+            self.spill.append(url_obj)
+            return
+        self.push_url(host, url_obj, score)
+
+
+    def push_url(self, host, url_obj, score):
+        """
+        push url object into the in-memory host queue, 调用方需持有 self.cond
+        """
+        entry = (url_obj.get_depth(), -score, next(self.seq), url_obj)
+        heapq.heappush(self.host_queues[host], entry)
+        self.memory_num += 1
+        # 已就绪的 host 的队首变好时，放入新的 key，旧条目在出队时被跳过
+        if host in self.available_keys and entry[:3] < self.available_keys[host]:
+            self.make_available(host)
+
+
+    def score(self, url_obj):
+        """
+        get score of url object, 没有 scorer 时为 0
+        """
+        if self.scorer is None:
+            return 0
+        return self.scorer(url_obj)
+
+
+    def refill(self):
+        """
+        load spilled urls back when memory is half empty, 调用方需持有 self.cond
+        """
+        if self.spill.size == 0 or self.memory_num > self.memory_limit // 2:
+            return
+        for url_obj in self.spill.pop_many(self.memory_limit - self.memory_num):
+            host = get_host(url_obj.get_url())
+            self.push_url(host, url_obj, self.score(url_obj))
+            self.schedule(host)
+
+
+    def put(self, url_obj):
+        """
+        put a url object into its host queue
+        """
+        host = get_host(url_obj.get_url())
+        score = self.score(url_obj)
+        with self.cond:
+            self.add_url(host, url_obj, score)
+            self.unfinished_tasks += 1
+            self.pending_num += 1
+            self.schedule(host)
+
+
+    def put_many(self, url_objs):
+        """
+        put url objects into their host queues, 只获取一次锁
+        """
+        hosts = [get_host(url_obj.get_url()) for url_obj in url_objs]
+        scores = [self.score(url_obj) for url_obj in url_objs]
+        start = time.time()
+        with self.cond:
+            metrics.observe('lock_wait.frontier', time.time() - start)
+            for host, url_obj, score in zip(hosts, url_objs, scores):
+                self.add_url(host, url_obj, score)
+            self.unfinished_tasks += len(url_objs)
+            self.pending_num += len(url_objs)
+            for host in set(hosts):
+                self.schedule(host)
+
+
+    def pop_available(self):
+        """
+        pop the best url among available hosts, 调用方需持有 self.cond
+
+        Returns:
+            (host, url_obj)，没有已就绪的 host 时返回 (None, None)
+        """
+        now = time.time()
+        while self.retry_heap and self.retry_heap[0][0] <= now:
+            _, _, host, url_obj = heapq.heappop(self.retry_heap)
+            self.add_url(host, url_obj, self.score(url_obj))
+            self.pending_num += 1
+            self.schedule(host)
+        while self.waiting_heap and self.waiting_heap[0][0] <= now:
+            ready_time, _, host = heapq.heappop(self.waiting_heap)
+            if self.host_ready.get(host, 0) > ready_time:
+                # 在等待期间被 pause 推迟
+                heapq.heappush(self.waiting_heap, (self.host_ready[host], next(self.seq), host))
+                continue
+            self.make_available(host)
+        while self.available_heap:
+            key, host = heapq.heappop(self.available_heap)
+            if self.available_keys.get(host) != key:
+                continue
+            del self.available_keys[host]
+            self.scheduled_hosts.discard(host)
+            url_obj = heapq.heappop(self.host_queues[host])[3]
+            if not self.host_queues[host]:
+                del self.host_queues[host]
+            return (host, url_obj)
+        return (None, None)
+
+
+    def get(self, block=True):
+        """
+        get the best url whose host is ready
+
+        Args:
+            block: 无就绪 url 时是否阻塞等待
+
+        Returns:
+            url_obj: url 对象，调用 stop() 之后返回 None
+
+        Raises:
+            Queue.Empty: block 为 False 且当前没有就绪的 url
+        """
+        with self.cond:
+            while True:
+                if self.stopped:
+                    return None
+                host, url_obj = self.pop_available()
+                if url_obj is not None:
+                    self.pending_num -= 1
+                    self.memory_num -= 1
+                    self.host_inflight[host] += 1
+                    self.host_ready[host] = time.time() + self.get_interval(host)
+                    self.refill()
+                    self.schedule(host)
+                    return url_obj
+
+                if not block:
+                    raise Queue.Empty
+                wake_times = [heap[0][0] for heap in (self.waiting_heap, self.retry_heap) if heap]
+                if wake_times:
+                    self.cond.wait(min(wake_times) - time.time())
+                else:
+                    self.cond.wait()
+
+
+    def task_done(self, url_obj):
+        """
+        indicate that a url returned by get() is finished
+        """
+        host = get_host(url_obj.get_url())
+        with self.cond:
+            self.host_inflight[host] -= 1
+            if self.host_inflight[host] <= 0:
+                del self.host_inflight[host]
+            self.unfinished_tasks -= 1
+            self.schedule(host)
+            if self.unfinished_tasks <= 0:
+                self.notify()
+
+
+    def retry(self, url_obj, delay):
+        """
+        finish a url returned by get() and queue it again after delay seconds,
+        重试次数加一；在重新抓取完成前任务不算完成，join() 会继续等待
+        """
+        host = get_host(url_obj.get_url())
+        retry_url_obj = url_object.Url(url_obj.get_url(), url_obj.get_depth(),
+                                       url_obj.get_retry_num() + 1)
+        with self.cond:
+            self.host_inflight[host] -= 1
+            if self.host_inflight[host] <= 0:
+                del self.host_inflight[host]
+            heapq.heappush(self.retry_heap, (time.time() + delay, next(self.seq), host,
+                                             retry_url_obj))
+            self.schedule(host)
+            self.notify()
+
+
+    def stop(self):
+        """
+        wake up and stop all consumers, 之后的 get() 都返回 None
+        """
+        with self.cond:
+            self.stopped = True
+            self.notify()
+
+
+    def join(self):
+        """
+        block until all tasks are done
+        """
+        with self.cond:
+            while self.unfinished_tasks > 0:
+                self.cond.wait()
+
+
+    def qsize(self):
+        """
+        number of urls waiting to be crawled (including spilled urls)
+        """
+        return self.pending_num
+
+
+    def spilled_num(self):
+        """
+        number of urls spilled to disk
+        """
+        return self.spill.size
+
+
+    def close(self):
+        """
+        release the spill file
+        """
+        with self.cond:
+            self.spill.close()
@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: seen_store.py
+Description: 已见 URL 存储，支持内存集合、可伸缩 Bloom filter 和基于 sqlite 的磁盘存储三种后端
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import hashlib
+import math
+import os
+import sqlite3
+import struct
+import sys
+import threading
+
+SEEN_STORE_BACKENDS = ('memory', 'bloom', 'sqlite')
+
+
+def _to_bytes(url):
+    if isinstance(url, unicode):
+        return url.encode('utf-8')
+    return url
+
+
+class SeenStore(object):
+    """
+    Base class of seen-url stores.
+
+    add() 是原子的“检查并插入”操作，返回 True 表示该 url 之前未出现过。
+    """
+
+    name = 'base'
+
+    def add(self, url):
+        """
+        add url into store
+
+        Args:
+            url: url 字符串
+
+        Returns:
+            True/False: url 为新加入返回 True，已存在返回 False
+        """
+        raise NotImplementedError
+
+
+    def __contains__(self, url):
+        raise NotImplementedError
+
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+    def memory_usage(self):
+        """
+        estimated memory usage in bytes
+        """
+        raise NotImplementedError
+
+
+    def bytes_per_url(self):
+        """
+        estimated memory usage per stored url
+        """
+        count = len(self)
+        if count == 0:
+            return 0.0
+        return float(self.memory_usage()) / count
+
+
+    def close(self):
+        """
+        release resources held by the store
+        """
+        pass
+
+
+class MemorySeenStore(SeenStore):
+    """
+    Exact in-memory store based on python sets, 按 url 哈希分片加锁，
+    不同分片上的 add() 可以并发执行
+
+    Attributes:
+        shards : 已见 url 字符串集合的分片列表
+        locks  : 与 shards 一一对应的锁
+    """
+
+    name = 'memory'
+    SHARD_NUM = 64
+
+    def __init__(self):
+        self.shards = [set() for _ in xrange(self.SHARD_NUM)]
+        self.locks = [threading.Lock() for _ in xrange(self.SHARD_NUM)]
+
+
+    def add(self, url):
+        index = hash(url) % self.SHARD_NUM
+        shard = self.shards[index]
+        with self.locks[index]:
+            if url in shard:
+                return False
+            shard.add(url)
+            return True
+
+
+    def __contains__(self, url):
+        return url in self.shards[hash(url) % self.SHARD_NUM]
+
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+
+    def memory_usage(self):
+        usage = 0
+        for shard, lock in zip(self.shards, self.locks):
+            with lock:
+                usage += sys.getsizeof(shard) + sum(sys.getsizeof(url) for url in shard)
+        return usage
+
+
+class BloomFilter(object):
+    """
+    Fixed size Bloom filter.
+
+    Attributes:
+        capacity   : 预期容纳元素个数
+        error_rate : 容量内的误判率
+        num_bits   : 位数组长度
+        num_hashes : 哈希函数个数
+        count      : 已插入元素个数
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits * math.log(2) / capacity)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+
+    def positions(self, digest):
+        """
+        bit positions of a url digest
+        """
+        # double hashing: h1 + i * h2，只需计算一次 md5
+        h1, h2 = struct.unpack('<QQ', digest)
+        return [(h1 + i * h2) % self.num_bits for i in xrange(self.num_hashes)]
+
+
+    def __contains__(self, digest):
+        for pos in self.positions(digest):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+    def add(self, digest):
+        """
+        add url digest, return True if it was (probably) not present before
+        """
+        is_new = False
+        for pos in self.positions(digest):
+            mask = 1 << (pos & 7)
+            if not self.bits[pos >> 3] & mask:
+                self.bits[pos >> 3] |= mask
+                is_new = True
+        if is_new:
+            self.count += 1
+        return is_new
+
+
+    def is_full(self):
+        return self.count >= self.capacity
+
+
+class BloomSeenStore(SeenStore):
+    """
+    Scalable Bloom filter (Almeida et al.): 当前 filter 满了之后追加一个容量翻倍、
+    误判率收紧的新 filter，整体误判率收敛于 error_rate。
+
+    Attributes:
+        error_rate       : 整体误判率上限
+        initial_capacity : 第一个 filter 的容量
+        filters          : BloomFilter 列表
+    """
+
+    name = 'bloom'
+    GROWTH = 2
+    TIGHTENING = 0.9
+
+    def __init__(self, error_rate=0.001, initial_capacity=100000):
+        self.error_rate = error_rate
+        self.initial_capacity = initial_capacity
+        self.filters = []
+        self.count = 0
+        self.lock = threading.Lock()
+
+
+    def _add_filter(self):
+        index = len(self.filters)
+        capacity = self.initial_capacity * (self.GROWTH ** index)
+        error_rate = self.error_rate * (1 - self.TIGHTENING) * (self.TIGHTENING ** index)
+        self.filters.append(BloomFilter(capacity, error_rate))
+
+
+    def add(self, url):
+        # 位数组的读-改-写不是原子的，只能整体加锁；哈希在锁外计算
+        digest = hashlib.md5(_to_bytes(url)).digest()
+        with self.lock:
+            if self._contains(digest):
+                return False
+            if not self.filters or self.filters[-1].is_full():
+                self._add_filter()
+            self.filters[-1].add(digest)
+            self.count += 1
+            return True
+
+
+    def _contains(self, digest):
+        for bloom in reversed(self.filters):
+            if digest in bloom:
+                return True
+        return False
+
+
+    def __contains__(self, url):
+        digest = hashlib.md5(_to_bytes(url)).digest()
+        with self.lock:
+            return self._contains(digest)
+
+
+    def __len__(self):
+        return self.count
+
+
+    def memory_usage(self):
+        return sum(len(bloom.bits) for bloom in self.filters)
+
+
+class SqliteSeenStore(SeenStore):
+    """
+    On-disk store based on sqlite, 以 url 的 64 位哈希作为主键（B-tree 有序存储），
+    适合千万级 url；内存占用只有 sqlite 的页缓存。
+
+    Attributes:
+        path       : 数据库文件路径
+        cache_kb   : sqlite 页缓存大小（KB）
+        reset      : 是否清空已有的数据库文件
+    """
+
+    name = 'sqlite'
+    COMMIT_EVERY = 1000
+
+    def __init__(self, path, cache_kb=8192, reset=True):
+        self.path = path
+        self.cache_kb = cache_kb
+        path_dirname = os.path.dirname(path)
+        if path_dirname and not os.path.isdir(path_dirname):
+            os.makedirs(path_dirname)
+        if reset and os.path.isfile(path):
+            os.remove(path)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA synchronous = OFF')
+        self.conn.execute('PRAGMA cache_size = -%d' % cache_kb)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS seen (url_hash INTEGER PRIMARY KEY)')
+        self.lock = threading.Lock()
+        self.count = self.conn.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+        self.pending_writes = 0
+
+
+    @staticmethod
+    def _url_hash(url):
+        return struct.unpack('<q', hashlib.md5(_to_bytes(url)).digest()[:8])[0]
+
+
+    def add(self, url):
+        url_hash = self._url_hash(url)
+        with self.lock:
+            cursor = self.conn.execute('INSERT OR IGNORE INTO seen (url_hash) VALUES (?)',
+                                       (url_hash,))
+            if cursor.rowcount != 1:
+                return False
+            self.count += 1
+            self.pending_writes += 1
+            if self.pending_writes >= self.COMMIT_EVERY:
+                self.conn.commit()
+                self.pending_writes = 0
+            return True
+
+
+    def __contains__(self, url):
+        url_hash = self._url_hash(url)
+        with self.lock:
+            row = self.conn.execute('SELECT 1 FROM seen WHERE url_hash = ?',
+                                    (url_hash,)).fetchone()
+            return row is not None
+
+
+    def __len__(self):
+        return self.count
+
+
+    def memory_usage(self):
+        # sqlite 只在内存中保留页缓存，大小以 cache_size 为上限
+        with self.lock:
+            page_size = self.conn.execute('PRAGMA page_size').fetchone()[0]
+            page_count = self.conn.execute('PRAGMA page_count').fetchone()[0]
+        return min(page_size * page_count, self.cache_kb * 1024)
+
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+def create_seen_store(backend, error_rate=0.001, initial_capacity=100000, path='./seen.db',
+                      reset=True):
+    """
+    create a seen store by backend name
+
+    Args:
+        backend          : memory / bloom / sqlite
+        error_rate       : bloom 后端的误判率
+        initial_capacity : bloom 后端的初始容量
+        path             : sqlite 后端的数据库文件路径
+        reset            : sqlite 后端是否清空已有数据
+
+    Returns:
+        SeenStore 实例
+
+    Raises:
+        ValueError: 未知的后端名
+    """
+    if backend == 'memory':
+        return MemorySeenStore()
+    elif backend == 'bloom':
+        return BloomSeenStore(error_rate, initial_capacity)
+    elif backend == 'sqlite':
+        return SqliteSeenStore(path, reset=reset)
+    raise ValueError('unknown seen store backend: %s' % backend)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: simhash.py
+Description: 页面内容的 SimHash 指纹（对去掉标签后的文本按词做 shingle）和按 Hamming 距离
+             查找近似重复指纹的分段索引，用于识别镜像页面、session id 变体等近似重复页面
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import hashlib
+import re
+import struct
+import threading
+
+FINGERPRINT_BITS = 64
+SHINGLE_SIZE = 4
+# shingle 太少时指纹不可靠（不同的短页面也可能很接近），不计算指纹
+MIN_SHINGLES = 16
+
+IGNORED_BLOCK_PATTERN = re.compile(r'<(script|style|noscript)\b.*?</\1\s*>', re.I | re.S)
+TAG_PATTERN = re.compile(r'<[^>]*>|&\w+;|&#\d+;')
+WORD_PATTERN = re.compile(r'\w+', re.U)
+
+# 每个 bit 的计数占用 LANE_BITS 位，逐字节查表后用大整数加法同时累加 8 个 bit 的计数
+LANE_BITS = 24
+MAX_SHINGLES = (1 << LANE_BITS) - 1
+LANE_MASK = (1 << LANE_BITS) - 1
+BYTE_LANES = [sum(((value >> bit) & 1) << (bit * LANE_BITS) for bit in xrange(8))
+              for value in xrange(256)]
+HASH_BYTES = struct.Struct('8B')
+
+
+def extract_words(html):
+    """
+    get lower-cased words of the visible text of html
+
+    Args:
+        html: 已解码的 html 文本
+
+    Returns:
+        词列表
+    """
+    text = IGNORED_BLOCK_PATTERN.sub(' ', html)
+    text = TAG_PATTERN.sub(' ', text)
+    return WORD_PATTERN.findall(text.lower())
+
+
+def compute(features):
+    """
+    compute simhash of features, 每个特征权重相同
+
+    Args:
+        features: 字节串列表
+
+    Returns:
+        FINGERPRINT_BITS 位整数指纹
+    """
+    # sk 保存 md5 第 k 个字节的 8 个 bit 各自为 1 的次数，热循环手工展开
+    lanes = BYTE_LANES
+    unpack = HASH_BYTES.unpack_from
+    md5 = hashlib.md5
+    s0 = s1 = s2 = s3 = s4 = s5 = s6 = s7 = 0
+    num = 0
+    for feature in features:
+        b0, b1, b2, b3, b4, b5, b6, b7 = unpack(md5(feature).digest())
+        s0 += lanes[b0]
+        s1 += lanes[b1]
+        s2 += lanes[b2]
+        s3 += lanes[b3]
+        s4 += lanes[b4]
+        s5 += lanes[b5]
+        s6 += lanes[b6]
+        s7 += lanes[b7]
+        num += 1
+        if num == MAX_SHINGLES:
+            break
+    sums = (s0, s1, s2, s3, s4, s5, s6, s7)
+    fingerprint = 0
+    half = num / 2.0
+    for k in xrange(8):
+        for bit in xrange(8):
+            if (sums[k] >> (bit * LANE_BITS)) & LANE_MASK > half:
+                fingerprint |= 1 << (8 * k + bit)
+    return fingerprint
+
+
+def fingerprint(html, shingle_size=SHINGLE_SIZE):
+    """
+    fingerprint the visible text of a page
+
+    Args:
+        html         : 已解码的 html 文本
+        shingle_size : 每个 shingle 的词数
+
+    Returns:
+        指纹整数，文本太短时返回 None
+    """
+    words = [word.encode('utf-8') for word in extract_words(html)]
+    shingle_num = len(words) - shingle_size + 1
+    if shingle_num < MIN_SHINGLES:
+        return None
+    return compute(' '.join(words[i:i + shingle_size]) for i in xrange(shingle_num))
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class SimHashIndex(object):
+    """
+    Index of fingerprints supporting Hamming-distance lookup, thread-safe.
+
+    把指纹分成 distance + 1 段：距离不超过 distance 的两个指纹至少有一段完全相同，
+    所以只需比较至少一段相同的候选指纹。
+
+    Attributes:
+        distance : 判定为近似重复的最大 Hamming 距离
+        size     : 已加入的指纹数
+    """
+    def __init__(self, distance):
+        self.distance = distance
+        band_num = distance + 1
+        self.bands = []
+        start = 0
+        for index in xrange(band_num):
+            width = FINGERPRINT_BITS // band_num + (1 if index < FINGERPRINT_BITS % band_num else 0)
+            self.bands.append((start, (1 << width) - 1))
+            start += width
+        # 每段一个表：段的值 -> 该段取此值的指纹列表
+        self.tables = [{} for _ in self.bands]
+        self.size = 0
+        self.lock = threading.Lock()
+
+
+    def find(self, fingerprint):
+        """
+        find an indexed fingerprint within distance, 调用方需持有 self.lock
+
+        Returns:
+            找到的指纹，没有时返回 None
+        """
+        for (shift, mask), table in zip(self.bands, self.tables):
+            for candidate in table.get((fingerprint >> shift) & mask, ()):
+                if hamming_distance(candidate, fingerprint) <= self.distance:
+                    return candidate
+        return None
+
+
+    def add_if_new(self, fingerprint):
+        """
+        add fingerprint unless a near duplicate is indexed
+
+        Returns:
+            True/False: 加入返回 True，已有近似重复时返回 False
+        """
+        with self.lock:
+            if self.find(fingerprint) is not None:
+                return False
+            for (shift, mask), table in zip(self.bands, self.tables):
+                table.setdefault((fingerprint >> shift) & mask, []).append(fingerprint)
+            self.size += 1
+            return True
@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: target_store.py
+Description: target 文件的存储布局：
+             flat - 以 quote_plus(url) 为文件名平铺在 output_dir 中
+             cas  - 按内容哈希寻址，分层目录存放，sqlite 索引 url -> 哈希，
+                    可选把小文件打包进只追加的 segment 文件
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import urllib
+
+import downloader
+
+OUTPUT_LAYOUTS = ('flat', 'cas')
+INDEX_NAME = 'index.db'
+
+
+def get_target_path(output_dir, url):
+    """
+    get local file path for saving a target url in flat layout
+
+    Args:
+        output_dir: 存放爬取页面的目录
+        url       : target url
+
+    Returns:
+        target_path: 保存路径
+    """
+    file_name = urllib.quote_plus(url)
+    if len(file_name) > 127:
+        file_name = file_name[-127:]
+    return "{}/{}".format(output_dir, file_name)
+
+
+def _to_unicode(value):
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+class TargetWriter(object):
+    """
+    Streaming writer of one target, 边写边计算哈希
+
+    Attributes:
+        store       : 所属的 target store
+        url         : target url
+        atomic_file : 临时文件
+        size        : 已写入字节数
+    """
+    def __init__(self, store, url, atomic_file, hash_func):
+        self.store = store
+        self.url = url
+        self.atomic_file = atomic_file
+        self.hasher = hash_func()
+        self.size = 0
+
+
+    def write(self, data):
+        self.atomic_file.write(data)
+        self.hasher.update(data)
+        self.size += len(data)
+
+
+    def commit(self):
+        """
+        finish writing
+
+        Returns:
+            (size, content_hash)
+        """
+        content_hash = self.hasher.hexdigest()
+        self.store.commit(self, content_hash)
+        return (self.size, content_hash)
+
+
+    def abort(self):
+        self.atomic_file.abort()
+
+
+class FlatTargetStore(object):
+    """
+    Flat layout, 与原先的保存方式相同
+
+    Attributes:
+        output_dir: 存放 target 文件的目录
+    """
+
+    name = 'flat'
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+
+    def exists(self, url):
+        """
+        whether url has been saved
+        """
+        return os.path.isfile(get_target_path(self.output_dir, url))
+
+
+    def open_writer(self, url):
+        """
+        open a streaming writer for url
+        """
+        atomic_file = downloader.AtomicFile(get_target_path(self.output_dir, url))
+        return TargetWriter(self, url, atomic_file, hashlib.md5)
+
+
+    def commit(self, writer, content_hash):
+        writer.atomic_file.commit()
+
+
+    def save(self, url, response, max_body_size):
+        """
+        stream response body of url into the store
+
+        Returns:
+            (size, content_hash)
+
+        Raises:
+            BodyTooLargeError/IOError: 下载或写入失败，此时不会留下目标文件
+        """
+        writer = self.open_writer(url)
+        try:
+            for chunk in downloader.iter_body(response, max_body_size):
+                writer.write(chunk)
+        except Exception:
+            writer.abort()
+            raise
+        return writer.commit()
+
+
+    def stats(self):
+        return ''
+
+
+    def close(self):
+        pass
+
+
+class CasTargetStore(FlatTargetStore):
+    """
+    Content-addressed layout:
+
+        output_dir/objects/ab/cd/abcd...   按 sha1 两级分层的对象文件
+        output_dir/segments/000001.seg     打包的小文件（只追加）
+        output_dir/index.db                url -> 哈希及元数据，哈希 -> 位置
+
+    同一内容只保存一次，文件名不会因截断而冲突。
+
+    Attributes:
+        output_dir     : 存储根目录
+        pack_max_size  : 不超过该大小的对象打包进 segment，0 表示不打包
+        segment_size   : 单个 segment 文件的最大字节数
+        url_num        : 本次运行保存的 url 数
+        object_num     : 本次运行新增的对象数
+        dedup_bytes    : 本次运行因内容重复而未写入的字节数
+        packed_num     : 本次运行打包进 segment 的对象数
+    """
+
+    name = 'cas'
+    COMMIT_EVERY = 100
+
+    def __init__(self, output_dir, pack_max_size=0, segment_size=64 * 1024 * 1024):
+        super(CasTargetStore, self).__init__(output_dir)
+        self.pack_max_size = pack_max_size
+        self.segment_size = segment_size
+        self.objects_dir = os.path.join(output_dir, 'objects')
+        self.segments_dir = os.path.join(output_dir, 'segments')
+        for path in (self.objects_dir, self.segments_dir):
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        self.conn = sqlite3.connect(os.path.join(output_dir, INDEX_NAME),
+                                    check_same_thread=False)
+        self.conn.execute('PRAGMA synchronous = OFF')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, '
+                          'hash TEXT, size INTEGER, saved_at REAL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS objects (hash TEXT PRIMARY KEY, '
+                          'size INTEGER, segment INTEGER, offset INTEGER)')
+        self.lock = threading.Lock()
+        self.pending_writes = 0
+        self.url_num = 0
+        self.object_num = 0
+        self.dedup_bytes = 0
+        self.packed_num = 0
+        # 续写最后一个 segment
+        last_segment = self.conn.execute('SELECT MAX(segment) FROM objects').fetchone()[0]
+        self.segment_id = last_segment or 1
+        self.segment_file = None
+
+
+    def get_object_path(self, content_hash):
+        """
+        get fan-out path of an object file
+        """
+        return os.path.join(self.objects_dir, content_hash[:2], content_hash[2:4], content_hash)
+
+
+    def get_segment_path(self, segment_id):
+        return os.path.join(self.segments_dir, '%06d.seg' % segment_id)
+
+
+    def exists(self, url):
+        with self.lock:
+            row = self.conn.execute('SELECT 1 FROM urls WHERE url = ?',
+                                    (_to_unicode(url),)).fetchone()
+        return row is not None
+
+
+    def open_writer(self, url):
+        # 临时文件与对象文件在同一文件系统，提交时可以直接 rename
+        atomic_file = downloader.AtomicFile(os.path.join(self.objects_dir, 'incoming'))
+        return TargetWriter(self, url, atomic_file, hashlib.sha1)
+
+
+    def commit(self, writer, content_hash):
+        """
+        move a finished writer into place and index its url, 内容已存在时丢弃临时文件
+        """
+        with self.lock:
+            known = self.conn.execute('SELECT 1 FROM objects WHERE hash = ?',
+                                      (content_hash,)).fetchone()
+            if known is not None:
+                writer.abort()
+                self.dedup_bytes += writer.size
+            elif 0 < self.pack_max_size and writer.size <= self.pack_max_size:
+                writer.atomic_file.file.close()
+                with open(writer.atomic_file.tmp_path, 'rb') as f:
+                    data = f.read()
+                writer.abort()
+                segment_id, offset = self.append_segment(data)
+                self.conn.execute('INSERT INTO objects (hash, size, segment, offset) '
+                                  'VALUES (?, ?, ?, ?)',
+                                  (content_hash, writer.size, segment_id, offset))
+                self.object_num += 1
+                self.packed_num += 1
+            else:
+                object_path = self.get_object_path(content_hash)
+                if not os.path.isdir(os.path.dirname(object_path)):
+                    os.makedirs(os.path.dirname(object_path))
+                writer.atomic_file.commit(object_path)
+                self.conn.execute('INSERT INTO objects (hash, size) VALUES (?, ?)',
+                                  (content_hash, writer.size))
+                self.object_num += 1
+
+            self.conn.execute('INSERT OR REPLACE INTO urls (url, hash, size, saved_at) '
+                              'VALUES (?, ?, ?, ?)',
+                              (_to_unicode(writer.url), content_hash, writer.size, time.time()))
+            self.url_num += 1
+            self.pending_writes += 1
+            if self.pending_writes >= self.COMMIT_EVERY:
+                self.conn.commit()
+                self.pending_writes = 0
+
+
+    def append_segment(self, data):
+        """
+        append data to the current segment, 超过 segment_size 时换新文件，调用方需持有 self.lock
+
+        Returns:
+            (segment_id, offset)
+        """
+        if self.segment_file is None:
+            self.segment_file = open(self.get_segment_path(self.segment_id), 'ab')
+        offset = self.segment_file.tell()
+        if offset > 0 and offset + len(data) > self.segment_size:
+            self.segment_file.close()
+            self.segment_id += 1
+            self.segment_file = open(self.get_segment_path(self.segment_id), 'ab')
+            offset = 0
+        self.segment_file.write(data)
+        # 先落到文件再写索引，崩溃时最多留下无索引的数据
+        self.segment_file.flush()
+        return (self.segment_id, offset)
+
+
+    def read(self, url):
+        """
+        read saved content of url
+
+        Returns:
+            内容字符串，url 未保存时返回 None
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT objects.hash, objects.size, segment, offset '
+                                    'FROM urls JOIN objects ON urls.hash = objects.hash '
+                                    'WHERE url = ?', (_to_unicode(url),)).fetchone()
+            if row is None:
+                return None
+            if self.segment_file is not None:
+                self.segment_file.flush()
+        content_hash, size, segment_id, offset = row
+        if segment_id is None:
+            with open(self.get_object_path(content_hash), 'rb') as f:
+                return f.read()
+        with open(self.get_segment_path(segment_id), 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+
+    def stats(self):
+        return '{} urls, {} new objects, {} packed, {} bytes deduplicated'.format(
+            self.url_num, self.object_num, self.packed_num, self.dedup_bytes)
+
+
+    def close(self):
+        with self.lock:
+            if self.segment_file is not None:
+                self.segment_file.close()
+                self.segment_file = None
+            self.conn.commit()
+            self.conn.close()
+
+
+def create_target_store(layout, output_dir, pack_max_size=0, segment_size=64 * 1024 * 1024):
+    """
+    create a target store by layout name
+
+    Args:
+        layout        : flat / cas
+        output_dir    : 存储根目录
+        pack_max_size : cas 布局下打包进 segment 的最大对象大小，0 表示不打包
+        segment_size  : cas 布局下单个 segment 文件的最大字节数
+
+    Returns:
+        target store 实例
+
+    Raises:
+        ValueError: 未知的布局名
+    """
+    if layout == 'flat':
+        return FlatTargetStore(output_dir)
+    if layout == 'cas':
+        return CasTargetStore(output_dir, pack_max_size, segment_size)
+    raise ValueError('unknown output layout: %s' % layout)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_adaptive.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import StringIO
+import mimetools
+import socket
+import unittest
+import urllib2
+import sys
+
+sys.path.append('../')
+import adaptive
+import url_object
+
+def http_error(code, headers=''):
+    return urllib2.HTTPError('http://a.com/', code, 'error',
+                             mimetools.Message(StringIO.StringIO(headers)), None)
+
+
+class FakeFrontier(object):
+    """
+    records set_concurrency and pause calls
+    """
+    def __init__(self):
+        self.concurrency = {}
+        self.paused = {}
+
+
+    def set_concurrency(self, host, concurrency):
+        self.concurrency[host] = concurrency
+
+
+    def pause(self, host, until):
+        self.paused[host] = until
+
+
+class TestAdaptive(unittest.TestCase):
+    """
+    Unit Test class of AdaptiveController
+    """
+    def setUp(self):
+        self.now = [100.0]
+        self.frontier = FakeFrontier()
+        self.controller = adaptive.AdaptiveController([self.frontier], 8, try_times=4,
+                                                      retry_base_delay=1.0, retry_max_delay=5.0,
+                                                      breaker_threshold=3, breaker_cooldown=10.0,
+                                                      clock=lambda: self.now[0],
+                                                      rand=lambda: 1.0)
+
+
+    def test_aimd(self):
+        """
+        host limit grows by one per round of successes and halves on errors
+        """
+        url = 'http://a.com/1'
+        self.controller.record(url, 0.1, None)
+        self.assertEqual(self.frontier.concurrency['a.com'], 2)
+        for _ in xrange(10):
+            self.controller.record(url, 0.1, None)
+        self.assertEqual(self.frontier.concurrency['a.com'], 5)
+        self.controller.record(url, None, socket.timeout('timed out'))
+        self.assertEqual(self.frontier.concurrency['a.com'], 2)
+        # 同一秒内的多个失败只减小一次
+        self.controller.record(url, None, socket.timeout('timed out'))
+        self.assertEqual(self.frontier.concurrency['a.com'], 2)
+        # 404 说明服务端正常
+        self.controller.record(url, 0.1, http_error(404))
+        self.assertEqual(self.controller.hosts['a.com'].failures, 0)
+
+
+    def test_latency_congestion(self):
+        """
+        rising latency shrinks host and global limits
+        """
+        url = 'http://a.com/1'
+        for _ in xrange(20):
+            self.controller.record(url, 0.1, None)
+        limit = self.frontier.concurrency['a.com']
+        for _ in xrange(3):
+            self.controller.record(url, 1.0, None)
+        self.assertTrue(self.frontier.concurrency['a.com'] < limit)
+        self.assertEqual(self.controller.global_limit.get(), 4)
+
+
+    def test_retry_delay(self):
+        """
+        exponential backoff bounded by retry_max_delay, 4xx is not retried
+        """
+        error = socket.error('connection reset')
+        delays = [self.controller.retry_delay(url_object.Url('http://a.com/', 0, retry_num), error)
+                  for retry_num in xrange(4)]
+        self.assertEqual(delays, [1.0, 2.0, 4.0, None])
+        self.assertEqual(self.controller.retry_delay(url_object.Url('http://a.com/'),
+                                                     http_error(403)), None)
+        self.assertEqual(self.controller.retry_delay(url_object.Url('http://a.com/'),
+                                                     http_error(503, 'Retry-After: 3\n')), 3.0)
+        self.assertEqual(self.controller.retry_num, 4)
+
+
+    def test_circuit_breaker(self):
+        """
+        repeated failures pause the host, failures while half-open reopen it,
+        and a host is given up after BREAKER_MAX_TRIPS trips
+        """
+        url = 'http://a.com/1'
+        error = http_error(502)
+        for _ in xrange(3):
+            self.controller.record(url, None, error)
+        self.assertEqual(self.frontier.paused['a.com'], 110.0)
+        self.assertEqual(self.frontier.concurrency['a.com'], 1)
+        # 暂停期间结束的请求不计入
+        self.controller.record(url, None, error)
+        self.assertEqual(self.controller.trip_num, 1)
+        for trip in xrange(adaptive.BREAKER_MAX_TRIPS):
+            self.now[0] = self.controller.hosts['a.com'].open_until
+            self.controller.record(url, None, error)
+        self.assertEqual(self.frontier.paused['a.com'], self.now[0])
+        self.assertTrue(self.controller.is_given_up(url))
+        self.assertEqual(self.controller.retry_delay(url_object.Url(url), error), None)
+        self.assertFalse(self.controller.is_given_up('http://b.com/'))
+
+
+    def test_breaker_closes_on_success(self):
+        """
+        a success while half-open closes the breaker
+        """
+        url = 'http://a.com/1'
+        for _ in xrange(3):
+            self.controller.record(url, None, socket.timeout('timed out'))
+        self.now[0] += 10
+        self.controller.record(url, 0.1, None)
+        state = self.controller.hosts['a.com']
+        self.assertEqual((state.trips, state.failures), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_async_engine.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import BaseHTTPServer
+import SocketServer
+import StringIO
+import gzip
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+import sys
+
+sys.path.append('../')
+import adaptive
+import async_engine
+import compression
+import dns_cache
+import scheduler
+import target_store
+import url_object
+
+
+def gzip_compress(data):
+    buf = StringIO.StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb')
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+
+PAGES = {
+    '/index.html': '<a href="/a.html">a</a><a href="/gz.html">gz</a>'
+                   '<a href="/missing.html">missing</a><img src="/img.png">',
+    '/a.html': '<a href="/deep.html">deep</a><a href="/index.html">home</a>',
+    '/gz.html': '<a href="/g.png">g</a>',
+    '/deep.html': '<a href="/deeper.html">deeper</a>',
+    '/img.png': 'PNG' * 100,
+    '/g.png': 'GIF' * 100,
+}
+
+
+class SiteHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    HTTP/1.1 handler serving PAGES, /gz.html 以 gzip 编码返回，/flaky.html 第一次返回 503
+    """
+    protocol_version = 'HTTP/1.1'
+    flaky_hits = []
+
+    def do_GET(self):
+        body = PAGES.get(self.path)
+        if self.path == '/flaky.html':
+            self.flaky_hits.append(self.path)
+            if len(self.flaky_hits) == 1:
+                self.send_error(503)
+                return
+            body = '<a href="/img.png">img</a>'
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        if self.path == '/gz.html':
+            body = gzip_compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TestAsyncEngine(unittest.TestCase):
+    """
+    Unit Test class of AsyncCrawler against a local site
+    """
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), SiteHandler)
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        server_thread = threading.Thread(target=self.server.serve_forever)
+        server_thread.setDaemon(True)
+        server_thread.start()
+        self.output_dir = tempfile.mkdtemp()
+        self.results = {}
+        self.seen = set()
+        self.frontier = None
+
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+
+    def make_crawler(self, crawl_interval=0.0, controller=None, resolver_cache=None):
+        self.frontier = scheduler.HostScheduler(crawl_interval)
+        args_dict = {'output_dir': self.output_dir,
+                     'target_store': target_store.create_target_store('flat', self.output_dir),
+                     'crawl_interval': crawl_interval,
+                     'crawl_timeout': 5,
+                     'url_pattern': re.compile(r'.*\.(gif|png|jpg|bmp)$'),
+                     'max_depth': 2,
+                     'tag_dict': {'a': 'href', 'img': 'src'},
+                     'try_times': 2,
+                     'max_body_size': 1024 * 1024,
+                     'parser': 'html5lib',
+                     'dns_cache': resolver_cache,
+                     'cluster': None,
+                     'with_fingerprint': False,
+                     'robots_cache': None,
+                     'adaptive': controller}
+        return async_engine.AsyncCrawler(self.frontier, self.process_response, args_dict, 4,
+                                         self.frontier.retry)
+
+
+    def process_response(self, url_obj, flag, extract_url_list=None, fingerprint=None):
+        """
+        records flags and enqueues unseen links, 与 MiniSpider.process_response 相同地调用 task_done
+        """
+        self.results[url_obj.get_url()[len(self.base_url):]] = flag
+        if flag == 0:
+            for url in extract_url_list:
+                if url not in self.seen:
+                    self.seen.add(url)
+                    self.frontier.put(url_object.Url(url, url_obj.get_depth() + 1))
+        self.frontier.task_done(url_obj)
+
+
+    def seed(self, path):
+        self.seen.add(self.base_url + path)
+        self.frontier.put(url_object.Url(self.base_url + path, 0))
+
+
+    def test_crawl(self):
+        """
+        pages, gzip pages, targets, failures and the depth cut get their flags and
+        the loop stops once the frontier drains
+        """
+        resolver_cache = dns_cache.DnsCache()
+        crawler = self.make_crawler(resolver_cache=resolver_cache)
+        self.seed('/index.html')
+        crawler.run()
+        self.assertEqual(self.results, {'/index.html': 0, '/a.html': 0, '/gz.html': 0,
+                                        '/missing.html': -1, '/img.png': 1, '/g.png': 1,
+                                        '/deep.html': 2})
+        self.assertEqual(self.frontier.unfinished_tasks, 0)
+        self.assertEqual(self.frontier.listeners, [])
+        store = crawler.target_store
+        self.assertTrue(store.exists(self.base_url + '/img.png'))
+        self.assertTrue(store.exists(self.base_url + '/g.png'))
+        # 所有请求都经过 CachingResolver，只实际解析一次
+        self.assertEqual(resolver_cache.miss_num, 1)
+        self.assertTrue(resolver_cache.hit_num > 0)
+
+
+    def test_crawl_interval(self):
+        """
+        waiting hosts wake the dispatch loop at their ready time
+        """
+        crawler = self.make_crawler(crawl_interval=0.05)
+        self.seed('/a.html')
+        crawler.run()
+        self.assertEqual(self.results, {'/a.html': 0, '/deep.html': 0, '/index.html': 0,
+                                        '/deeper.html': 2, '/gz.html': 2, '/missing.html': 2,
+                                        '/img.png': 1})
+
+
+    def test_retry(self):
+        """
+        with adaptive control a 503 is retried through the frontier
+        """
+        controller = adaptive.AdaptiveController([], 4, retry_base_delay=0.05)
+        crawler = self.make_crawler(controller=controller)
+        self.seed('/flaky.html')
+        crawler.run()
+        self.assertEqual(self.results, {'/flaky.html': 0, '/img.png': 1})
+        self.assertEqual(controller.retry_num, 1)
+        self.assertEqual(controller.inflight, 0)
+
+
+class TestStreamDecoder(unittest.TestCase):
+    """
+    Unit Test class of StreamDecoder
+    """
+    def test_decode(self):
+        """
+        the body is decoded by the Content-Encoding header and errors surface in finish
+        """
+        data = gzip_compress('x' * 1000)
+        decoder = async_engine.StreamDecoder(2000)
+        decoder.on_header('HTTP/1.1 200 OK\r\n')
+        decoder.on_header('Content-Encoding: gzip\r\n')
+        for i in xrange(0, len(data), 7):
+            decoder.on_chunk(data[i:i + 7])
+        self.assertEqual(decoder.finish(), 'x' * 1000)
+
+        parts = []
+        decoder = async_engine.StreamDecoder(500, parts.append)
+        decoder.on_header('Content-Encoding: gzip\r\n')
+        decoder.on_chunk(data)
+        decoder.on_chunk(data)
+        self.assertRaises(compression.BodyTooLargeError, decoder.finish)
+        self.assertEqual(parts, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
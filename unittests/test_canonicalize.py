@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_canonicalize.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import unittest
+import sys
+
+sys.path.append('../')
+import canonicalize
+
+class TestCanonicalize(unittest.TestCase):
+    """
+    Unit Test class of Canonicalizer
+    """
+    def test_basic_rules(self):
+        """
+        scheme/host case, default port, fragment, dot segments and percent-encoding
+        """
+        canonicalizer = canonicalize.Canonicalizer()
+        canonical = canonicalizer.canonicalize
+        self.assertEqual(canonical('HTTP://A.com:80/x#frag'), 'http://a.com/x')
+        self.assertEqual(canonical('https://a.com:443'), 'https://a.com/')
+        self.assertEqual(canonical('http://a.com:8080/x'), 'http://a.com:8080/x')
+        self.assertEqual(canonical('http://a.com/a/./b/../c'), 'http://a.com/a/c')
+        self.assertEqual(canonical('http://a.com/../x'), 'http://a.com/x')
+        self.assertEqual(canonical('http://a.com/%7euser/%2f'), 'http://a.com/~user/%2F')
+        self.assertEqual(canonical('http://a.com/a b?q=x y'), 'http://a.com/a%20b?q=x%20y')
+        self.assertEqual(canonical('http://a.com/100%'), 'http://a.com/100%25')
+        self.assertEqual(canonical(u'http://a.com/中'), 'http://a.com/%E4%B8%AD')
+        # 非 http(s) url 原样返回
+        self.assertEqual(canonical('mailto:a@a.com'), 'mailto:a@a.com')
+
+
+    def test_query(self):
+        """
+        tracking params are stripped, sorting and trailing slash are optional
+        """
+        url = 'http://a.com/x/?b=2&utm_source=feed&a=1&b=1'
+        self.assertEqual(canonicalize.Canonicalizer().canonicalize(url),
+                         'http://a.com/x/?b=2&a=1&b=1')
+        canonicalizer = canonicalize.Canonicalizer(sort_query=True, strip_trailing_slash=True)
+        self.assertEqual(canonicalizer.canonicalize(url), 'http://a.com/x?a=1&b=2&b=1')
+        self.assertEqual(canonicalizer.canonicalize('http://a.com/?utm_medium=x'),
+                         'http://a.com/')
+        canonicalizer = canonicalize.Canonicalizer(strip_params=())
+        self.assertEqual(canonicalizer.canonicalize('http://a.com/?utm_source=x'),
+                         'http://a.com/?utm_source=x')
+
+
+if __name__ == '__main__':
+    unittest.main()
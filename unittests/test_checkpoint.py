@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_checkpoint.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import shutil
+import tempfile
+import unittest
+import sys
+
+sys.path.append('../')
+import checkpoint
+
+class TestCrawlJournal(unittest.TestCase):
+    """
+    Unit Test class of CrawlJournal
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+
+    def write_journal(self):
+        """
+        write a journal interrupted in the middle of a record
+        """
+        journal = checkpoint.CrawlJournal(self.tmp_dir, interval=60)
+        journal.open(truncate=True)
+        journal.record_enqueue('http://a.com/', 0)
+        journal.record_enqueue('http://a.com/1', 1)
+        journal.record_enqueue(u'http://a.com/中', 1)
+        journal.record_done('http://a.com/', 0)
+        journal.record_enqueue('http://a.com/2.png', 1)
+        journal.record_done('http://a.com/2.png', -1)
+        journal.close()
+        with open(journal.path, 'ab') as f:
+            f.write('A\t2\thttp://a.com/partial')
+
+
+    def test_load(self):
+        """
+        frontier = enqueued - done, partial last record is ignored
+        """
+        self.write_journal()
+        seen = []
+        journal = checkpoint.CrawlJournal(self.tmp_dir)
+        pending, checked_num, error_num = journal.load(seen.append)
+        self.assertEqual(pending.items(), [('http://a.com/1', 1), (u'http://a.com/中', 1)])
+        self.assertEqual(len(seen), 4)
+        self.assertEqual((checked_num, error_num), (1, 1))
+
+
+    def test_compact(self):
+        """
+        compacted journal restores the same state
+        """
+        self.write_journal()
+        journal = checkpoint.CrawlJournal(self.tmp_dir)
+        state = journal.load(lambda url: None)
+        journal.compact(*state)
+
+        seen = []
+        pending, checked_num, error_num = journal.load(seen.append)
+        self.assertEqual(pending, state[0])
+        self.assertEqual(len(seen), 4)
+        self.assertEqual((checked_num, error_num), (1, 1))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_cluster.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import Queue
+import socket
+import threading
+import unittest
+import sys
+
+sys.path.append('../')
+import cluster
+import url_object
+
+# 12 个 host，每个 host 的页面 i 链接到下一个 host 的页面 i + 1 和本 host 的页面 i + 1
+HOST_NUM = 12
+PAGE_NUM = 20
+
+
+def get_links(url):
+    host, page = url[len('http://'):].split('/')
+    host_index = int(host[1:])
+    page = int(page)
+    if page + 1 >= PAGE_NUM:
+        return []
+    return ['http://h%d/%d' % ((host_index + 1) % HOST_NUM, page + 1),
+            'http://h%d/%d' % (host_index, page + 1)]
+
+
+class FakeNode(object):
+    """
+    Single-threaded crawler of the link graph get_links
+    """
+    def __init__(self, node_id, node_num, transport):
+        self.seen = set()
+        self.lock = threading.Lock()
+        self.queue = Queue.Queue()
+        self.crawled = []
+        self.node = cluster.ClusterNode(node_id, node_num, transport, self.receive, self.is_idle,
+                                        self.stats, batch_size=5, flush_interval=0.01,
+                                        poll_interval=0.05)
+
+
+    def receive(self, url_objs):
+        with self.lock:
+            url_objs = [url_obj for url_obj in url_objs if url_obj.get_url() not in self.seen]
+            self.seen.update(url_obj.get_url() for url_obj in url_objs)
+        for url_obj in url_objs:
+            self.queue.put(url_obj)
+
+
+    def is_idle(self):
+        return self.queue.unfinished_tasks == 0
+
+
+    def stats(self):
+        return {'checked_num': len(self.crawled), 'forwarded_num': self.node.forwarded_num,
+                'received_num': self.node.received_num}
+
+
+    def run(self):
+        self.node.start()
+        while not self.node.is_stopped():
+            try:
+                url_obj = self.queue.get(timeout=0.01)
+            except Queue.Empty:
+                continue
+            self.crawled.append(url_obj.get_url())
+            with self.lock:
+                links = [url_object.Url(link, url_obj.get_depth() + 1)
+                         for link in get_links(url_obj.get_url()) if link not in self.seen]
+                self.seen.update(link.get_url() for link in links)
+            for local_url_obj in self.node.route(links):
+                self.queue.put(local_url_obj)
+            self.queue.task_done()
+
+
+class TestCluster(unittest.TestCase):
+    """
+    Unit Test class of cluster node
+    """
+    def crawl(self, transports):
+        nodes = [FakeNode(node_id, len(transports), transport)
+                 for node_id, transport in enumerate(transports)]
+        seed = 'http://h0/0'
+        owner = nodes[0].node.owner(seed)
+        nodes[owner].receive([url_object.Url(seed, 0)])
+        threads = [threading.Thread(target=node.run) for node in nodes]
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        self.assertTrue(all(node.node.is_stopped() for node in nodes))
+        reports = nodes[0].node.gather_reports(timeout=5)
+        for node in nodes:
+            node.node.close()
+        return nodes, reports
+
+
+    def check_crawl(self, nodes, reports):
+        crawled = [url for node in nodes for url in node.crawled]
+        # 每个页面恰好被其 host 的归属节点抓取一次
+        self.assertEqual(len(crawled), len(set(crawled)))
+        self.assertEqual(len(crawled), HOST_NUM * PAGE_NUM - HOST_NUM * (HOST_NUM - 1) / 2)
+        for node in nodes:
+            self.assertTrue(all(node.node.is_local(url) for url in node.crawled))
+        self.assertEqual(sorted(reports), range(len(nodes)))
+        self.assertEqual(sum(report['checked_num'] for report in reports.values()),
+                         len(crawled))
+        self.assertEqual(sum(report['forwarded_num'] for report in reports.values()),
+                         sum(report['received_num'] for report in reports.values()))
+
+
+    def test_owner_non_ascii_host(self):
+        """
+        non-ASCII hosts are routed the same whether the url is unicode or utf-8 str
+        """
+        node = cluster.ClusterNode(0, 3, cluster.LocalTransport(0, cluster.LocalHub()),
+                                   None, None, None)
+        url = u'http://例子.com/a'
+        self.assertEqual(node.owner(url), node.owner(url.encode('utf-8')))
+        url_objs = [url_object.Url(u'http://例子%d.com/a' % i, 1) for i in xrange(12)]
+        local_url_objs = node.route(url_objs)
+        self.assertEqual(len(local_url_objs) + node.forwarded_num, 12)
+        self.assertTrue(all(node.is_local(url_obj.get_url()) for url_obj in local_url_objs))
+
+
+    def test_local_transport(self):
+        """
+        three nodes in one process crawl the whole graph and terminate
+        """
+        hub = cluster.LocalHub()
+        nodes, reports = self.crawl([cluster.LocalTransport(i, hub) for i in xrange(3)])
+        self.check_crawl(nodes, reports)
+        self.assertTrue(all(node.node.received_num > 0 for node in nodes))
+
+
+    def test_tcp_transport(self):
+        """
+        nodes talk over local tcp sockets
+        """
+        addresses = []
+        for _ in xrange(2):
+            sock = socket.socket()
+            sock.bind(('127.0.0.1', 0))
+            addresses.append(sock.getsockname())
+            sock.close()
+        nodes, reports = self.crawl([cluster.TcpTransport(i, addresses) for i in xrange(2)])
+        self.check_crawl(nodes, reports)
+
+
+if __name__ == '__main__':
+    unittest.main()
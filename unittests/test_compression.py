@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_compression.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import StringIO
+import gzip
+import unittest
+import zlib
+import sys
+
+sys.path.append('../')
+import compression
+import downloader
+
+HTML = '<html><body>' + '<a href="/page.html">page</a>' * 2000 + '</body></html>'
+
+
+def gzip_compress(data):
+    buf = StringIO.StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb')
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+
+def raw_deflate(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decode_in_chunks(decoder, data, chunk_size=100):
+    parts = [decoder.decode(data[i:i + chunk_size]) for i in xrange(0, len(data), chunk_size)]
+    return ''.join(parts) + decoder.flush()
+
+
+class FakeResponse(object):
+    """
+    minimal response object with read(amt)/getheader/close
+    """
+    def __init__(self, body, headers=None):
+        self.body = StringIO.StringIO(body)
+        self.headers = headers or {}
+        self.closed = False
+
+
+    def read(self, amt=None):
+        return self.body.read(amt)
+
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+
+    def close(self):
+        self.closed = True
+
+
+class TestCompression(unittest.TestCase):
+    """
+    Unit Test class of content decoding
+    """
+    def test_decode(self):
+        """
+        gzip, zlib and raw deflate bodies are decoded chunk by chunk
+        """
+        for encoding, data in (('gzip', gzip_compress(HTML)),
+                               ('deflate', zlib.compress(HTML)),
+                               ('deflate', raw_deflate(HTML)),
+                               (None, HTML)):
+            decoder = compression.ContentDecoder(encoding, 1000000)
+            self.assertEqual(decode_in_chunks(decoder, data), HTML)
+            self.assertEqual((decoder.wire_size, decoder.decoded_size), (len(data), len(HTML)))
+        self.assertRaises(IOError, compression.ContentDecoder, 'compress', 1000)
+        decoder = compression.ContentDecoder('gzip', 1000)
+        self.assertRaises(IOError, decoder.decode, 'not gzip data')
+
+
+    def test_deflate_short_chunks(self):
+        """
+        the zlib header is detected when the first chunks are shorter than 2 bytes
+        """
+        for data in (zlib.compress(HTML), raw_deflate(HTML)):
+            decoder = compression.ContentDecoder('deflate', 1000000)
+            self.assertEqual(decode_in_chunks(decoder, data, 1), HTML)
+            decoder = compression.ContentDecoder('deflate', 1000000)
+            self.assertEqual(decoder.decode(data[:1]), '')
+            self.assertEqual(decoder.decode(data[1:]) + decoder.flush(), HTML)
+        decoder = compression.ContentDecoder('deflate', 1000000)
+        self.assertEqual(decoder.flush(), '')
+
+
+    def test_zip_bomb(self):
+        """
+        decoding stops once the decoded size exceeds the limit
+        """
+        bomb = gzip_compress('\0' * (10 * 1024 * 1024))
+        decoder = compression.ContentDecoder('gzip', 100000)
+        self.assertRaises(compression.BodyTooLargeError, decode_in_chunks, decoder, bomb, 4096)
+        self.assertTrue(decoder.decoded_size <= 100000 + compression.DECODE_CHUNK_SIZE)
+
+
+    def test_iter_body(self):
+        """
+        iter_body yields decoded data and enforces the limit on decoded size
+        """
+        data = gzip_compress(HTML)
+        response = FakeResponse(data, {'content-encoding': 'gzip',
+                                       'content-length': str(len(data))})
+        self.assertEqual(downloader.read_body(response, 1000000), HTML)
+        self.assertTrue(response.closed)
+        response = FakeResponse(data, {'content-encoding': 'gzip'})
+        self.assertRaises(downloader.BodyTooLargeError, downloader.read_body,
+                          response, len(HTML) - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,9 @@ Author: guiyilin(yilin.gui@gmail.com)
 Date: 2020-11-02 23:41:00
 """
 
+import os
+import shutil
+import tempfile
 import unittest
 import sys
 
@@ -52,6 +55,39 @@ class TestConfigLoader(unittest.TestCase):
         self.assertEqual(self.conf_loader.get_try_times(), 3)
 
 
+    def test_optional_defaults(self):
+        """
+        check default values of optional configs
+        """
+        self.assertTrue(self.conf_loader.initialize())
+
+        self.assertEqual(self.conf_loader.get_seen_store(), 'memory')
+        self.assertEqual(self.conf_loader.get_bloom_error_rate(), 0.001)
+        self.assertEqual(self.conf_loader.get_bloom_initial_capacity(), 100000)
+
+
+    def test_async_ignored_options(self):
+        """
+        thread engine only options set with engine = async are reported
+        """
+        conf_dir = tempfile.mkdtemp()
+        try:
+            conf_path = os.path.join(conf_dir, 'spider.conf')
+            with open('./spider.conf') as f:
+                content = f.read()
+            with open(conf_path, 'w') as f:
+                f.write(content + 'engine = async\nparse_processes = 2\n'
+                        'http_cache_path = ./cache.db\nmax_conn_total = 0\n')
+            conf_loader = config_loader.ConfigLoader(conf_path)
+            self.assertTrue(conf_loader.initialize())
+            self.assertEqual(conf_loader.get_ignored_options(),
+                             ['parse_processes', 'http_cache_path'])
+            self.assertTrue(self.conf_loader.initialize())
+            self.assertEqual(self.conf_loader.get_ignored_options(), [])
+        finally:
+            shutil.rmtree(conf_dir)
+
+
     def tearDown(self):
         self.conf_loader = None
 
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_connection_pool.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import BaseHTTPServer
+import SocketServer
+import threading
+import unittest
+import urllib2
+import sys
+
+sys.path.append('../')
+import connection_pool
+
+class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    HTTP/1.1 handler serving a page, a redirect and a 404
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/page')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path != '/page':
+            self.send_error(404)
+            return
+        body = 'hello'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TestConnectionPool(unittest.TestCase):
+    """
+    Unit Test class of ConnectionPool
+    """
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.setDaemon(True)
+        self.server_thread.start()
+        self.pool = connection_pool.ConnectionPool(max_per_host=2, max_total=4)
+
+
+    def test_keep_alive_reuse(self):
+        """
+        consecutive requests to one host reuse the connection
+        """
+        for _ in xrange(3):
+            response = self.pool.urlopen(self.base_url + '/page', 2)
+            self.assertEqual(response.read(), 'hello')
+        self.assertEqual(self.pool.request_num, 3)
+        self.assertEqual(self.pool.reused_num, 2)
+        self.assertEqual(self.pool.total_conns, 1)
+
+
+    def test_redirect(self):
+        """
+        redirects are followed over the same connection
+        """
+        response = self.pool.urlopen(self.base_url + '/redirect', 2)
+        self.assertEqual(response.read(), 'hello')
+        self.assertEqual(response.geturl(), self.base_url + '/page')
+
+
+    def test_http_error(self):
+        """
+        status >= 400 raises urllib2.HTTPError
+        """
+        self.assertRaises(urllib2.HTTPError, self.pool.urlopen, self.base_url + '/missing', 2)
+
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_crawl_thread.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import BaseHTTPServer
+import SocketServer
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+import sys
+
+sys.path.append('../')
+import connection_pool
+import crawl_thread
+import target_store
+import url_object
+
+
+class StubFrontier(object):
+    """
+    process_request / process_response stubs, url 取完后返回 None 使线程退出
+    """
+    def __init__(self, urls):
+        self.url_objs = [url_object.Url(url) for url in urls]
+        self.responses = []
+
+
+    def process_request(self):
+        if not self.url_objs:
+            return None
+        return self.url_objs.pop(0)
+
+
+    def process_response(self, url_obj, flag, extract_url_list=None, fingerprint=None):
+        self.responses.append((url_obj.get_url(), flag))
+
+
+class TargetHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    HTTP/1.1 handler serving /img.png, 其余路径返回 404
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path != '/img.png':
+            self.send_error(404)
+            return
+        body = 'PNG' * 100
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class StubRobotsCache(object):
+    """
+    robots cache disallowing every url
+    """
+    def allowed(self, url):
+        return False
+
+
+class StubAdaptive(object):
+    """
+    adaptive controller whose hosts are all given up
+    """
+    def is_given_up(self, url):
+        return True
+
+
+def make_args_dict(output_dir, **kwargs):
+    args_dict = {'output_dir': output_dir,
+                 'target_store': target_store.create_target_store('flat', output_dir),
+                 'crawl_interval': 0,
+                 'crawl_timeout': 5,
+                 'url_pattern': re.compile(r'.*\.(gif|png|jpg|bmp)$'),
+                 'max_depth': 2,
+                 'tag_dict': {'a': 'href', 'img': 'src'},
+                 'try_times': 1,
+                 'conn_pool': None,
+                 'max_body_size': 1024 * 1024,
+                 'parser': 'html5lib',
+                 'parse_pool': None,
+                 'http_cache': None,
+                 'with_fingerprint': False,
+                 'robots_cache': None,
+                 'adaptive': None}
+    args_dict.update(kwargs)
+    return args_dict
+
+
+class TestCrawlerThread(unittest.TestCase):
+    """
+    Unit Test class of CrawlerThread
+    """
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+
+    def make_thread(self, frontier, crawl):
+        thread = crawl_thread.CrawlerThread('thread - test', frontier.process_request,
+                                            frontier.process_response,
+                                            make_args_dict(self.output_dir))
+        thread.crawl = crawl
+        return thread
+
+
+    def run_thread(self, thread):
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+
+
+    def test_unexpected_error(self):
+        """
+        an unexpected exception is counted as a failure and the thread goes on
+        """
+        frontier = StubFrontier(['http://a.com/1.html', 'http://a.com/2.html'])
+
+        def crawl(url_obj):
+            if url_obj.get_url().endswith('1.html'):
+                raise AttributeError('parser bug')
+            frontier.process_response(url_obj, 0, [])
+
+        self.run_thread(self.make_thread(frontier, crawl))
+        self.assertEqual(frontier.responses, [('http://a.com/1.html', -1),
+                                              ('http://a.com/2.html', 0)])
+
+
+    def test_error_after_response(self):
+        """
+        a url already passed to process_response is not counted again
+        """
+        frontier = StubFrontier(['http://a.com/1.html'])
+
+        def crawl(url_obj):
+            thread.process_response(url_obj, 0, [])
+            raise ValueError('after response')
+
+        thread = self.make_thread(frontier, crawl)
+        self.run_thread(thread)
+        self.assertEqual(frontier.responses, [('http://a.com/1.html', 0)])
+
+
+
+    def test_response_error(self):
+        """
+        an error raised by process_response itself is not reported again
+        """
+        frontier = StubFrontier(['http://a.com/1.html', 'http://a.com/2.html'])
+        process_response = frontier.process_response
+
+        def failing_process_response(url_obj, flag, extract_url_list=None, fingerprint=None):
+            process_response(url_obj, flag, extract_url_list, fingerprint)
+            if url_obj.get_url().endswith('1.html'):
+                raise IOError('journal write failed')
+
+        frontier.process_response = failing_process_response
+
+        def crawl(url_obj):
+            thread.process_response(url_obj, 0, [])
+
+        thread = self.make_thread(frontier, crawl)
+        self.run_thread(thread)
+        self.assertEqual(frontier.responses, [('http://a.com/1.html', 0),
+                                              ('http://a.com/2.html', 0)])
+
+
+class TestTargetThread(unittest.TestCase):
+    """
+    Unit Test class of TargetThread against a local server
+    """
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), TargetHandler)
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        server_thread = threading.Thread(target=self.server.serve_forever)
+        server_thread.setDaemon(True)
+        server_thread.start()
+        self.output_dir = tempfile.mkdtemp()
+        self.conn_pool = connection_pool.ConnectionPool()
+
+
+    def tearDown(self):
+        self.conn_pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+
+    def run_lane(self, paths, **kwargs):
+        """
+        run a TargetThread over paths and return the flags and the target store
+        """
+        frontier = StubFrontier([self.base_url + path for path in paths])
+        args_dict = make_args_dict(self.output_dir, conn_pool=self.conn_pool, **kwargs)
+        thread = crawl_thread.TargetThread('target thread - test', frontier.process_request,
+                                           frontier.process_response, args_dict)
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        flags = [(url[len(self.base_url):], flag) for url, flag in frontier.responses]
+        return flags, args_dict['target_store']
+
+
+    def test_save_target(self):
+        """
+        targets are saved into the target store, a missing target is a failure
+        """
+        flags, store = self.run_lane(['/img.png', '/missing.png'])
+        self.assertEqual(flags, [('/img.png', 1), ('/missing.png', -1)])
+        self.assertTrue(store.exists(self.base_url + '/img.png'))
+        self.assertFalse(store.exists(self.base_url + '/missing.png'))
+
+
+    def test_robots_disallowed(self):
+        """
+        a target disallowed by robots.txt is not requested
+        """
+        flags, store = self.run_lane(['/img.png'], robots_cache=StubRobotsCache())
+        self.assertEqual(flags, [('/img.png', 3)])
+        self.assertFalse(store.exists(self.base_url + '/img.png'))
+
+
+    def test_given_up(self):
+        """
+        a target on a given up host fails without a request
+        """
+        flags, store = self.run_lane(['/img.png'], adaptive=StubAdaptive())
+        self.assertEqual(flags, [('/img.png', -1)])
+        self.assertFalse(store.exists(self.base_url + '/img.png'))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_dns_cache.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import socket
+import threading
+import time
+import unittest
+import sys
+
+sys.path.append('../')
+import dns_cache
+
+class FakeResolver(object):
+    """
+    getaddrinfo replacement counting calls
+    """
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+
+
+    def __call__(self, host, port, family, socktype):
+        with self.lock:
+            self.calls.append(host)
+        time.sleep(self.delay)
+        if host.endswith('.invalid'):
+            raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+        return [(socket.AF_INET, socktype, 6, '', ('10.0.0.1', port))]
+
+
+class TestDnsCache(unittest.TestCase):
+    """
+    Unit Test class of DnsCache
+    """
+    def test_ttl(self):
+        """
+        results are cached until ttl expires
+        """
+        now = [100.0]
+        resolver = FakeResolver()
+        cache = dns_cache.DnsCache(ttl=60, resolver=resolver, clock=lambda: now[0])
+        self.assertEqual(cache.resolve('a.com', 80)[0][4], ('10.0.0.1', 80))
+        cache.resolve('a.com', 80)
+        self.assertEqual(resolver.calls, ['a.com'])
+        now[0] += 61
+        cache.resolve('a.com', 80)
+        self.assertEqual(resolver.calls, ['a.com', 'a.com'])
+        self.assertEqual((cache.hit_num, cache.miss_num), (1, 2))
+
+
+    def test_negative_cache(self):
+        """
+        failures are cached for negative_ttl
+        """
+        now = [100.0]
+        resolver = FakeResolver()
+        cache = dns_cache.DnsCache(negative_ttl=10, resolver=resolver, clock=lambda: now[0])
+        for _ in xrange(3):
+            self.assertRaises(socket.gaierror, cache.resolve, 'x.invalid', 80)
+        self.assertEqual(len(resolver.calls), 1)
+        self.assertEqual(cache.negative_hit_num, 2)
+        now[0] += 11
+        self.assertRaises(socket.gaierror, cache.resolve, 'x.invalid', 80)
+        self.assertEqual(len(resolver.calls), 2)
+
+
+    def test_concurrent_misses(self):
+        """
+        concurrent lookups of one host resolve only once
+        """
+        resolver = FakeResolver(delay=0.1)
+        cache = dns_cache.DnsCache(resolver=resolver)
+        threads = [threading.Thread(target=cache.resolve, args=('a.com', 80))
+                   for _ in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(resolver.calls, ['a.com'])
+        self.assertEqual(cache.hit_num, 7)
+
+
+    def test_prefetch(self):
+        """
+        hosts of extracted links are resolved in background
+        """
+        resolver = FakeResolver()
+        cache = dns_cache.DnsCache(resolver=resolver, prefetch_threads=1)
+        cache.prefetch(['http://a.com/1', 'http://a.com/2', 'https://b.com/', 'ftp://c.com/'])
+        for _ in xrange(100):
+            if cache.prefetch_num == 2 and not cache.pending:
+                break
+            time.sleep(0.01)
+        self.assertEqual(sorted(resolver.calls), ['a.com', 'b.com'])
+        self.assertEqual(cache.resolve('b.com', 443)[0][4], ('10.0.0.1', 443))
+        self.assertEqual(cache.hit_num, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
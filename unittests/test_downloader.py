@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_downloader.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+import sys
+
+sys.path.append('../')
+import downloader
+
+class FakeResponse(object):
+    """
+    minimal response object with read(amt)/getheader/close
+    """
+    def __init__(self, body, headers=None):
+        self.body = StringIO.StringIO(body)
+        self.headers = headers or {}
+        self.closed = False
+
+
+    def read(self, amt=None):
+        return self.body.read(amt)
+
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+
+    def close(self):
+        self.closed = True
+
+
+class TestDownloader(unittest.TestCase):
+    """
+    Unit Test class of streaming body helpers
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+
+    def test_read_body(self):
+        """
+        body is read in chunks and the response is closed
+        """
+        response = FakeResponse('x' * 200000)
+        self.assertEqual(len(downloader.read_body(response, 300000)), 200000)
+        self.assertTrue(response.closed)
+
+
+    def test_body_too_large(self):
+        """
+        oversized bodies are aborted by Content-Length or while reading
+        """
+        response = FakeResponse('x' * 100, {'content-length': '100'})
+        self.assertRaises(downloader.BodyTooLargeError, downloader.read_body, response, 10)
+        response = FakeResponse('x' * 200000)
+        self.assertRaises(downloader.BodyTooLargeError, downloader.read_body, response, 100000)
+        self.assertTrue(response.closed)
+
+
+    def test_save_body_atomic(self):
+        """
+        target file appears only when the whole body was saved
+        """
+        target_path = os.path.join(self.tmp_dir, 'target')
+        downloader.save_body(FakeResponse('data'), target_path)
+        with open(target_path, 'rb') as f:
+            self.assertEqual(f.read(), 'data')
+
+        failed_path = os.path.join(self.tmp_dir, 'failed')
+        self.assertRaises(downloader.BodyTooLargeError, downloader.save_body,
+                          FakeResponse('x' * 200000), failed_path, 100000)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['target'])
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_html_parser.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import unittest
+import sys
+
+sys.path.append('../')
+import html_parser
+
+TAG_DICT = {'a': 'href', 'img': 'src', 'link': 'href', 'script': 'src'}
+PAGE = '''<html><head><meta charset="utf-8"><link href="/a.css" rel="stylesheet">
+<script src="app.js"></script></head><body>
+<a href="page.html?x=1&amp;y=2">链接</a><img src="/img/1.png"><img alt="no src">
+<a href="javascript:void(0)">js</a><a href="http://other.com/z">z</a>
+</body></html>'''
+EXPECTED = set(['http://a.com/a.css', 'http://a.com/dir/app.js',
+                'http://a.com/dir/page.html?x=1&y=2', 'http://a.com/img/1.png',
+                'http://other.com/z'])
+
+
+class TestHtmlParser(unittest.TestCase):
+    """
+    Unit Test class of HtmlParser
+    """
+    def test_backends_agree(self):
+        """
+        all available backends extract the same link set
+        """
+        for backend in html_parser.PARSER_BACKENDS:
+            if backend == 'lxml' and html_parser.lxml is None:
+                continue
+            parser = html_parser.HtmlParser(PAGE, TAG_DICT, 'http://a.com/dir/index.html', backend)
+            self.assertEqual(set(parser.extract_url()), EXPECTED, backend)
+
+
+
+    def test_encoding_sources(self):
+        """
+        encoding is resolved from header, BOM, meta and finally chardet
+        """
+        cases = [(PAGE, 'gbk', 'gb18030', 'header'),
+                 ('\xef\xbb\xbf<html></html>', None, 'utf-8', 'bom'),
+                 (PAGE, None, 'utf-8', 'meta'),
+                 (PAGE, 'no-such-charset', 'utf-8', 'meta'),
+                 ('<html>plain ascii</html>', None, 'ascii', 'chardet'),
+                 (u'<html></html>', None, 'unicode', 'unicode')]
+        for content, charset, encoding, source in cases:
+            parser = html_parser.HtmlParser(content, TAG_DICT, 'http://a.com/', charset=charset)
+            self.assertEqual(parser.detect_encoding(), encoding)
+            self.assertEqual(parser.encoding_source, source)
+
+
+    def test_parse_charset(self):
+        """
+        charset is parsed from Content-Type header
+        """
+        self.assertEqual(html_parser.parse_charset('text/html; charset="GBK"'), 'GBK')
+        self.assertEqual(html_parser.parse_charset('text/html'), None)
+        self.assertEqual(html_parser.parse_charset(None), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_http_cache.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import sys
+
+sys.path.append('../')
+import http_cache
+
+class TestHttpCache(unittest.TestCase):
+    """
+    Unit Test class of HttpCache
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'cache.db')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+    def test_persist_across_runs(self):
+        """
+        validators and links survive reopening the cache
+        """
+        cache = http_cache.HttpCache(self.path)
+        cache.store('http://a.com/', '"v1"', 'Mon, 02 Nov 2020 23:41:00 GMT', 'abc', 100,
+                    ['http://a.com/1', u'http://a.com/中'])
+        cache.store('http://a.com/1.png', None, None, 'def', 10)
+        cache.close()
+
+        cache = http_cache.HttpCache(self.path)
+        entry = cache.get('http://a.com/')
+        self.assertEqual(entry.links, [u'http://a.com/1', u'http://a.com/中'])
+        self.assertEqual(http_cache.HttpCache.conditional_headers(entry),
+                         {'If-None-Match': '"v1"',
+                          'If-Modified-Since': 'Mon, 02 Nov 2020 23:41:00 GMT'})
+        # 没有校验器的响应不缓存
+        self.assertTrue(cache.get('http://a.com/1.png') is None)
+        self.assertEqual(http_cache.HttpCache.conditional_headers(None), {})
+
+        cache.record_hit(entry)
+        self.assertEqual(cache.bytes_saved, 100)
+        self.assertEqual(cache.hit_ratio(), 0.5)
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_log.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import Queue
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+import sys
+
+sys.path.append('../')
+import log
+
+class TestLog(unittest.TestCase):
+    """
+    Unit Test class of async logging and rate limit
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+    def make_record(self, msg, args=(), lineno=10, level=logging.INFO):
+        return logging.LogRecord('test', level, 'crawl_thread.py', lineno, msg, args, None)
+
+
+    def test_rate_limit(self):
+        """
+        each call site is limited separately and suppressed count is reported
+        """
+        now = [100.0]
+        rate_filter = log.RateLimitFilter(2, clock=lambda: now[0])
+        passed = [rate_filter.filter(self.make_record('url %s', (i,))) for i in xrange(5)]
+        self.assertEqual(passed, [True, True, False, False, False])
+        self.assertTrue(rate_filter.filter(self.make_record('other site', lineno=20)))
+        self.assertTrue(rate_filter.filter(self.make_record('error', level=logging.ERROR)))
+        self.assertEqual(rate_filter.suppressed_num, 3)
+
+        now[0] += 1.0
+        record = self.make_record('url %s', (5,))
+        self.assertTrue(rate_filter.filter(record))
+        self.assertEqual(record.getMessage(), 'url 5 (3 similar messages suppressed)')
+
+
+    def test_async_writer(self):
+        """
+        queued records are all written by the writer thread in order
+        """
+        handler = log.BatchRotatingFileHandler(os.path.join(self.tmp_dir, 'a.log'))
+        handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        queue_handler = log.QueueHandler(Queue.Queue())
+        writer = log.LogWriter(queue_handler.queue, handler, batch_size=7)
+        writer.start()
+        args = [0]
+        for i in xrange(100):
+            args[0] = i
+            queue_handler.handle(self.make_record(u'页面 %s', tuple(args)))
+            # 参数在入队时已合并，之后的修改不影响输出
+            args[0] = -1
+        writer.stop()
+        handler.close()
+
+        with open(os.path.join(self.tmp_dir, 'a.log')) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 100)
+        self.assertEqual(lines[0], 'INFO 页面 0')
+        self.assertEqual(lines[-1], 'INFO 页面 99')
+
+
+    def test_child_log(self):
+        """
+        a forked child writes directly to the log file instead of the unconsumed queue
+        """
+        logger = logging.getLogger()
+        saved = (logger.handlers[:], logger.level)
+        log_path = os.path.join(self.tmp_dir, 'log', 'spider')
+        try:
+            log.init_log(log_path, async_mode=True, format='%(message)s')
+            pid = os.fork()
+            if pid == 0:
+                log.init_child_log()
+                logging.info('from child')
+                os._exit(0)
+            os.waitpid(pid, 0)
+            logging.info('from parent')
+            log.shutdown_log()
+        finally:
+            logger.handlers, logger.level = saved
+        with open(log_path + '.log') as f:
+            self.assertEqual(sorted(f.read().splitlines()), ['from child', 'from parent'])
+
+
+if __name__ == '__main__':
+    unittest.main()
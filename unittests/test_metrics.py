@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_metrics.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import json
+import threading
+import unittest
+import urllib2
+import sys
+
+sys.path.append('../')
+import metrics
+
+class TestMetrics(unittest.TestCase):
+    """
+    Unit Test class of metrics registry
+    """
+    def test_histogram_quantile(self):
+        """
+        quantiles are estimated within a factor of 2
+        """
+        histogram = metrics.Histogram()
+        for i in xrange(1, 101):
+            histogram.observe(i / 100.0)
+        self.assertEqual(histogram.count, 100)
+        self.assertTrue(0.5 <= histogram.quantile(0.5) <= 1.0)
+        self.assertEqual(histogram.quantile(1.0), 1.0)
+        self.assertAlmostEqual(histogram.summary()['mean'], 0.505)
+
+
+    def test_shards_are_merged(self):
+        """
+        counters written by several threads are merged in snapshot
+        """
+        registry = metrics.Metrics()
+
+        def work():
+            for _ in xrange(1000):
+                registry.incr('pages')
+                registry.observe('parse_time', 0.01)
+            registry.incr('host_requests', 2, label='a.com')
+            registry.incr('host_errors', label='a.com')
+
+        threads = [threading.Thread(target=work) for _ in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        registry.register_gauge('frontier_size', lambda: 7)
+
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['counters']['pages'], 4000)
+        self.assertEqual(snapshot['histograms']['parse_time']['count'], 4000)
+        self.assertEqual(snapshot['gauges']['frontier_size'], 7)
+        self.assertEqual(metrics.host_error_rates(snapshot)['a.com'], (8, 4, 0.5))
+        self.assertTrue('frontier_size=7' in metrics.format_stats(snapshot))
+
+
+    def test_stats_server(self):
+        """
+        the stats endpoint serves snapshots as json
+        """
+        registry = metrics.Metrics()
+        registry.incr('pages', 3)
+        server = metrics.start_stats_server(registry, 0)
+        try:
+            url = 'http://127.0.0.1:%d/stats' % server.server_address[1]
+            snapshot = json.loads(urllib2.urlopen(url, timeout=5).read())
+            self.assertEqual(snapshot['counters']['pages'], 3)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
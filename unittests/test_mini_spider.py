@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_mini_spider.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import BaseHTTPServer
+import SocketServer
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import sys
+
+sys.path.append('../')
+import mini_spider
+import url_object
+
+
+PAGES = {
+    '/index.html': '<a href="/a.html">a</a><img src="/img.png"><img src="/missing.png">',
+    '/a.html': '<img src="/a.png"><a href="/index.html">home</a>',
+    '/img.png': 'PNG' * 100,
+    '/a.png': 'PNG' * 100,
+}
+
+
+class SiteHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    HTTP/1.1 handler serving PAGES
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = PAGES.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class RecordHandler(logging.Handler):
+    """
+    logging handler keeping formatted messages
+    """
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestMiniSpider(unittest.TestCase):
+    """
+    Unit Test class of MiniSpider against a local site
+    """
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), SiteHandler)
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        server_thread = threading.Thread(target=self.server.serve_forever)
+        server_thread.setDaemon(True)
+        server_thread.start()
+        self.work_dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+    def make_spider(self, extra_conf='', resume=False):
+        """
+        write config and seed file into work_dir and initialize a MiniSpider
+        """
+        url_list_file = os.path.join(self.work_dir, 'urls')
+        with open(url_list_file, 'w') as f:
+            f.write(self.base_url + '/index.html\n')
+        conf_path = os.path.join(self.work_dir, 'spider.conf')
+        with open(conf_path, 'w') as f:
+            f.write('[spider]\n'
+                    'url_list_file = %s\n'
+                    'output_directory = %s\n'
+                    'max_depth = 2\n'
+                    'crawl_interval = 0\n'
+                    'crawl_timeout = 5\n'
+                    'target_url = .*.(gif|png|jpg|bmp)$\n'
+                    'thread_count = 2\n'
+                    'target_thread_count = 2\n'
+                    'try_times = 1\n' % (url_list_file, os.path.join(self.work_dir, 'output')) +
+                    extra_conf)
+        spider = mini_spider.MiniSpider(conf_path, resume)
+        self.assertTrue(spider.initialize())
+        return spider
+
+
+    def test_put_urls(self):
+        """
+        target urls go to the download lane, other urls to the HTML lane
+        """
+        spider = self.make_spider()
+        self.assertEqual((spider.checking_urls.qsize(), spider.target_urls.qsize()), (1, 0))
+        spider.put_urls([url_object.Url(self.base_url + '/a.html', 1),
+                         url_object.Url(self.base_url + '/img.png', 1),
+                         url_object.Url(self.base_url + '/a.png', 1)])
+        self.assertEqual((spider.checking_urls.qsize(), spider.target_urls.qsize()), (2, 2))
+        self.assertTrue(spider.target_urls.get().get_url().endswith('.png'))
+
+
+    def test_resume_without_checkpoint(self):
+        """
+        --resume without checkpoint_dir warns and starts from the seeds
+        """
+        handler = RecordHandler()
+        logging.getLogger().addHandler(handler)
+        try:
+            spider = self.make_spider(resume=True)
+        finally:
+            logging.getLogger().removeHandler(handler)
+        self.assertIsNone(spider.journal)
+        self.assertEqual(spider.checking_urls.qsize(), 1)
+        self.assertTrue(any('--resume is ignored' in message for message in handler.messages))
+
+
+    def test_canonical_dup_num(self):
+        """
+        only raw forms never seen before count as duplicates saved by canonicalization
+        """
+        spider = self.make_spider('canonicalize = 1\n')
+        url_obj = spider.checking_urls.get()
+        links = ['/a.html', '/a.html#x', '/a.html#x', '/./a.html', '/a.html',
+                 '/b.html#top', '/b.html#top', '/b.html']
+        spider.process_response(url_obj, 0, [self.base_url + link for link in links])
+        self.assertEqual(spider.checking_urls.qsize(), 2)
+        self.assertEqual(spider.canonical_dup_num, 2)
+
+
+    def test_process_response_threads(self):
+        """
+        concurrent process_response() keeps counters exact and enqueues each link once
+        """
+        spider = self.make_spider()
+        parents = []
+        for index in xrange(8 * 20):
+            spider.checking_urls.put(url_object.Url('http://p%d.com/' % index, 0))
+            parents.append(spider.checking_urls.get())
+        start = threading.Event()
+
+        def process(thread_index):
+            start.wait()
+            links = [self.base_url + '/%d.html' % i
+                     for i in xrange(thread_index * 50, thread_index * 50 + 200)]
+            for index in xrange(thread_index * 20, thread_index * 20 + 20):
+                flag = -1 if index % 5 == 0 else 0
+                spider.process_response(parents[index], flag, links if flag == 0 else None)
+
+        threads = [threading.Thread(target=process, args=(index,)) for index in xrange(8)]
+        check_interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            for thread in threads:
+                thread.start()
+            start.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setcheckinterval(check_interval)
+        self.assertEqual((spider.checked_num, spider.error_num), (8 * 16, 8 * 4))
+        # 种子 index.html 尚未取出，新链接 0.html ~ 549.html 各入队一次
+        link_num = 7 * 50 + 200
+        self.assertEqual(len(spider.seen_urls), link_num + 1)
+        self.assertEqual(spider.checking_urls.qsize(), link_num + 1)
+        self.assertEqual(spider.checking_urls.unfinished_tasks, link_num + 1)
+
+
+    def test_run(self):
+        """
+        both lanes drain, the HTML lane is joined before the download lane and
+        the worker threads exit
+        """
+        spider = self.make_spider()
+        joins = []
+
+        def wrap_join(name, frontier):
+            join = frontier.join
+
+            def wrapped_join():
+                join()
+                joins.append((name, spider.checking_urls.unfinished_tasks))
+            frontier.join = wrapped_join
+
+        wrap_join('checking_urls', spider.checking_urls)
+        wrap_join('target_urls', spider.target_urls)
+        spider.run()
+        self.assertEqual(joins, [('checking_urls', 0), ('target_urls', 0)])
+        # index.html, a.html, img.png, a.png 成功，missing.png 失败
+        self.assertEqual((spider.checked_num, spider.error_num), (4, 1))
+        self.assertEqual(spider.target_urls.unfinished_tasks, 0)
+        self.assertTrue(spider.target_store.exists(self.base_url + '/img.png'))
+        self.assertTrue(spider.target_store.exists(self.base_url + '/a.png'))
+        self.assertEqual([thread.name for thread in threading.enumerate()
+                          if thread.name.startswith(('thread - ', 'target thread - '))], [])
+
+
+
+    def test_run_callback_error(self):
+        """
+        a failing journal write inside the response callbacks does not block join()
+        """
+        spider = self.make_spider('checkpoint_dir = %s\n' % os.path.join(self.work_dir, 'ckpt'))
+
+        def record_done(url, flag):
+            raise IOError('disk full')
+
+        spider.journal.record_done = record_done
+        thread = threading.Thread(target=spider.run)
+        thread.setDaemon(True)
+        thread.start()
+        thread.join(30)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual((spider.checked_num, spider.error_num), (4, 1))
+        self.assertEqual(spider.checking_urls.unfinished_tasks, 0)
+        self.assertEqual(spider.target_urls.unfinished_tasks, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
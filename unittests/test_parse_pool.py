@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_parse_pool.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import unittest
+import sys
+
+sys.path.append('../')
+import parse_pool
+
+TAG_DICT = {'a': 'href', 'img': 'src', 'link': 'href', 'script': 'src'}
+
+
+class TestParsePool(unittest.TestCase):
+    """
+    Unit Test class of ParsePool
+    """
+    def test_parse_in_batches(self):
+        """
+        every submitted page gets its links back through its callback
+        """
+        pool = parse_pool.ParsePool(2, TAG_DICT, 'streaming', batch_size=4, queue_size=2)
+        results = {}
+
+        # 回调中的异常会被 ParsePool 捕获并记录，断言放在测试线程中
+        def make_callback(index):
+            def callback(extract_url_list, fingerprint):
+                results[index] = (extract_url_list, fingerprint)
+            return callback
+
+        for index in xrange(10):
+            page = '<html><body><a href="/p%d.html">p</a></body></html>' % index
+            pool.submit(page, 'http://a.com/', 'utf-8', make_callback(index))
+        # close 等待所有批次完成，回调在此之前都已执行
+        pool.close()
+
+        self.assertEqual(sorted(results), range(10))
+        for index in xrange(10):
+            # 页面文本太短，不计算指纹
+            self.assertEqual(results[index], (['http://a.com/p%d.html' % index], None))
+
+
+if __name__ == '__main__':
+    unittest.main()
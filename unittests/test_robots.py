@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_robots.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import BaseHTTPServer
+import SocketServer
+import threading
+import unittest
+import sys
+
+sys.path.append('../')
+import connection_pool
+import robots
+
+ROBOTS_TXT = """
+# comment
+User-agent: *
+Disallow: /
+
+User-agent: Googlebot
+User-agent: MiniSpider
+Disallow: /private/
+Allow: /private/public/
+Disallow: /*.pdf$
+Disallow: /search?
+Crawl-delay: 2
+"""
+
+
+class RobotsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    HTTP/1.1 handler serving robots.txt, 计数其请求次数
+    """
+    protocol_version = 'HTTP/1.1'
+    robots_requests = []
+
+    def do_GET(self):
+        if self.path != '/robots.txt':
+            self.send_error(404)
+            return
+        self.robots_requests.append(self.headers.get('user-agent'))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(ROBOTS_TXT)))
+        self.end_headers()
+        self.wfile.write(ROBOTS_TXT)
+
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TestRobots(unittest.TestCase):
+    """
+    Unit Test class of robots.txt rules and cache
+    """
+    def test_parse(self):
+        """
+        the MiniSpider group is used with longest-match precedence and wildcards
+        """
+        rules = robots.parse(ROBOTS_TXT)
+        self.assertEqual(rules.crawl_delay, 2.0)
+        self.assertTrue(rules.allowed('/index.html'))
+        self.assertFalse(rules.allowed('/private/a.html'))
+        self.assertTrue(rules.allowed('/private/public/a.html'))
+        self.assertFalse(rules.allowed('/docs/a.pdf'))
+        self.assertTrue(rules.allowed('/docs/a.pdf.html'))
+        self.assertFalse(rules.allowed('/search?q=1'))
+        self.assertTrue(rules.allowed('/search'))
+        # 其它爬虫使用 * 分组
+        self.assertFalse(robots.parse(ROBOTS_TXT, 'otherbot').allowed('/index.html'))
+        self.assertTrue(robots.parse('Disallow: /\n').allowed('/'))
+        self.assertTrue(robots.parse('User-agent: *\nDisallow:\n').allowed('/'))
+
+
+    def test_failure_cache(self):
+        """
+        4xx allows everything, 5xx and network errors are cached for failure_ttl
+        """
+        now = [100.0]
+        responses = {'http://a.com/robots.txt': (404, ''),
+                     'http://b.com/robots.txt': (503, '')}
+        calls = []
+
+        def fetch(url):
+            calls.append(url)
+            if url not in responses:
+                raise IOError('connection refused')
+            return responses[url]
+
+        cache = robots.RobotsCache(fetch, ttl=1000, failure_ttl=10, clock=lambda: now[0])
+        for url in ('http://a.com/x', 'http://b.com/x', 'http://c.com/x'):
+            self.assertEqual(cache.check(url), None)
+            self.assertTrue(cache.allowed(url))
+            self.assertTrue(cache.allowed(url))
+        self.assertEqual(len(calls), 3)
+        self.assertEqual((cache.fetch_num, cache.failure_num), (3, 2))
+        now[0] += 11
+        for url in ('http://a.com/x', 'http://b.com/x', 'http://c.com/x'):
+            cache.allowed(url)
+        self.assertEqual(calls[3:], ['http://b.com/robots.txt', 'http://c.com/robots.txt'])
+
+
+    def test_local_server(self):
+        """
+        robots.txt is fetched once through the connection pool by concurrent threads
+        """
+        server = ThreadingHTTPServer(('127.0.0.1', 0), RobotsHandler)
+        base_url = 'http://127.0.0.1:%d' % server.server_address[1]
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.setDaemon(True)
+        server_thread.start()
+        pool = connection_pool.ConnectionPool()
+        delays = []
+        cache = robots.RobotsCache(robots.make_pool_fetcher(pool, 2),
+                                   on_rules=lambda url, rules: delays.append(rules.crawl_delay))
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            cache.allowed(base_url + '/private/a.html'))) for _ in xrange(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [False] * 5)
+        self.assertEqual(RobotsHandler.robots_requests, [connection_pool.USER_AGENT])
+        self.assertEqual(delays, [2.0])
+        self.assertTrue(cache.check(base_url + '/index.html'))
+        self.assertEqual(cache.blocked_num, 5)
+        pool.close()
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_scheduler.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import Queue
+import threading
+import time
+import unittest
+import sys
+
+sys.path.append('../')
+import scheduler
+import url_object
+
+class TestHostScheduler(unittest.TestCase):
+    """
+    Unit Test class of HostScheduler
+    """
+    def test_interval_is_per_host(self):
+        """
+        a slow host does not delay urls of other hosts
+        """
+        sched = scheduler.HostScheduler(10, host_intervals={'b.com': 0})
+        for url in ['http://a.com/1', 'http://a.com/2', 'http://b.com/1', 'http://b.com/2']:
+            sched.put(url_object.Url(url))
+
+        got = [sched.get(block=False).get_url() for _ in xrange(3)]
+        self.assertEqual(sorted(got), ['http://a.com/1', 'http://b.com/1', 'http://b.com/2'])
+        # a.com 需要等待 10 秒后才能再次抓取
+        self.assertRaises(Queue.Empty, sched.get, False)
+        self.assertEqual(sched.qsize(), 1)
+
+
+    def test_host_concurrency(self):
+        """
+        a host is not handed out beyond its concurrency cap
+        """
+        sched = scheduler.HostScheduler(0, default_concurrency=1)
+        sched.put(url_object.Url('http://a.com/1'))
+        sched.put(url_object.Url('http://a.com/2'))
+
+        first = sched.get(block=False)
+        self.assertRaises(Queue.Empty, sched.get, False)
+        sched.task_done(first)
+        second = sched.get(block=False)
+        self.assertEqual(second.get_url(), 'http://a.com/2')
+        sched.task_done(second)
+        self.assertEqual(sched.unfinished_tasks, 0)
+        sched.join()
+
+
+    def test_blocking_get_waits_for_ready_time(self):
+        """
+        blocking get() returns once the host becomes ready
+        """
+        sched = scheduler.HostScheduler(0.2)
+        sched.put(url_object.Url('http://a.com/1'))
+        sched.put(url_object.Url('http://a.com/2'))
+        sched.get()
+        start = time.time()
+        sched.get()
+        self.assertTrue(time.time() - start >= 0.15)
+
+
+    def test_priority_by_depth_and_score(self):
+        """
+        shallower urls first across ready hosts, then higher score
+        """
+        sched = scheduler.HostScheduler(0, scorer=lambda url_obj: len(url_obj.get_url()))
+        sched.put(url_object.Url('http://a.com/deep', 2))
+        sched.put(url_object.Url('http://b.com/1', 1))
+        sched.put(url_object.Url('http://a.com/longer', 1))
+        sched.put(url_object.Url('http://c.com/', 0))
+        got = [sched.get(block=False).get_url() for _ in xrange(4)]
+        self.assertEqual(got, ['http://c.com/', 'http://a.com/longer', 'http://b.com/1',
+                               'http://a.com/deep'])
+
+
+    def test_spill_to_disk(self):
+        """
+        urls beyond memory limit are spilled and loaded back
+        """
+        sched = scheduler.HostScheduler(0, memory_limit=2)
+        urls = ['http://a.com/%d' % i for i in xrange(5)]
+        sched.put_many([url_object.Url(url, 1) for url in urls])
+        self.assertEqual(sched.spilled_num(), 3)
+        self.assertEqual(sched.qsize(), 5)
+
+        got = []
+        for _ in xrange(5):
+            url_obj = sched.get(block=False)
+            got.append(url_obj.get_url())
+            self.assertEqual(url_obj.get_depth(), 1)
+            sched.task_done(url_obj)
+        self.assertEqual(got, urls)
+        self.assertEqual(sched.spilled_num(), 0)
+        self.assertRaises(Queue.Empty, sched.get, False)
+        sched.join()
+        sched.close()
+
+
+    def test_spill_keeps_depth_order(self):
+        """
+        a BFS crawl through a spill/refill cycle still gets urls in depth order
+        """
+        sched = scheduler.HostScheduler(0, memory_limit=4)
+        sched.put_many([url_object.Url('http://h%d.com/' % i, 0) for i in xrange(10)])
+        depths = []
+        while sched.qsize() > 0:
+            url_obj = sched.get(block=False)
+            depth = url_obj.get_depth()
+            depths.append(depth)
+            if depth < 2:
+                sched.put_many([url_object.Url('%s%d/' % (url_obj.get_url(), i), depth + 1)
+                                for i in xrange(2)])
+            sched.task_done(url_obj)
+        self.assertEqual(len(depths), 10 + 20 + 40)
+        self.assertEqual(depths, sorted(depths))
+        self.assertEqual(sched.spilled_num(), 0)
+        sched.close()
+
+
+    def test_retry_and_pause(self):
+        """
+        retried urls come back after the delay and paused hosts are skipped
+        """
+        sched = scheduler.HostScheduler(0)
+        sched.put(url_object.Url('http://a.com/1', 2))
+        sched.put(url_object.Url('http://b.com/1'))
+        url_obj = sched.get(block=False)
+        self.assertEqual(url_obj.get_url(), 'http://b.com/1')
+        sched.retry(url_obj, 0.1)
+        sched.pause('a.com', time.time() + 0.2)
+        self.assertRaises(Queue.Empty, sched.get, False)
+        self.assertEqual(sched.unfinished_tasks, 2)
+
+        start = time.time()
+        retried = sched.get()
+        self.assertTrue(time.time() - start >= 0.05)
+        self.assertEqual((retried.get_url(), retried.get_retry_num()), ('http://b.com/1', 1))
+        sched.task_done(retried)
+        resumed = sched.get()
+        self.assertTrue(time.time() - start >= 0.15)
+        self.assertEqual(resumed.get_depth(), 2)
+        sched.task_done(resumed)
+        sched.join()
+
+
+    def test_stop(self):
+        """
+        stop wakes up a blocked get, which then returns None, and notifies listeners
+        """
+        sched = scheduler.HostScheduler(0)
+        notified = []
+        sched.add_listener(lambda: notified.append(1))
+        results = []
+        thread = threading.Thread(target=lambda: results.append(sched.get()))
+        thread.start()
+        time.sleep(0.05)
+        sched.stop()
+        thread.join(5)
+        self.assertEqual(results, [None])
+        self.assertTrue(notified)
+        sched.put(url_object.Url('http://a.com/1'))
+        self.assertEqual(sched.get(), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_seen_store.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import collections
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import sys
+
+sys.path.append('../')
+import seen_store
+
+class TestSeenStore(unittest.TestCase):
+    """
+    Unit Test class of seen stores
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+
+    def check_store(self, store):
+        """
+        common checks for all backends
+        """
+        self.assertTrue(store.add('http://a.com/x'))
+        self.assertFalse(store.add('http://a.com/x'))
+        self.assertTrue(store.add(u'http://a.com/中'))
+        self.assertTrue('http://a.com/x' in store)
+        self.assertFalse('http://a.com/y' in store)
+        self.assertEqual(len(store), 2)
+        self.assertTrue(store.memory_usage() > 0)
+        store.close()
+
+
+    def test_memory_store(self):
+        """
+        check memory backend
+        """
+        self.check_store(seen_store.create_seen_store('memory'))
+
+
+    def test_memory_store_threads(self):
+        """
+        concurrent add() of overlapping urls returns True exactly once per url
+        """
+        store = seen_store.create_seen_store('memory')
+        start = threading.Event()
+        results = [[] for _ in xrange(8)]
+
+        def add_urls(index):
+            start.wait()
+            for i in xrange(index * 500, index * 500 + 2000):
+                results[index].append((i, store.add('http://a.com/%d' % i)))
+
+        threads = [threading.Thread(target=add_urls, args=(index,)) for index in xrange(8)]
+        check_interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            for thread in threads:
+                thread.start()
+            start.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setcheckinterval(check_interval)
+        added = collections.Counter(i for result in results for i, is_new in result if is_new)
+        self.assertEqual(sorted(added), range(7 * 500 + 2000))
+        self.assertEqual(set(added.values()), set([1]))
+        self.assertEqual(len(store), 7 * 500 + 2000)
+
+
+    def test_bloom_store(self):
+        """
+        check bloom backend, including growth beyond the initial capacity
+        """
+        self.check_store(seen_store.create_seen_store('bloom', initial_capacity=10))
+
+        store = seen_store.BloomSeenStore(error_rate=0.01, initial_capacity=100)
+        for i in xrange(1000):
+            store.add('http://a.com/%d' % i)
+        self.assertTrue(len(store.filters) > 1)
+        for i in xrange(1000):
+            self.assertTrue('http://a.com/%d' % i in store)
+
+
+    def test_sqlite_store(self):
+        """
+        check sqlite backend
+        """
+        path = os.path.join(self.tmp_dir, 'seen.db')
+        self.check_store(seen_store.create_seen_store('sqlite', path=path))
+
+        store = seen_store.create_seen_store('sqlite', path=path, reset=False)
+        self.assertTrue('http://a.com/x' in store)
+        store.close()
+
+
+    def test_unknown_backend(self):
+        """
+        check unknown backend name
+        """
+        self.assertRaises(ValueError, seen_store.create_seen_store, 'redis')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
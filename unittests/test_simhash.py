@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_simhash.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import hashlib
+import random
+import struct
+import unittest
+import sys
+
+sys.path.append('../')
+import html_parser
+import simhash
+
+def make_text(seed, num=300):
+    rng = random.Random(seed)
+    return ' '.join('w%d' % rng.randint(0, 2000) for _ in xrange(num))
+
+
+class TestSimHash(unittest.TestCase):
+    """
+    Unit Test class of simhash fingerprint and index
+    """
+    def test_fingerprint(self):
+        """
+        near-identical pages get close fingerprints, unrelated pages do not
+        """
+        text = make_text(1)
+        page = '<html><head><script>var a = 1;</script></head><body><p>%s</p></body></html>'
+        a = simhash.fingerprint(page % text)
+        # 标签和脚本不影响指纹
+        self.assertEqual(a, simhash.fingerprint(text))
+        words = text.split()
+        words[150] = 'changed'
+        b = simhash.fingerprint(page % ' '.join(words))
+        c = simhash.fingerprint(page % make_text(2))
+        self.assertTrue(simhash.hamming_distance(a, b) <= 3)
+        self.assertTrue(simhash.hamming_distance(a, c) > 10)
+        self.assertEqual(simhash.fingerprint(u'<p>太短的页面</p>'), None)
+
+
+    def test_compute_matches_definition(self):
+        """
+        lane-packed bit counting equals the textbook +1/-1 vector
+        """
+        features = [str(i) for i in xrange(100)]
+        expected = 0
+        for bit in xrange(simhash.FINGERPRINT_BITS):
+            votes = 0
+            for feature in features:
+                # md5 的前 8 个字节按小端序组成整数
+                value = struct.unpack('<Q', hashlib.md5(feature).digest()[:8])[0]
+                votes += 1 if (value >> bit) & 1 else -1
+            if votes > 0:
+                expected |= 1 << bit
+        self.assertEqual(simhash.compute(features), expected)
+
+
+    def test_index(self):
+        """
+        index finds fingerprints within distance
+        """
+        index = simhash.SimHashIndex(3)
+        rng = random.Random(5)
+        fingerprints = [rng.getrandbits(64) for _ in xrange(1000)]
+        for fingerprint in fingerprints:
+            self.assertTrue(index.add_if_new(fingerprint))
+        for fingerprint in fingerprints[:100]:
+            near = fingerprint ^ (1 << rng.randint(0, 63)) ^ (1 << rng.randint(0, 63))
+            self.assertFalse(index.add_if_new(near))
+            far = fingerprint ^ 0xff
+            self.assertTrue(index.add_if_new(far))
+        self.assertEqual(index.size, 1100)
+
+
+    def test_parser_fingerprint(self):
+        """
+        HtmlParser computes the fingerprint while extracting links
+        """
+        text = make_text(3)
+        content = '<html><body><p>%s</p><a href="/x.html">x</a></body></html>' % text
+        for backend in ('html5lib', 'streaming'):
+            parser = html_parser.HtmlParser(content, {'a': 'href'}, 'http://a.com/', backend,
+                                            'utf-8', with_fingerprint=True)
+            self.assertEqual(parser.extract_url(), ['http://a.com/x.html'])
+            self.assertEqual(parser.fingerprint, simhash.fingerprint(content))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_target_store.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import sys
+
+sys.path.append('../')
+import target_store
+from test_downloader import FakeResponse
+
+class TestTargetStore(unittest.TestCase):
+    """
+    Unit Test class of target stores
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+    def test_flat_layout(self):
+        """
+        flat layout keeps the quote_plus file name
+        """
+        store = target_store.create_target_store('flat', self.tmp_dir)
+        url = 'http://a.com/1.png'
+        size, _ = store.save(url, FakeResponse('png'), 100)
+        self.assertEqual(size, 3)
+        self.assertTrue(store.exists(url))
+        with open(target_store.get_target_path(self.tmp_dir, url), 'rb') as f:
+            self.assertEqual(f.read(), 'png')
+
+
+    def test_cas_dedup_and_pack(self):
+        """
+        same content is stored once, small objects go into segments
+        """
+        store = target_store.create_target_store('cas', self.tmp_dir, pack_max_size=10)
+        _, hash_a = store.save('http://a.com/1.png', FakeResponse('small'), 100)
+        _, hash_b = store.save('http://b.com/2.png', FakeResponse('small'), 100)
+        _, hash_c = store.save('http://a.com/3.png', FakeResponse('x' * 50), 100)
+        self.assertEqual(hash_a, hash_b)
+        self.assertEqual((store.url_num, store.object_num, store.packed_num), (3, 2, 1))
+        self.assertEqual(store.dedup_bytes, 5)
+        self.assertTrue(os.path.isfile(store.get_object_path(hash_c)))
+        store.close()
+
+        # 重新打开后续写 segment，且索引仍然可读
+        store = target_store.create_target_store('cas', self.tmp_dir, pack_max_size=10)
+        store.save('http://a.com/4.png', FakeResponse('tiny'), 100)
+        self.assertEqual(store.read('http://b.com/2.png'), 'small')
+        self.assertEqual(store.read('http://a.com/3.png'), 'x' * 50)
+        self.assertEqual(store.read('http://a.com/4.png'), 'tiny')
+        self.assertTrue(store.exists('http://a.com/1.png'))
+        self.assertTrue(store.read('http://a.com/5.png') is None)
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
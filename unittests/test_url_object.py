@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: test_url_object.py
+Author: guiyilin(yilin.gui@gmail.com)
+Date: 2020-11-02 23:41:00
+"""
+
+import unittest
+import sys
+
+sys.path.append('../')
+import url_object
+
+class TestUrlObject(unittest.TestCase):
+    """
+    Unit Test class of Url
+    """
+    def test_getters(self):
+        """
+        check url getters
+        """
+        url_obj = url_object.Url('http://a.com/x', 2)
+        self.assertEqual(url_obj.get_url(), 'http://a.com/x')
+        self.assertEqual(url_obj.get_depth(), 2)
+
+
+    def test_hash_and_eq(self):
+        """
+        Url objects with the same url string are equal regardless of depth
+        """
+        url_a = url_object.Url('http://a.com/x', 0)
+        url_b = url_object.Url('http://a.com/x', 3)
+        url_c = url_object.Url('http://a.com/y', 0)
+        self.assertEqual(url_a, url_b)
+        self.assertNotEqual(url_a, url_c)
+        self.assertEqual(len(set([url_a, url_b, url_c])), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
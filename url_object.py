@@ -12,16 +12,18 @@ class Url(object):
     This class is used to represent a url(address + depth)
 
     Attributes:
-        url   : string of url 
-        depth : depth of the url
+        url       : string of url 
+        depth     : depth of the url
+        retry_num : 下载失败后已重新调度的次数
     """
 
-    def __init__(self, url, depth=0):
+    def __init__(self, url, depth=0, retry_num=0):
     	# Python 中的约定：
     	#   以单下划线开头的表示的是 protected 类型的变量
     	#   以双下划线开头的表示的是私有类型的变量
         self.__url = url
         self.__depth = depth
+        self.__retry_num = retry_num
 
 
     def get_url(self):
@@ -36,3 +38,33 @@ class Url(object):
         get url depth
         """
         return self.__depth
+
+
+    def get_retry_num(self):
+        """
+        get number of retries scheduled for the url
+        """
+        return self.__retry_num
+
+
+    def __eq__(self, other):
+        """
+        two url objects are equal if their url strings are equal (depth ignored)
+        """
+        if not isinstance(other, Url):
+            return NotImplemented
+        return self.__url == other.get_url()
+
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+
+    def __hash__(self):
+        """
+        hash by url string, so that Url objects can be used in set/dict
+        """
+        return hash(self.__url)